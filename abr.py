@@ -0,0 +1,421 @@
+import atexit
+import functools
+import math
+import os
+import re
+import shutil
+import subprocess
+import time
+from collections import namedtuple
+
+from flask import Response
+
+Rendition = namedtuple('Rendition', 'name width height bitrate')
+
+DEFAULT_LADDER = '360p:640x360:800k,480p:854x480:1400k,720p:1280x720:2800k'
+LADDER_RE = re.compile(r'^([\w-]+):(\d+)x(\d+):(\d+)([km]?)$')
+AUDIO_BITRATE = 128000
+
+
+def parse_ladder(spec):
+    """Renditions from `name:WIDTHxHEIGHT:bitrate` entries, cheapest first"""
+    ladder = []
+    for entry in spec.split(','):
+        match = LADDER_RE.match(entry.strip())
+        if match is None:
+            raise ValueError(f'Bad rendition {entry!r}, expected '
+                             f'name:WIDTHxHEIGHT:bitrate')
+        name, width, height, bitrate, unit = match.groups()
+        ladder.append(Rendition(name, int(width), int(height), int(bitrate) *
+                                {'': 1, 'k': 1000, 'm': 1000000}[unit]))
+    return sorted(ladder, key=lambda r: r.width * r.height)
+
+
+class CPUMeter:
+    """Share of the machine's CPU time spent busy since the last reading"""
+
+    def __init__(self):
+        self._last = self._times()
+
+    def _times(self):
+        try:
+            with open('/proc/stat') as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle and iowait
+        return sum(fields), fields[3] + fields[4]
+
+    def read(self):
+        times = self._times()
+        if times is None or self._last is None:
+            # Not Linux: the load average is the next best thing
+            return min(os.getloadavg()[0] / os.cpu_count(), 1.0)
+        total, idle = times[0] - self._last[0], times[1] - self._last[1]
+        self._last = times
+        return 1 - idle / total if total else 0.0
+
+
+class _Transcode:
+    __slots__ = ('rendition', 'process', 'started', 'restarts', 'backoff',
+                 'restart_at')
+
+    def __init__(self, rendition):
+        self.rendition = rendition
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 1
+        self.restart_at = 0.0
+
+
+class ABRScheduler:
+    """Transcodes live streams into a ladder of HLS renditions.
+
+    Each rendition is its own ffmpeg process, reading the stream with
+    `input_args(source)` and writing media_root/live/<playback id>/<name>/,
+    with keyframes forced every `segment_time` so players can switch
+    between renditions at any segment. Separate processes cost a decode
+    each but start, stop and fail on their own. They run at `nice` so that
+    ingest and the app's event loop come first, with x264 threads to match
+    their cost.
+
+    The cheapest rendition runs for as long as a stream is published. The
+    others are offered in the master playlist and run while someone fetches
+    them: any worker marks a rendition watched in the state store, and one
+    that goes `idle_timeout` seconds without a request is stopped (a request
+    for a stopped one starts it again).
+
+    A rendition is estimated to need `decode_cost` cores to decode and scale
+    the stream plus its pixels per second over `pixels_per_core` to encode
+    (benchmarks/abr_capacity.py measures both), and renditions only start
+    while the total fits in `cpu_target` of the cores. The machine's measured CPU use adds a
+    ceiling per stream: once use has stayed above `cpu_high` for
+    `pressure_after` checks (ffmpeg starting up is a brief spike), the
+    stream spending the most loses its top rendition, and once it has stayed
+    under `cpu_low` for `recover_after` checks the most degraded stream gets
+    one back.
+    """
+
+    def __init__(self, socketio, state_store, event_log, media_root,
+                 input_args, ladder=DEFAULT_LADDER, ffmpeg='ffmpeg',
+                 preset='veryfast', fps=30, segment_time=2,
+                 pixels_per_core=84e6, decode_cost=0.14, cores=None,
+                 cpu_target=0.8,
+                 cpu_high=0.9, cpu_low=0.6, pressure_after=2, recover_after=5,
+                 idle_timeout=30,
+                 nice=10, interval=2):
+        self.socketio = socketio
+        self.state_store = state_store
+        self.event_log = event_log
+        self.media_root = media_root
+        self.input_args = input_args
+        self.ladder = parse_ladder(ladder) if isinstance(ladder, str) \
+            else ladder
+        self.ffmpeg = ffmpeg
+        self.preset = preset
+        self.fps = fps
+        self.segment_time = segment_time
+        self.pixels_per_core = pixels_per_core
+        self.decode_cost = decode_cost
+        self.cores = cores or len(os.sched_getaffinity(0))
+        self.budget = self.cores * cpu_target
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.pressure_after = pressure_after
+        self.recover_after = recover_after
+        self.idle_timeout = idle_timeout
+        self.nice = nice
+        self.interval = interval
+        self.cpu = CPUMeter()
+        self.utilization = 0.0
+        # Checks in a row above cpu_high, and under cpu_low
+        self._hot = 0
+        self._calm = 0
+        # playback ID -> {rendition name: _Transcode}, on the worker running
+        # the transcodes
+        self.streams = {}
+        # playback ID -> what input_args reads the stream from
+        self.sources = {}
+        # playback ID -> how many renditions it may use
+        self.ceilings = {}
+        self.degraded = 0
+        self.restored = 0
+        # (playback ID, rendition) -> when this worker last marked it watched
+        self._marked = {}
+        # Stopped ffmpegs that may not have exited yet: (process, when to
+        # kill it, folder to remove once it is gone)
+        self._dying = []
+        self.task = None
+        atexit.register(self.stop)
+
+    def cost(self, rendition):
+        """Estimated cores needed to transcode `rendition` in real time"""
+        return self.decode_cost + rendition.width * rendition.height * \
+            self.fps / self.pixels_per_core
+
+    def running_cost(self):
+        return sum(self.cost(t.rendition) for transcodes in
+                   self.streams.values() for t in transcodes.values()
+                   if t.process is not None)
+
+    def publish(self, playback_id, source):
+        """Start transcoding a stream that went live on this worker"""
+        self.sources[playback_id] = source
+        if playback_id not in self.streams:
+            self.streams[playback_id] = {}
+            self.ceilings[playback_id] = len(self.ladder)
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self._run)
+        self.schedule(check_cpu=False)
+
+    def unpublish(self, playback_id):
+        for transcode in self.streams.pop(playback_id, {}).values():
+            self._stop(playback_id, transcode)
+        self.ceilings.pop(playback_id, None)
+        self.sources.pop(playback_id, None)
+        self.state_store.delete(f'abr:{playback_id}')
+
+    def watched(self, playback_id, name):
+        """Note a request for one of a stream's renditions, on any worker"""
+        if not any(rendition.name == name for rendition in self.ladder):
+            return
+        now = time.monotonic()
+        key = (playback_id, name)
+        # Once per quarter of the idle timeout is enough to keep it alive
+        if now - self._marked.get(key, -self.idle_timeout) < \
+                self.idle_timeout / 4:
+            return
+        # Only for streams being transcoded
+        if not self.state_store.get(f'abr:{playback_id}'):
+            return
+        if len(self._marked) > 10000:
+            self._marked.clear()
+        self._marked[key] = now
+        self.state_store.set(f'abr_watched:{playback_id}/{name}', 1,
+                             ttl=self.idle_timeout)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.schedule()
+            except Exception as e:
+                self.event_log.error('abr_schedule_failed', error=str(e))
+
+    def schedule(self, check_cpu=True):
+        """Start, stop and restart transcodes to fit demand and the CPU.
+
+        Runs every `interval`; `check_cpu` is off for extra runs in between,
+        whose CPU reading would cover too short a time.
+        """
+        now = time.monotonic()
+        self._reap_dying(now)
+        if check_cpu:
+            self.utilization = self.cpu.read()
+            self._adjust_ceilings()
+        watched = {key[len('abr_watched:'):] for key in
+                   self.state_store.scan('abr_watched:')}
+        spent = 0.0
+        wanted = []
+        for playback_id, transcodes in self.streams.items():
+            for transcode in transcodes.values():
+                self._reap(playback_id, transcode, now)
+            for index, rendition in enumerate(self.ladder):
+                if index >= self.ceilings[playback_id]:
+                    break
+                if index == 0 or f'{playback_id}/{rendition.name}' in watched:
+                    wanted.append((index, playback_id, rendition))
+        # Every stream's cheapest rendition first, then the next rung up
+        wanted.sort(key=lambda entry: entry[0])
+        keep = set()
+        for _, playback_id, rendition in wanted:
+            cost = self.cost(rendition)
+            # A stream always gets its first rendition
+            if spent + cost > self.budget and rendition is not self.ladder[0]:
+                continue
+            spent += cost
+            keep.add((playback_id, rendition.name))
+        for playback_id, transcodes in self.streams.items():
+            for rendition in self.ladder:
+                transcode = transcodes.get(rendition.name)
+                if (playback_id, rendition.name) in keep:
+                    if transcode is None:
+                        transcode = transcodes[rendition.name] = \
+                            _Transcode(rendition)
+                    if transcode.process is None and now >= transcode.restart_at:
+                        self._start(playback_id, transcode, now)
+                elif transcode is not None:
+                    self._stop(playback_id, transcode)
+                    del transcodes[rendition.name]
+            # What the master playlist offers: what runs, and what there is
+            # room to start on request
+            offered = [r.name for i, r in enumerate(self.ladder)
+                       if (playback_id, r.name) in keep or
+                       (i < self.ceilings[playback_id] and
+                        spent + self.cost(r) <= self.budget)]
+            self.state_store.set(f'abr:{playback_id}', offered,
+                                 ttl=self.interval * 3)
+
+    def _adjust_ceilings(self):
+        if not self.streams:
+            return
+        if self.utilization > self.cpu_high:
+            self._calm = 0
+            self._hot += 1
+            if self._hot < self.pressure_after:
+                return
+            self._hot = 0
+            # The stream spending the most gives up its top rendition
+            costs = {key: sum(self.cost(t.rendition)
+                              for t in transcodes.values() if t.process)
+                     for key, transcodes in self.streams.items()
+                     if self.ceilings[key] > 1}
+            if costs:
+                key = max(costs, key=costs.get)
+                self.ceilings[key] -= 1
+                self.degraded += 1
+                self.event_log.warning(
+                    'abr_degraded', playback_id=key, cpu=self.utilization,
+                    renditions=self.ceilings[key])
+        elif self.utilization < self.cpu_low:
+            self._hot = 0
+            self._calm += 1
+            if self._calm >= self.recover_after:
+                self._calm = 0
+                key = min(self.ceilings, key=self.ceilings.get)
+                if self.ceilings[key] < len(self.ladder):
+                    self.ceilings[key] += 1
+                    self.restored += 1
+                    self.event_log.info(
+                        'abr_restored', playback_id=key, cpu=self.utilization,
+                        renditions=self.ceilings[key])
+        else:
+            self._hot = self._calm = 0
+
+    def _folder(self, playback_id, rendition):
+        return os.path.join(self.media_root, 'live', playback_id,
+                            rendition.name)
+
+    def command(self, playback_id, rendition):
+        folder = self._folder(playback_id, rendition)
+        threads = max(1, min(math.ceil(self.cost(rendition)), self.cores))
+        return [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            *self.input_args(self.sources[playback_id]),
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', self.preset,
+            '-vf', f'scale=-2:{rendition.height}',
+            '-b:v', str(rendition.bitrate),
+            '-maxrate', str(rendition.bitrate),
+            '-bufsize', str(rendition.bitrate * 2),
+            '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_time})',
+            '-sc_threshold', '0', '-threads', str(threads),
+            '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), '-ac', '2',
+            '-f', 'hls', '-hls_time', str(self.segment_time),
+            '-hls_list_size', '6', '-hls_flags', 'delete_segments+temp_file',
+            os.path.join(folder, 'index.m3u8')]
+
+    def _start(self, playback_id, transcode, now):
+        rendition = transcode.rendition
+        os.makedirs(self._folder(playback_id, rendition), exist_ok=True)
+        try:
+            transcode.process = subprocess.Popen(
+                self.command(playback_id, rendition),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=functools.partial(os.nice, self.nice))
+        except OSError as e:
+            self.event_log.error('abr_start_failed', playback_id=playback_id,
+                                 rendition=rendition.name, error=str(e))
+            self._restart_later(transcode, now)
+            return
+        transcode.started = now
+        self.event_log.info('abr_started', playback_id=playback_id,
+                            rendition=rendition.name,
+                            pid=transcode.process.pid)
+
+    def _reap(self, playback_id, transcode, now):
+        process = transcode.process
+        if process is None or process.poll() is None:
+            if process is not None and now - transcode.started > 60:
+                transcode.backoff = 1
+            return
+        self.event_log.warning('abr_exited', playback_id=playback_id,
+                               rendition=transcode.rendition.name,
+                               code=process.returncode,
+                               backoff=transcode.backoff)
+        transcode.process = None
+        self._restart_later(transcode, now)
+
+    def _restart_later(self, transcode, now):
+        transcode.restarts += 1
+        transcode.restart_at = now + transcode.backoff
+        transcode.backoff = min(transcode.backoff * 2, 30)
+
+    def _stop(self, playback_id, transcode):
+        """Stop a transcode; its files go once ffmpeg has exited, so a
+        stale playlist is never served"""
+        process, transcode.process = transcode.process, None
+        folder = self._folder(playback_id, transcode.rendition)
+        if process is not None and process.poll() is None:
+            process.terminate()
+            self._dying.append((process, time.monotonic() + 5, folder))
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+        self.event_log.info('abr_stopped', playback_id=playback_id,
+                            rendition=transcode.rendition.name)
+
+    def _reap_dying(self, now):
+        dying = []
+        for process, deadline, folder in self._dying:
+            if process.poll() is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+                continue
+            if now > deadline:
+                process.kill()
+            dying.append((process, deadline, folder))
+        self._dying = dying
+
+    def stop(self):
+        """Stop every transcode, e.g. when the app exits"""
+        for playback_id in list(self.streams):
+            self.unpublish(playback_id)
+        for process, _, folder in self._dying:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            shutil.rmtree(folder, ignore_errors=True)
+        self._dying = []
+
+    def master_playlist(self, playback_id):
+        """The master playlist of a transcoded stream, served by any worker"""
+        offered = self.state_store.get(f'abr:{playback_id}')
+        if not offered:
+            return Response('Not found', status=404)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for rendition in self.ladder:
+            if rendition.name in offered:
+                lines += [f'#EXT-X-STREAM-INF:BANDWIDTH='
+                          f'{int((rendition.bitrate + AUDIO_BITRATE) * 1.1)},'
+                          f'RESOLUTION={rendition.width}x{rendition.height}',
+                          f'{rendition.name}/index.m3u8']
+        response = Response('\n'.join(lines) + '\n',
+                            mimetype='application/vnd.apple.mpegurl')
+        # The ladder changes with demand and CPU
+        response.headers['Cache-Control'] = f'public, max-age={self.interval}'
+        return response
+
+    def stats(self):
+        return {'cores': self.cores, 'budget': round(self.budget, 2),
+                'cpu': round(self.utilization, 3),
+                'running_cost': round(self.running_cost(), 2),
+                'degraded': self.degraded, 'restored': self.restored,
+                'streams': {key: {
+                    'ceiling': self.ceilings[key],
+                    'running': [name for name, t in transcodes.items()
+                                if t.process is not None],
+                    'restarts': sum(t.restarts for t in transcodes.values())
+                } for key, transcodes in self.streams.items()}}
@@ -0,0 +1,190 @@
+import json
+import math
+import random
+import secrets
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+# Message of the refusal a waiting client gets
+WAITING_ROOM = 'waiting_room'
+
+
+class AdmissionController:
+    """Decides which new connections a worker accepts, and in what order.
+
+    Two gates, both open with limits of 0:
+
+    - New Engine.IO sessions are let in at `rate` per second (bursts of
+      `burst`) and not at all while the event loop lags more than `max_lag`
+      seconds. The rest are shed before any session or websocket exists,
+      with a 503 and a Retry-After header; the handshake is most of what a
+      connection costs, so this is where a spike has to be held back.
+    - A Socket.IO connect is accepted while fewer than `max_sessions -
+      reserve` sockets are open (and the loop keeps up). Anyone else is
+      refused with a ticket for the waiting room, their place in line and a
+      `retry_after` hint; they keep their Engine.IO connection, and
+      presenting the ticket again keeps their place. Tickets not presented
+      again within `ticket_ttl` seconds lapse.
+
+    Broadcasters, told apart by `priority(stream_key)` on the handshake's
+    query string or the connect's auth, skip the rate and the waiting room
+    and can use the `reserve` slots.
+    """
+
+    def __init__(self, socketio, priority, max_sessions=0, rate=0,
+                 burst=None, reserve=0, max_lag=0, queue_size=10000,
+                 ticket_ttl=30, retry_max=30):
+        self.socketio = socketio
+        self.priority = priority
+        self.max_sessions = max_sessions
+        self.rate = rate
+        # A tenth of a second's worth by default: handshakes let in back to
+        # back hold up everyone else
+        self.burst = burst or max(rate / 10, 1)
+        self.reserve = reserve
+        self.max_lag = max_lag
+        self.queue_size = queue_size
+        self.ticket_ttl = ticket_ttl
+        self.retry_max = retry_max
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # Shed handshakes are told to come back one token apart
+        self._next_slot = 0
+        self.lag = 0.0
+        # ticket -> [place in line, lapses at], in the order they were issued
+        self.waiting = OrderedDict()
+        self.issued = 0
+        # When viewers were admitted over the last `window` seconds, to
+        # estimate how fast the line moves
+        self.window = 10
+        self._recent = deque()
+        self.admitted = {'broadcaster': 0, 'viewer': 0}
+        self.shed = 0
+        self.refused = 0
+        self.lapsed = 0
+        self.task = None
+
+    def install(self):
+        """Put the handshake gate in front of the Engine.IO server"""
+        eio = self.socketio.server.eio
+        handle_request = eio.handle_request
+
+        def handle_admitted_request(environ, start_response):
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            # Requests for an existing session carry its sid
+            if environ.get('REQUEST_METHOD') == 'GET' and 'sid' not in query:
+                wait = self.accept(query.get('stream_key', [None])[0])
+                if wait:
+                    start_response('503 Service Unavailable', [
+                        ('Content-Type', 'application/json'),
+                        ('Retry-After', str(math.ceil(wait)))])
+                    return [json.dumps({'message': 'busy',
+                                        'retry_after': wait}).encode()]
+            return handle_request(environ, start_response)
+
+        eio.handle_request = handle_admitted_request
+
+    def start(self):
+        if self.max_lag and self.task is None:
+            self.task = self.socketio.start_background_task(self._watch_lag)
+
+    def _watch_lag(self, interval=0.05):
+        # How late a short sleep wakes up is how long the loop is busy
+        while True:
+            start = time.monotonic()
+            self.socketio.sleep(interval)
+            late = time.monotonic() - start - interval
+            # Rise at once, fall off over a few intervals
+            self.lag = late if late > self.lag else (self.lag + late) / 2
+
+    def accept(self, stream_key=None):
+        """Returns 0 to let a handshake in, else seconds to retry after"""
+        if not (self.rate or self.max_lag) or self.priority(stream_key):
+            return 0
+        if self.max_lag and self.lag > self.max_lag:
+            self.shed += 1
+            return round(random.uniform(1, 5), 1)
+        if self.rate:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.shed += 1
+                self._next_slot = min(max(self._next_slot, now) + 1 / self.rate,
+                                      now + self.retry_max)
+                return round(max(self._next_slot - now, 1), 1)
+            self.tokens -= 1
+        return 0
+
+    def admit(self, ticket, stream_key, sessions):
+        """Returns None to accept a Socket.IO connect, or the refusal's data.
+
+        `sessions` is how many sockets the worker holds now.
+        """
+        now = time.monotonic()
+        if self.priority(stream_key):
+            if not self.max_sessions or sessions < self.max_sessions:
+                self.admitted['broadcaster'] += 1
+                return None
+            return {'position': None, 'retry_after': 1}
+        self._lapse(now)
+        entry = self.waiting.get(ticket) if ticket else None
+        if self.waiting:
+            head = next(iter(self.waiting.values()))[0]
+            position = (entry[0] if entry else self.issued) - head
+        else:
+            position = 0
+        if position < self._free(sessions):
+            if entry is not None:
+                del self.waiting[ticket]
+            self.admitted['viewer'] += 1
+            self._recent.append(now)
+            return None
+        self.refused += 1
+        if entry is not None:
+            entry[1] = now + self.ticket_ttl
+        elif len(self.waiting) < self.queue_size:
+            ticket = secrets.token_urlsafe(12)
+            self.waiting[ticket] = [self.issued, now + self.ticket_ttl]
+            self.issued += 1
+        else:
+            # The waiting room is full too: try again much later
+            return {'position': None, 'retry_after': self.retry_max}
+        return {'ticket': ticket, 'position': position + 1,
+                'retry_after': self._retry_after(position, now)}
+
+    def _free(self, sessions):
+        """How many viewers could be admitted right now"""
+        if self.max_lag and self.lag > self.max_lag:
+            return 0
+        if self.max_sessions:
+            return self.max_sessions - self.reserve - sessions
+        return float('inf')
+
+    def _lapse(self, now):
+        # Only the front of the line is checked, so a lapsed ticket further
+        # back still counts towards positions until the line reaches it
+        waiting = self.waiting
+        while waiting:
+            ticket, (_, lapses) = next(iter(waiting.items()))
+            if lapses > now:
+                break
+            del waiting[ticket]
+            self.lapsed += 1
+
+    def _retry_after(self, position, now):
+        # The line moves as fast as viewers have been getting in lately
+        recent = self._recent
+        while recent and recent[0] < now - self.window:
+            recent.popleft()
+        per_second = max(len(recent) / self.window, 1)
+        return round(min(max((position + 1) / per_second, 1),
+                         self.retry_max), 1)
+
+    def stats(self):
+        return {'max_sessions': self.max_sessions, 'rate': self.rate,
+                'admitted': dict(self.admitted), 'shed': self.shed,
+                'refused': self.refused, 'waiting': len(self.waiting),
+                'lapsed': self.lapsed, 'loop_lag': round(self.lag, 4)}
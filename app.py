@@ -1,70 +1,508 @@
+import os
+
+# Message queue clients block on sockets, so the standard library has to be
+# green before anything else imports it
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    import eventlet
+    eventlet.monkey_patch()
 
-from flask import Flask, Response, render_template_string, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import SocketIO, ConnectionRefusedError, emit, join_room, leave_room
+import functools
+import hmac
 import threading
-import time
-import os
+import math
 import json
 import base64
+import secrets
+import time
+import uuid
 from flask_cors import CORS
-import subprocess
-from threading import Thread
+from abr import ABRScheduler, DEFAULT_LADDER
+from admission import AdmissionController, WAITING_ROOM
+from broadcast import Broadcaster
+from chat_batcher import ChatBatcher
+from chat_history import ChatHistoryStore
+from chat_log import ChatLog
+from event_log import EventLog, LEVELS, parse_sample
+from local_broker import LocalBrokerManager
+from metrics import Metrics, instrument_socketio
+from outbound import SlowConsumerMonitor
+from rate_limiter import RateLimiter, DEFAULT_LIMITS, parse_limits
+from rtmp_supervisor import RTMPSupervisor
+from session_store import SessionStore, BROADCASTER, VIEWER
+from state_store import create_state_store
+from sfu import SFU
+from signaling import SignalingRelay
+from stream_keys import StreamKeys
+from stream_registry import StreamRegistry, LOBBY_ROOM, stream_room
+from stream_info import StreamInfo
+from static_assets import Asset, StaticAssets
+from frame_broadcaster import FrameBroadcaster, create_frame_source
+from hls_packager import HLSPackager
+from hls_server import HLSServer
+from ll_hls import LowLatencyHLS
 
 app = Flask(__name__)
 CORS(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'secret!')
+
+# Multi-worker mode: SOCKETIO_MESSAGE_QUEUE relays emits between workers
+# (redis://, amqp://, zmq+tcp:// or local:// for local_broker.py) and
+# STATE_STORE_URL holds the stream and presence state they share
+message_queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+queue_options = {}
+if message_queue and message_queue.startswith('local://'):
+    queue_options['client_manager'] = LocalBrokerManager(message_queue)
+elif message_queue:
+    queue_options['message_queue'] = message_queue
+# Long-polling needs sticky sessions to span workers; multi-worker
+# deployments without them should set SOCKETIO_TRANSPORTS=websocket
+transports = os.environ.get('SOCKETIO_TRANSPORTS', 'websocket,polling').split(',')
+# SOCKETIO_SERIALIZER=msgpack encodes every packet as MessagePack instead of
+# JSON (needs the msgpack package); the page then loads the Socket.IO client
+# build with the matching parser. Binary packets travel base64-encoded over
+# long-polling, so it pays off most with SOCKETIO_TRANSPORTS=websocket.
+serializer = os.environ.get('SOCKETIO_SERIALIZER', 'default')
+
 # Enhanced SocketIO configuration for better compatibility
 socketio = SocketIO(app, 
                    cors_allowed_origins="*",
                    logger=False,  # Disabled for Azure
                    engineio_logger=False,  # Disabled for Azure
-                   async_mode='eventlet')  # Changed for Azure
+                   async_mode='eventlet',  # Changed for Azure
+                   transports=transports,
+                   serializer=serializer,
+                   **queue_options)
+
+# Each emit is encoded once and the same packet is queued for every
+# recipient. WEBSOCKET_DEFLATE=on accepts permessage-deflate and compresses
+# packets of WEBSOCKET_DEFLATE_MIN bytes or more once per emit, not once per
+# socket; by default websocket traffic is sent uncompressed.
+broadcaster = Broadcaster(
+    socketio.server,
+    deflate_level=6 if os.environ.get('WEBSOCKET_DEFLATE') == 'on' else None,
+    deflate_min=int(os.environ.get('WEBSOCKET_DEFLATE_MIN', 512)))
+broadcaster.install()
+
+# Every client's send queue holds at most OUTBOUND_QUEUE_LIMIT packets.
+# OUTBOUND_QUEUE_POLICY picks what happens to a client that can't keep up:
+# collapse (keep only the latest of OUTBOUND_COLLAPSE_EVENTS), drop_oldest
+# and disconnect (once its queue has been full for OUTBOUND_MAX_LAG seconds)
+slow_consumers = SlowConsumerMonitor(
+    socketio,
+    limit=int(os.environ.get('OUTBOUND_QUEUE_LIMIT', 1000)),
+    policies=[p for p in os.environ.get(
+        'OUTBOUND_QUEUE_POLICY', 'collapse,drop_oldest,disconnect').split(',')
+        if p],
+    collapse=os.environ.get('OUTBOUND_COLLAPSE_EVENTS',
+                            'viewer_count,stream_info,stream_list').split(','),
+    max_lag=float(os.environ.get('OUTBOUND_MAX_LAG', 60)))
+slow_consumers.install()
 
-# Track connected users and streaming state
-connected_users = set()
-current_stream = {
+state_store = create_state_store(os.environ.get('STATE_STORE_URL'))
+worker_id = uuid.uuid4().hex
+PRESENCE_TTL = 15
+# Viewer counts are published by a ticker at most once per interval and only
+# when they changed; VIEWER_COUNT_INTERVAL=0 broadcasts on every connect
+VIEWER_COUNT_INTERVAL = float(os.environ.get('VIEWER_COUNT_INTERVAL', 1))
+
+# Sockets connected to this worker, with the stream each one is watching or
+# broadcasting (everyone else sits in the lobby room); totals and streaming
+# state live in the state store so every worker sees the same values
+sessions = SessionStore()
+viewer_count = 0
+viewer_count_task = None
+# A broadcaster that drops keeps its admission priority for
+# BROADCASTER_RECONNECT_GRACE seconds. Streams belong to the worker that
+# started them and are reaped by the others once its presence expires
+stream_registry = StreamRegistry(
+    state_store,
+    reconnect_grace=int(os.environ.get('BROADCASTER_RECONNECT_GRACE', 60)),
+    owner=worker_id)
+# ICE candidates are coalesced per peer pair into `webrtc_ice_candidates`
+# packets; WEBRTC_CANDIDATE_WINDOW_MS=0 sends one packet per candidate
+signaling = SignalingRelay(
+    socketio, state_store,
+    max_candidates=int(os.environ.get('WEBRTC_MAX_CACHED_CANDIDATES', 32)),
+    window=float(os.environ.get('WEBRTC_CANDIDATE_WINDOW_MS', 20)) / 1000,
+    max_batch=int(os.environ.get('WEBRTC_CANDIDATE_BATCH_SIZE', 50)))
+# WEBRTC_MODE=sfu relays each broadcast through this server (needs the
+# pinned aiortc of requirements-sfu.txt):
+# the broadcaster uploads once and every viewer is fed from here. Streams
+# are published to the worker the broadcaster is connected to.
+WEBRTC_MODE = os.environ.get('WEBRTC_MODE', 'p2p')
+sfu = SFU(
+    max_queue=int(os.environ.get('SFU_QUEUE_FRAMES', 30)),
+    sleep=socketio.sleep) if WEBRTC_MODE == 'sfu' else None
+IDLE_STREAM = {
+    'stream_id': None,
     'active': False,
     'streamer_id': None,
     'streamer_name': None,
-    'stream_key': None
+    'playback_id': None
 }
+# /stream/info answers If-None-Match with a 304 while the state is the same
+# version, and holds `?wait_version=N` requests until it changes, for up to
+# STREAM_INFO_MAX_WAIT seconds. Changes made on other workers are noticed
+# within STREAM_INFO_POLL_MS.
+stream_info_server = StreamInfo(
+    socketio, stream_registry, IDLE_STREAM,
+    max_wait=float(os.environ.get('STREAM_INFO_MAX_WAIT', 30)),
+    poll_interval=float(os.environ.get('STREAM_INFO_POLL_MS', 100)) / 1000)
+stream_registry.on_change = stream_info_server.notify
 
-def start_rtmp_server():
-    try:
-        print("Attempting to start RTMP server...")
-        process = subprocess.Popen(["node", "rtmp_server.js"], 
-                                 stdout=subprocess.PIPE, 
-                                 stderr=subprocess.PIPE)
-        print(f"RTMP server started with PID: {process.pid}")
-    except Exception as e:
-        print(f"Failed to start RTMP server: {e}")
+def current_room(sid):
+    stream_id = sessions.stream_of(sid)
+    return stream_room(stream_id) if stream_id else LOBBY_ROOM
+
+def watch_stream(sid, stream_id):
+    """Move a socket into a stream's room, or back to the lobby"""
+    if sessions.stream_of(sid) != stream_id:
+        signaling.leave(sid)
+    chat_batcher.leave(sid, current_room(sid))
+    leave_room(current_room(sid), sid=sid)
+    sessions.set_stream(sid, stream_id)
+    join_room(current_room(sid), sid=sid)
+    chat_batcher.join(sid, current_room(sid))
+    # Catch the socket up on recent chat in one packet
+    history = chat_history.page(current_room(sid), limit=CHAT_REPLAY_COUNT)
+    if history['messages']:
+        emit('chat_history', history, to=sid)
+
+def get_viewer_count():
+    """Total viewers across all workers"""
+    return sum(state_store.scan('presence:').values())
+
+def publish_presence():
+    state_store.set(f'presence:{worker_id}', len(sessions),
+                    ttl=PRESENCE_TTL)
+
+def start_presence():
+    """Keep this worker's presence alive and its peers' streams checked"""
+    global viewer_count_task
+    if viewer_count_task is None:
+        # Published at once: a stream may start before the first tick
+        publish_presence()
+        viewer_count_task = socketio.start_background_task(viewer_count_ticker)
+
+def reap_streams():
+    """Close the streams of workers whose presence has expired"""
+    live = {key[len('presence:'):] for key in state_store.scan('presence:')}
+    for stream in stream_registry.reap(live):
+        event_log.warning('stream_reaped', stream_id=stream['stream_id'],
+                          streamer_id=stream['streamer_id'])
+        close_stream(stream, f'{stream["streamer_name"]} went offline '
+                             '(stream ended)')
+
+def hold_viewer_count_lease(ttl):
+    """Claim or renew the right to publish the viewer count"""
+    if (state_store.add('viewer_count:publisher', worker_id, ttl=ttl) or
+            state_store.get('viewer_count:publisher') == worker_id):
+        state_store.set('viewer_count:publisher', worker_id, ttl=ttl)
+        return True
+    return False
+
+def viewer_count_ticker():
+    """Refresh this worker's presence and publish the coalesced total"""
+    global viewer_count
+    ticking = VIEWER_COUNT_INTERVAL > 0
+    interval = VIEWER_COUNT_INTERVAL if ticking else PRESENCE_TTL / 3
+    reap_at = 0
+    while True:
+        socketio.sleep(interval)
+        # Keep this worker's count alive; it expires if the worker dies
+        publish_presence()
+        if time.monotonic() >= reap_at:
+            reap_at = time.monotonic() + PRESENCE_TTL
+            reap_streams()
+        if not ticking:
+            continue
+        viewer_count = get_viewer_count()
+        # One worker publishes, and only when the count changed; another
+        # takes over a few ticks after it dies
+        if hold_viewer_count_lease(interval * 3) and \
+                state_store.get('viewer_count:published') != viewer_count:
+            state_store.set('viewer_count:published', viewer_count)
+            socketio.emit('viewer_count', {'count': viewer_count})
+
+# Recent chat per room, bounded by count and size. Each worker records
+# every batch delivered to it, so all of them hold the same history; the
+# last CHAT_REPLAY_COUNT messages are replayed when a socket enters a room
+chat_history = ChatHistoryStore(
+    state_store,
+    max_messages=int(os.environ.get('CHAT_HISTORY_SIZE', 1000)),
+    max_bytes=int(os.environ.get('CHAT_HISTORY_KB', 256)) * 1024)
+
+# Chat fan-out is coalesced into `chat_batch` packets; CHAT_BATCH_MODE=off
+# restores one `chat_message` broadcast per message
+chat_batcher = ChatBatcher(
+    socketio, chat_history,
+    min_window=float(os.environ.get('CHAT_BATCH_MIN_WINDOW_MS', 20)) / 1000,
+    max_window=float(os.environ.get('CHAT_BATCH_MAX_WINDOW_MS', 250)) / 1000,
+    max_batch=int(os.environ.get('CHAT_BATCH_MAX_SIZE', 50)),
+    enabled=os.environ.get('CHAT_BATCH_MODE', 'batch') != 'off',
+    idle_ttl=int(os.environ.get('CHAT_BATCH_IDLE_TTL', 60)))
+chat_batcher.install(broadcaster)
+
+CHAT_REPLAY_COUNT = int(os.environ.get('CHAT_REPLAY_COUNT', 50))
+CHAT_PAGE_LIMIT = 200
 
-# Start the RTMP server in a separate thread when the Flask app starts
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and os.environ.get('WEBSITE_SITE_NAME') is None:
-    rtmp_thread = Thread(target=start_rtmp_server)
-    rtmp_thread.daemon = True
-    rtmp_thread.start()
+# Structured logs for the event handlers, written off the event loop
+event_log = EventLog(
+    level=os.environ.get('LOG_LEVEL', 'info'),
+    sample=parse_sample(os.environ.get('LOG_SAMPLE', 'chat_message=0.01')),
+    queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+
+# Durable chat log, written in batches off the event loop (off by default)
+CHAT_LOG_PATH = os.environ.get('CHAT_LOG_PATH')
+chat_log = ChatLog(
+    CHAT_LOG_PATH,
+    fsync=os.environ.get('CHAT_LOG_FSYNC', 'normal'),
+    queue_size=int(os.environ.get('CHAT_LOG_QUEUE_SIZE', 10000)),
+    max_batch=int(os.environ.get('CHAT_LOG_BATCH_SIZE', 500)),
+    flush_interval=int(os.environ.get('CHAT_LOG_FLUSH_MS', 50)) / 1000,
+    event_log=event_log,
+) if CHAT_LOG_PATH else None
+CHAT_LOG_PAGE_LIMIT = 1000
+
+# Bearer token for the admin endpoints; they are disabled without one
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Token buckets per client for the events that fan out or relay
+rate_limiter = RateLimiter(
+    parse_limits(os.environ.get('RATE_LIMITS', DEFAULT_LIMITS)),
+    idle_ttl=int(os.environ.get('RATE_LIMIT_IDLE_TTL', 60)))
+# Share one budget between every socket from an address instead of per sid
+if os.environ.get('RATE_LIMIT_KEY', 'sid') == 'ip':
+    rate_limit = functools.partial(rate_limiter.limit,
+                                   key_func=lambda: request.remote_addr,
+                                   sleep=socketio.sleep)
+else:
+    rate_limit = functools.partial(rate_limiter.limit, sleep=socketio.sleep)
+
+# RTMP stream keys are HMAC-signed so any worker can check one on its own;
+# without STREAM_KEY_SECRET the workers share a random secret through the
+# state store
+stream_key_secret = os.environ.get('STREAM_KEY_SECRET')
+if not stream_key_secret:
+    state_store.add('stream_key_secret', secrets.token_hex(32))
+    stream_key_secret = state_store.get('stream_key_secret')
+stream_keys = StreamKeys(stream_key_secret,
+                         ttl=int(os.environ.get('STREAM_KEY_TTL', 24 * 3600)))
+
+# Admission control per worker, off by default. New connections are let in
+# at ADMISSION_RATE per second (bursts of ADMISSION_BURST), none while the
+# event loop lags more than ADMISSION_MAX_LAG_MS, and the rest are shed with
+# a 503 and Retry-After. Past ADMISSION_MAX_SESSIONS sockets viewers wait in
+# line with a ticket; clients presenting the stream key of a live stream,
+# or of one that dropped within the reconnect grace, skip the line and may
+# use the ADMISSION_BROADCASTER_RESERVE last slots.
+def broadcaster_priority(stream_key):
+    # Anyone can mint a key, so only one that has been broadcasting counts
+    return stream_keys.verify(stream_key) is not None and \
+        stream_registry.is_broadcaster(stream_key)
+
+admission = AdmissionController(
+    socketio,
+    broadcaster_priority,
+    max_sessions=int(os.environ.get('ADMISSION_MAX_SESSIONS', 0)),
+    rate=float(os.environ.get('ADMISSION_RATE', 0)),
+    burst=float(os.environ.get('ADMISSION_BURST', 0)),
+    reserve=int(os.environ.get('ADMISSION_BROADCASTER_RESERVE', 10)),
+    max_lag=float(os.environ.get('ADMISSION_MAX_LAG_MS', 0)) / 1000,
+    queue_size=int(os.environ.get('ADMISSION_QUEUE_SIZE', 10000)),
+    ticket_ttl=int(os.environ.get('ADMISSION_TICKET_TTL', 30)))
+admission.install()
+
+# node-media-server runs as a supervised child of one worker; its publish
+# events keep the stream registry in line with what is actually ingested
+RTMP_PORT = int(os.environ.get('RTMP_PORT', 1935))
+RTMP_HTTP_PORT = int(os.environ.get('RTMP_HTTP_PORT', 8000))
+RTMP_LEASE_TTL = 30
+# HLS_LOW_LATENCY=on has ffmpeg cut parts of up to HLS_PART_TARGET seconds
+# that this app packages as LL-HLS. ffmpeg cuts on time alone, so parts
+# evenly divide HLS_SEGMENT_TARGET (set the encoder's keyframe interval to
+# it, so that keyframes start parts), with room for cuts landing a frame late
+HLS_LOW_LATENCY = os.environ.get('HLS_LOW_LATENCY') == 'on'
+HLS_PART_TARGET = float(os.environ.get('HLS_PART_TARGET', 0.334))
+HLS_SEGMENT_TARGET = float(os.environ.get('HLS_SEGMENT_TARGET', 2))
+HLS_PART_TIME = math.floor(HLS_SEGMENT_TARGET / math.ceil(
+    HLS_SEGMENT_TARGET / (HLS_PART_TARGET * 0.9)) * 1e6) / 1e6
+
+def hold_rtmp_lease():
+    """Claim or renew the right to run the RTMP server"""
+    if (state_store.add('rtmp_supervisor', worker_id, ttl=RTMP_LEASE_TTL) or
+            state_store.get('rtmp_supervisor') == worker_id):
+        state_store.set('rtmp_supervisor', worker_id, ttl=RTMP_LEASE_TTL)
+        return True
+    return False
+
+rtmp_supervisor = RTMPSupervisor(
+    socketio, ['node', 'rtmp_server.js'], event_log,
+    on_event=lambda event, record: handle_rtmp_event(event, record),
+    ports=(RTMP_PORT, RTMP_HTTP_PORT),
+    env=dict(os.environ, RTMP_PORT=str(RTMP_PORT),
+             RTMP_HTTP_PORT=str(RTMP_HTTP_PORT),
+             STREAM_KEY_SECRET=stream_key_secret),
+    lease=hold_rtmp_lease,
+    health_interval=float(os.environ.get('RTMP_HEALTH_INTERVAL', 5)),
+    max_backoff=float(os.environ.get('RTMP_MAX_BACKOFF', 60)))
+# RTMP_SERVER=on also starts it outside the reloader (e.g. under gunicorn)
+if ((os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or
+        os.environ.get('RTMP_SERVER') == 'on') and
+        os.environ.get('WEBSITE_SITE_NAME') is None):
+    rtmp_supervisor.start()
+
+# One producer serves every /video_feed client; VIDEO_FEED_SOURCE picks a
+# placeholder (no camera in cloud deployments), test pattern, file or pipe
+video_feed_source = os.environ.get('VIDEO_FEED_SOURCE', 'placeholder')
+video_feed_fps = float(os.environ.get(
+    'VIDEO_FEED_FPS', 1 if video_feed_source == 'placeholder' else 10))
+frame_broadcaster = FrameBroadcaster(
+    socketio, create_frame_source(video_feed_source, video_feed_fps),
+    fps=video_feed_fps)
+
+# The worker running the RTMP server packages each published stream as HLS
+# with HLS_FFMPEG (copying audio and video, no re-encoding) into MEDIA_ROOT,
+# which every worker serves, with hot segments kept in memory
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(app.root_path, 'media'))
+
+def rtmp_input(stream_key):
+    """ffmpeg arguments reading a published stream back from the RTMP server"""
+    return ['-i', f'rtmp://127.0.0.1:{RTMP_PORT}/live/{stream_key}']
+
+hls_packager = HLSPackager(
+    socketio, event_log, MEDIA_ROOT, rtmp_input,
+    ffmpeg=os.environ.get('HLS_FFMPEG', 'ffmpeg'),
+    segment_time=HLS_SEGMENT_TARGET,
+    part_time=HLS_PART_TIME if HLS_LOW_LATENCY else None)
+# Each worker packages LL-HLS on its own, so segment numbers only agree
+# between workers that saw the stream start; keep its viewers on one
+ll_hls = LowLatencyHLS(
+    socketio, MEDIA_ROOT, part_target=HLS_PART_TARGET,
+    segment_target=HLS_SEGMENT_TARGET,
+    segment_max=float(os.environ.get('HLS_SEGMENT_MAX', 4)),
+    window=int(os.environ.get('HLS_WINDOW', 6)),
+    poll_interval=float(os.environ.get('HLS_PART_POLL_MS', 50)) / 1000
+) if HLS_LOW_LATENCY else None
+hls_server = HLSServer(
+    socketio, MEDIA_ROOT,
+    cache_bytes=int(os.environ.get('HLS_CACHE_MB', 256)) * 1024 * 1024,
+    low_latency=ll_hls)
+
+# HLS_ABR=on transcodes every published stream into the ABR_LADDER
+# renditions (name:WIDTHxHEIGHT:bitrate, see abr.py) on the worker running
+# the RTMP server, within ABR_CPU_TARGET of its cores, and players get
+# /live/<playback id>/master.m3u8
+abr = ABRScheduler(
+    socketio, state_store, event_log, MEDIA_ROOT, rtmp_input,
+    ladder=os.environ.get('ABR_LADDER', DEFAULT_LADDER),
+    ffmpeg=os.environ.get('ABR_FFMPEG', 'ffmpeg'),
+    preset=os.environ.get('ABR_PRESET', 'veryfast'),
+    pixels_per_core=float(os.environ.get('ABR_PIXELS_PER_CORE', 84e6)),
+    decode_cost=float(os.environ.get('ABR_DECODE_COST', 0.14)),
+    cpu_target=float(os.environ.get('ABR_CPU_TARGET', 0.8)),
+    idle_timeout=float(os.environ.get('ABR_IDLE_TIMEOUT', 30))
+) if os.environ.get('HLS_ABR') == 'on' else None
+HLS_PLAYLIST = 'master.m3u8' if abr is not None else 'index.m3u8'
+
+@app.route('/live/<playback_id>/<name>')
+def hls_file(playback_id, name):
+    """Serve HLS playlists and segments"""
+    hls_server.start()
+    if name == 'master.m3u8' and abr is not None:
+        return abr.master_playlist(playback_id)
+    if name.endswith('.m3u8'):
+        return hls_server.playlist(playback_id, name)
+    return hls_server.segment(playback_id, name)
+
+@app.route('/live/<playback_id>/<rendition>/<name>')
+def hls_rendition_file(playback_id, rendition, name):
+    """Serve the playlists and segments of a transcoded rendition"""
+    hls_server.start()
+    if name.endswith('.m3u8'):
+        # Players reload the playlist of the rendition they are on
+        if abr is not None:
+            abr.watched(playback_id, rendition)
+        return hls_server.playlist(playback_id, name, rendition)
+    return hls_server.segment(playback_id, name, rendition)
 
 @app.route('/video_feed')
 def video_feed():
-    def generate():
-        # Simple placeholder without OpenCV
-        placeholder_response = b'''--frame\r
-Content-Type: text/plain\r
-
-Server camera not available in cloud deployment. Use browser camera below.\r
-'''
-        while True:
-            yield placeholder_response
-            time.sleep(1)
-    
-    return Response(generate(),
+    return Response(frame_broadcaster.stream(),
                   mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/streams')
+def list_streams():
+    """List all live streams"""
+    return jsonify({'streams': stream_registry.list()})
+
+@app.route('/stats')
+def worker_stats():
+    """Viewer total, this worker's sessions by role, transport and stream,
+    its slowest clients and its waiting room"""
+    return jsonify({'worker_id': worker_id, 'viewer_count': viewer_count,
+                    'sessions': sessions.snapshot(),
+                    'outbound': slow_consumers.stats(),
+                    'admission': admission.stats(),
+                    'stream_info': stream_info_server.stats(),
+                    'hls_packager': hls_packager.stats(),
+                    'abr': abr.stats() if abr is not None else None})
+
 @app.route('/stream/info')
-def stream_info():
-    """Get current streaming information"""
-    return jsonify(current_stream)
+@app.route('/stream/info/<stream_id>')
+def stream_info(stream_id=None):
+    """Get streaming information for one stream; single-stream clients
+    get the longest running stream"""
+    return stream_info_server.respond(stream_id or request.args.get('stream_id'))
+
+@app.route('/chat/history')
+def get_chat_history():
+    """Page back through a stream's chat (the lobby's without stream_id)"""
+    stream_id = request.args.get('stream_id')
+    room = stream_room(stream_id) if stream_id else LOBBY_ROOM
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 50, type=int), CHAT_PAGE_LIMIT)
+    return jsonify(chat_history.page(room, before, limit))
+
+@app.route('/chat/log')
+def export_chat_log():
+    """Read the durable chat log by offset and/or time range"""
+    if chat_log is None:
+        return jsonify({'error': 'Chat log is not enabled'}), 404
+    stream_id = request.args.get('stream_id')
+    limit = min(request.args.get('limit', 500, type=int), CHAT_LOG_PAGE_LIMIT)
+    messages = chat_log.read(
+        room=stream_room(stream_id) if stream_id else request.args.get('room'),
+        after=request.args.get('after', 0, type=int),
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        limit=limit)
+    # Pass `next` back as `after` to read the following page
+    return jsonify({
+        'messages': messages,
+        'next': messages[-1]['offset'] if len(messages) == limit else None,
+    })
+
+@app.route('/admin/logging', methods=['GET', 'PUT'])
+def admin_logging():
+    """Show or change the log level and per-event sample rates"""
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+        return jsonify({'error': 'Not found'}), 404
+    if request.method == 'PUT':
+        settings = request.get_json(silent=True) or {}
+        level = settings.get('level', event_log.level)
+        if level not in LEVELS:
+            return jsonify({'error': f'Unknown level: {level}'}), 400
+        event_log.set_level(level)
+        for event, rate in settings.get('sample', {}).items():
+            if rate is None:
+                event_log.sample.pop(event, None)
+            else:
+                event_log.sample[event] = float(rate)
+    return jsonify(event_log.stats())
 
 @app.route('/stream/rtmp-key')
 def get_rtmp_key():
@@ -73,867 +511,466 @@ def get_rtmp_key():
     # Extract host without port for RTMP URL
     host = request.host.split(':')[0]
     rtmp_url = f"rtmp://{host}/live"
-    stream_key = f"stream-{len(connected_users)}-{int(time.time())}"
+    stream_key = stream_keys.mint()
+    playback_id = stream_keys.playback_id(stream_key)
     
-    # Fix the HLS URL by using the correct port (8000)
-    hls_url = f"http://{host}:8000/live/{stream_key}/index.m3u8"
-    print(hls_url)
+    # HLS output is served by this app, under a name that can be shared
+    hls_url = f"{app_url}/live/{playback_id}/{HLS_PLAYLIST}"
+    event_log.info('rtmp_key', playback_id=playback_id, hls_url=hls_url)
 
     return jsonify({
         'rtmp_url': rtmp_url,
         'stream_key': stream_key,
+        'playback_id': playback_id,
         'hls_playback': hls_url,
         'instructions': {
             'obs': 'In OBS: Settings → Stream → Service: Custom → Server: ' + rtmp_url + ' → Stream Key: ' + stream_key,
             'software': 'Any RTMP-compatible software can use these settings'
         }
     })
+
+def announce_stream(stream, message):
+    """Tell everyone browsing the lobby about a new stream"""
+    socketio.emit('stream_started', {
+        'stream_id': stream['stream_id'],
+        'streamer_name': stream['streamer_name'],
+        'playback_id': stream['playback_id'],
+        'message': message
+    }, to=LOBBY_ROOM)
+
+def close_stream(stream, message):
+    """Notify a stopped stream's viewers and the lobby, and free its state"""
+    socketio.emit('stream_stopped', {
+        'stream_id': stream['stream_id'],
+        'message': message
+    }, to=[stream_room(stream['stream_id']), LOBBY_ROOM])
+    signaling.end_stream(stream['stream_id'], stream['streamer_id'])
+    if sfu is not None:
+        sfu.unpublish(stream['stream_id'])
+
+def forget_stream_chat(room, data):
+    """Free a stopped stream's chat state on every worker"""
+    chat_batcher.drop(stream_room(data['stream_id']))
+    chat_history.drop(stream_room(data['stream_id']))
+
+broadcaster.listen('stream_stopped', forget_stream_chat)
+
+def handle_rtmp_event(event, record):
+    """Track RTMP ingest from rtmp_server.js publish events"""
+    stream_key = record.get('stream_key')
+    if event == 'rejectPublish':
+        event_log.warning('rtmp_publish_rejected', ip=record.get('ip'),
+                          stream_key=stream_key)
+        return
+    if record.get('app') != 'live' or not stream_keys.verify(stream_key):
+        # Refused by rtmp_server.js, which closes the session
+        return
+    stream = stream_registry.get_by_key(stream_key)
+    if event == 'postPublish':
+        if stream is None:
+            # Published straight from OBS without a browser broadcast;
+            # the stream lives as long as this worker's presence
+            start_presence()
+            stream = stream_registry.start(
+                f'rtmp:{record["id"]}', 'RTMP', stream_key,
+                stream_keys.playback_id(stream_key))
+            if stream is None:
+                return
+            announce_stream(stream, 'An RTMP stream started')
+        stream = stream_registry.update(stream['stream_id'], ingest='live',
+                                        hls_playlist=HLS_PLAYLIST)
+        hls_packager.publish(stream['playback_id'], stream_key)
+        if abr is not None:
+            abr.publish(stream['playback_id'], stream_key)
+    elif event == 'donePublish' and stream is not None:
+        hls_packager.unpublish(stream['playback_id'])
+        if abr is not None:
+            abr.unpublish(stream['playback_id'])
+        if stream['streamer_id'] == f'rtmp:{record["id"]}':
+            stream_registry.stop(stream['streamer_id'])
+            close_stream(stream, 'RTMP stream ended')
+            return
+        stream = stream_registry.update(stream['stream_id'], ingest=None)
+    else:
+        return
+    socketio.emit('stream_ingest', {
+        'stream_id': stream['stream_id'],
+        'playback_id': stream['playback_id'],
+        'ingest': stream['ingest'],
+        'hls_playlist': HLS_PLAYLIST
+    }, to=stream_room(stream['stream_id']))
 @socketio.on('chat_message')
+@rate_limit('chat_message')
 def handle_message(data):
-    print(f'Received message from {data.get("user", "anonymous")}: {data.get("msg", "")}')
-    # Broadcast message to all connected clients
-    emit('chat_message', data, broadcast=True)
+    room = current_room(request.sid)
+    user = str(data.get('user', 'anonymous'))
+    msg = str(data.get('msg', ''))
+    ts = time.time()
+    event_log.info('chat_message', sid=request.sid, room=room, user=user,
+                   length=len(msg))
+    if chat_log is not None:
+        chat_log.append(room, ts, user, msg)
+    # Queue message for the next batched broadcast to the sender's stream;
+    # it is numbered and recorded in the history when its batch goes out
+    chat_batcher.add(dict(data, user=user, msg=msg, ts=ts), room=room)
+
+@socketio.on('get_chat_history')
+def handle_get_chat_history(data=None):
+    """Page back through the chat of the sender's room"""
+    data = data or {}
+    limit = min(int(data.get('limit', 50)), CHAT_PAGE_LIMIT)
+    return chat_history.page(current_room(request.sid), data.get('before'),
+                             limit)
 
 @socketio.on('connect')
-def handle_connect():
-    connected_users.add(request.sid)
-    viewer_count = len(connected_users)
-    print(f'Client connected: {request.sid} (Total viewers: {viewer_count})')
+def handle_connect(auth=None):
+    auth = auth or {}
+    admission.start()
+    refusal = admission.admit(auth.get('ticket'), auth.get('stream_key'),
+                              len(sessions))
+    if refusal is not None:
+        event_log.debug('connect_refused', sid=request.sid,
+                        position=refusal['position'])
+        # The Engine.IO connection stays open for the client to retry on
+        raise ConnectionRefusedError(WAITING_ROOM, refusal)
+    sessions.add(request.sid, request.args.get('transport', 'polling'))
+    start_presence()
+    slow_consumers.start()
+    # Clients that don't announce batch support get single chat_message events
+    if not auth.get('chat_batch'):
+        chat_batcher.add_legacy_client(request.sid)
+    event_log.info('connect', sid=request.sid, viewers=len(sessions))
     
-    # Notify all clients of the updated viewer count
-    emit('viewer_count', {'count': viewer_count}, broadcast=True)
+    if VIEWER_COUNT_INTERVAL > 0:
+        # Others learn about the new viewer on the next tick
+        emit('viewer_count', {'count': max(viewer_count, len(sessions))})
+    else:
+        # Notify all clients of the updated viewer count
+        publish_presence()
+        emit('viewer_count', {'count': get_viewer_count()}, broadcast=True)
     emit('status', {'msg': f'Client {request.sid[:8]} has connected'})
     
-    # Send current stream info to new user
-    emit('stream_info', current_stream)
+    # Join the requested stream, if it is live, and send its info
+    stream_id = auth.get('stream_id')
+    stream = stream_registry.get(stream_id) if stream_id else None
+    watch_stream(request.sid, stream and stream['stream_id'])
+    emit('stream_info', stream or IDLE_STREAM)
+    emit('stream_list', {'streams': stream_registry.list()})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    global current_stream
-    connected_users.discard(request.sid)
-    viewer_count = len(connected_users)
-    print(f'Client disconnected: {request.sid} (Total viewers: {viewer_count})')
+    sessions.remove(request.sid)
+    chat_batcher.remove_client(request.sid)
+    rate_limiter.forget(request.sid)
+    signaling.leave(request.sid)
+    if sfu is not None:
+        sfu.unsubscribe(request.sid)
+    event_log.info('disconnect', sid=request.sid, viewers=len(sessions))
     
     # If the disconnected user was streaming, stop the stream
-    if current_stream['active'] and current_stream['streamer_id'] == request.sid:
-        streamer_name = current_stream['streamer_name']
-        current_stream = {
-            'active': False,
-            'streamer_id': None,
-            'streamer_name': None,
-            'stream_key': None
-        }
-        emit('stream_stopped', {
-            'message': f'{streamer_name} disconnected (stream ended)'
-        }, broadcast=True)
+    stream = stream_registry.stop(request.sid)
+    if stream is not None:
+        close_stream(stream,
+                     f'{stream["streamer_name"]} disconnected (stream ended)')
     
-    # Notify remaining clients of the updated viewer count
-    emit('viewer_count', {'count': viewer_count}, broadcast=True)
+    if VIEWER_COUNT_INTERVAL <= 0:
+        # Notify remaining clients of the updated viewer count
+        publish_presence()
+        emit('viewer_count', {'count': get_viewer_count()}, broadcast=True)
+
+@socketio.on('get_viewer_count')
+def handle_get_viewer_count(data=None):
+    """Let clients pull the latest published viewer count"""
+    return {'count': viewer_count}
+
+@socketio.on('join_stream')
+def handle_join_stream(data):
+    """Start watching a stream"""
+    stream = stream_registry.get(data.get('stream_id'))
+    if stream is None:
+        return {'success': False, 'message': 'Stream not found'}
+    watch_stream(request.sid, stream['stream_id'])
+    emit('stream_info', stream)
+    return {'success': True, 'stream': stream}
+
+@socketio.on('leave_stream')
+def handle_leave_stream(data=None):
+    """Go back to the lobby"""
+    watch_stream(request.sid, None)
+    return {'success': True}
 
 @socketio.on('start_broadcast')
 def handle_start_broadcast(data):
     """Handle when someone starts broadcasting"""
-    global current_stream
-    
     user_name = data.get('user_name', 'Anonymous')
     stream_key = data.get('stream_key', None)
+    if stream_key is not None and not stream_keys.verify(stream_key):
+        return {'success': False, 'message': 'Invalid or expired stream key'}
     
-    if not current_stream['active']:
-        current_stream = {
-            'active': True,
-            'streamer_id': request.sid,
-            'streamer_name': user_name,
-            'stream_key': stream_key
-        }
-        
-        # Notify all users that streaming started
-        emit('stream_started', {
-            'streamer_name': user_name,
-            'stream_key': stream_key,
-            'message': f'{user_name} started broadcasting!'
-        }, broadcast=True)
+    stream = stream_registry.start(
+        request.sid, user_name, stream_key,
+        stream_keys.playback_id(stream_key) if stream_key else None)
+    if stream is not None:
+        watch_stream(request.sid, stream['stream_id'])
+        sessions.set_role(request.sid, BROADCASTER)
+        announce_stream(stream, f'{user_name} started broadcasting!')
         
-        print(f"{user_name} started broadcasting")
-        return {'success': True, 'message': 'Broadcasting started'}
+        event_log.info('broadcast_started', sid=request.sid,
+                       stream_id=stream['stream_id'], streamer_name=user_name)
+        return {'success': True, 'message': 'Broadcasting started',
+                'stream_id': stream['stream_id']}
     else:
-        return {'success': False, 'message': 'Someone else is already broadcasting'}
+        return {'success': False, 'message': 'You are already broadcasting'}
 
 @socketio.on('stop_broadcast')
-def handle_stop_broadcast():
+def handle_stop_broadcast(data=None):
     """Handle when someone stops broadcasting"""
-    global current_stream
-    
-    if current_stream['active'] and current_stream['streamer_id'] == request.sid:
-        streamer_name = current_stream['streamer_name']
-        current_stream = {
-            'active': False,
-            'streamer_id': None,
-            'streamer_name': None,
-            'stream_key': None
-        }
-        
-        # Notify all users that streaming stopped
-        emit('stream_stopped', {
-            'message': f'{streamer_name} stopped broadcasting'
-        }, broadcast=True)
+    stream = stream_registry.stop(request.sid)
+    if stream is not None:
+        streamer_name = stream['streamer_name']
+        watch_stream(request.sid, None)
+        sessions.set_role(request.sid, VIEWER)
+        close_stream(stream, f'{streamer_name} stopped broadcasting')
         
-        print(f"{streamer_name} stopped broadcasting")
+        event_log.info('broadcast_stopped', sid=request.sid,
+                       stream_id=stream['stream_id'],
+                       streamer_name=streamer_name)
         return {'success': True, 'message': 'Broadcasting stopped'}
     else:
         return {'success': False, 'message': 'You are not currently broadcasting'}
 
 @socketio.on('webrtc_offer')
+@rate_limit('webrtc_offer')
 def handle_webrtc_offer(data):
     """Handle WebRTC offer for peer-to-peer streaming"""
-    # Broadcast the offer to all other users except sender
-    emit('webrtc_offer', {
-        'offer': data['offer'],
-        'streamer_id': request.sid,
-        'streamer_name': data.get('streamer_name', 'Anonymous')
-    }, broadcast=True, include_self=False)
+    stream = stream_registry.get_by_streamer(request.sid)
+    if stream is None:
+        return
+    streamer_name = data.get('streamer_name', 'Anonymous')
+    if not data.get('offer'):
+        return {'success': False, 'message': 'No offer'}
+    if data.get('viewer_id'):
+        # Offer for one viewer's session
+        if not signaling.send_offer(stream, data['viewer_id'], data['offer'],
+                                    streamer_name):
+            return {'success': False, 'message': 'No session with that viewer'}
+    else:
+        # The stream's current offer, cached for viewers who join later
+        signaling.publish_offer(stream, data['offer'], streamer_name)
+    return {'success': True}
+
+@socketio.on('webrtc_join')
+def handle_webrtc_join(data=None):
+    """Ask the broadcaster of a stream for a WebRTC session"""
+    stream_id = (data or {}).get('stream_id') or sessions.stream_of(request.sid)
+    stream = stream_registry.get(stream_id) if stream_id else None
+    if stream is None:
+        return {'success': False, 'message': 'Stream not found'}
+    if stream['streamer_id'] == request.sid:
+        return {'success': False, 'message': 'You are the broadcaster'}
+    has_offer = signaling.join(request.sid, stream)
+    return {'success': True, 'streamer_id': stream['streamer_id'],
+            'cached_offer': has_offer}
+
+@socketio.on('webrtc_leave')
+def handle_webrtc_leave(data=None):
+    """Close the socket's WebRTC session"""
+    signaling.leave(request.sid)
+    return {'success': True}
 
 @socketio.on('webrtc_answer')
 def handle_webrtc_answer(data):
     """Handle WebRTC answer"""
-    # Send answer back to the streamer
-    emit('webrtc_answer', {
-        'answer': data['answer'],
-        'viewer_id': request.sid
-    }, room=data['streamer_id'])
+    # Send answer back to the streamer of this viewer's session
+    if not data.get('answer') or not signaling.answer(
+            request.sid, data.get('streamer_id'), data['answer']):
+        return {'success': False, 'message': 'No session with that streamer'}
+    return {'success': True}
 
 @socketio.on('webrtc_ice_candidate')
+@rate_limit('webrtc_ice_candidate')
 def handle_ice_candidate(data):
     """Handle ICE candidate exchange"""
-    # Forward ICE candidate to the target peer
+    # Queue the candidate for the target peer; a broadcaster's untargeted
+    # candidates belong to its cached offer. A null candidate ends the list.
     target_id = data.get('target_id')
-    if target_id:
-        emit('webrtc_ice_candidate', {
-            'candidate': data['candidate'],
-            'from_id': request.sid
-        }, room=target_id)
+    stream = None if target_id else \
+        stream_registry.get_by_streamer(request.sid)
+    if not signaling.candidate(request.sid, data.get('candidate'), target_id,
+                               stream):
+        return {'success': False, 'message': 'No session with that peer'}
+    return {'success': True}
+
+@socketio.on('sfu_publish')
+def handle_sfu_publish(data):
+    """Publish the broadcaster's tracks to the server's SFU"""
+    if sfu is None:
+        return {'success': False, 'message': 'SFU mode is off'}
+    stream = stream_registry.get_by_streamer(request.sid)
+    if stream is None:
+        return {'success': False, 'message': 'You are not broadcasting'}
+    try:
+        answer = sfu.publish(stream['stream_id'], data['offer'])
+    except Exception as e:
+        event_log.warning('sfu_publish_failed', sid=request.sid,
+                          stream_id=stream['stream_id'], error=str(e))
+        return {'success': False, 'message': 'Could not publish to the SFU'}
+    event_log.info('sfu_published', sid=request.sid,
+                   stream_id=stream['stream_id'])
+    return {'success': True, 'answer': answer}
+
+@socketio.on('sfu_subscribe')
+def handle_sfu_subscribe(data):
+    """Receive a stream from the server's SFU"""
+    if sfu is None:
+        return {'success': False, 'message': 'SFU mode is off'}
+    stream_id = data.get('stream_id') or sessions.stream_of(request.sid)
+    if not stream_id:
+        return {'success': False, 'message': 'Stream not found'}
+    try:
+        answer = sfu.subscribe(stream_id, request.sid, data['offer'])
+    except LookupError as e:
+        return {'success': False, 'message': str(e)}
+    except Exception as e:
+        event_log.warning('sfu_subscribe_failed', sid=request.sid,
+                          stream_id=stream_id, error=str(e))
+        return {'success': False, 'message': 'Could not subscribe'}
+    return {'success': True, 'answer': answer}
+
+@socketio.on('sfu_unsubscribe')
+def handle_sfu_unsubscribe(data=None):
+    if sfu is not None:
+        sfu.unsubscribe(request.sid)
+    return {'success': True}
+
+# Prometheus metrics; every handler above is timed from here on
+metrics = Metrics()
+instrument_socketio(socketio, metrics, broadcaster=broadcaster)
+
+def sockets_by_transport():
+    counts = {'websocket': 0, 'polling': 0}
+    for eio_socket in list(socketio.server.eio.sockets.values()):
+        counts['websocket' if eio_socket.upgraded else 'polling'] += 1
+    return [({'transport': t}, n) for t, n in counts.items()]
+
+def outbound_queue_depths():
+    return [eio_socket.queue.qsize()
+            for eio_socket in list(socketio.server.eio.sockets.values())]
+
+metrics.gauge('socketio_connected_sockets', 'Connected sockets by transport',
+              sockets_by_transport)
+metrics.gauge('socketio_outbound_queued_packets',
+              'Packets waiting in Engine.IO send queues',
+              lambda: sum(outbound_queue_depths()))
+metrics.gauge('socketio_outbound_queue_max',
+              'Longest Engine.IO send queue',
+              lambda: max(outbound_queue_depths(), default=0))
+metrics.gauge('sessions', 'Sessions on this worker by role',
+              lambda: [({'role': role}, len(sids))
+                       for role, sids in sessions.by_role.items()])
+metrics.gauge('socketio_slow_consumers',
+              'Clients whose send queue is full',
+              lambda: slow_consumers.full)
+metrics.gauge('socketio_outbound_lag_seconds_max',
+              'Age of the oldest packet waiting for any client',
+              lambda: slow_consumers.max_seen_lag)
+metrics.gauge('socketio_outbound_dropped_total',
+              'Events dropped from full send queues',
+              lambda: slow_consumers.dropped, type='counter')
+metrics.gauge('socketio_outbound_collapsed_total',
+              'Queued state events replaced by a newer value',
+              lambda: slow_consumers.collapsed, type='counter')
+metrics.gauge('socketio_slow_consumer_disconnects_total',
+              'Clients disconnected for lagging too long',
+              lambda: slow_consumers.disconnected, type='counter')
+metrics.gauge('admission_admitted_total', 'Connections accepted by role',
+              lambda: [({'role': role}, n)
+                       for role, n in admission.admitted.items()],
+              type='counter')
+metrics.gauge('admission_shed_total', 'Handshakes turned away with a 503',
+              lambda: admission.shed, type='counter')
+metrics.gauge('admission_refused_total', 'Connections sent to the waiting room',
+              lambda: admission.refused, type='counter')
+metrics.gauge('admission_waiting', 'Tickets in the waiting room',
+              lambda: len(admission.waiting))
+if admission.max_lag:
+    metrics.gauge('event_loop_lag_seconds',
+                  'How late the event loop runs timers',
+                  lambda: admission.lag)
+if abr is not None:
+    metrics.gauge('abr_renditions_running', 'Transcoded renditions running',
+                  lambda: sum(len(s['running'])
+                              for s in abr.stats()['streams'].values()))
+    metrics.gauge('abr_cpu_cost', 'Estimated cores used by transcodes',
+                  lambda: abr.running_cost())
+    metrics.gauge('abr_cpu_utilization', 'Machine CPU use seen by the ABR scheduler',
+                  lambda: abr.utilization)
+    metrics.gauge('abr_degraded_total', 'Renditions dropped for CPU pressure',
+                  lambda: abr.degraded, type='counter')
+metrics.gauge('streams_active', 'Live streams',
+              lambda: len(stream_registry.list()))
+metrics.gauge('stream_info_held', 'Requests waiting for a stream change',
+              lambda: stream_info_server.held)
+metrics.gauge('rtmp_server_up', 'Whether the RTMP server process is running',
+              lambda: int(rtmp_supervisor.running))
+metrics.gauge('rtmp_server_healthy', 'Whether the RTMP ports accept connections',
+              lambda: int(rtmp_supervisor.healthy))
+metrics.gauge('rtmp_server_restarts_total', 'RTMP server restarts',
+              lambda: rtmp_supervisor.restarts, type='counter')
+metrics.gauge('rate_limited_events_total', 'Events rejected by rate limits',
+              lambda: [({'event': e}, n)
+                       for e, n in rate_limiter.rejected.items()],
+              type='counter')
+metrics.gauge('event_log_dropped_total', 'Log records dropped on overflow',
+              lambda: event_log.dropped, type='counter')
+if chat_log is not None:
+    metrics.gauge('chat_log_written_total', 'Chat messages written to disk',
+                  lambda: chat_log.written, type='counter')
+    metrics.gauge('chat_log_dropped_total', 'Chat messages dropped on overflow',
+                  lambda: chat_log.dropped, type='counter')
+    metrics.gauge('chat_log_failed_total',
+                  'Chat messages lost to failed writes',
+                  lambda: chat_log.failed, type='counter')
+    metrics.gauge('chat_log_queued', 'Chat messages waiting to be written',
+                  lambda: chat_log.stats()['queued'])
+
+if sfu is not None:
+    metrics.gauge('sfu_subscribers', 'Viewers fed by the SFU',
+                  lambda: len(sfu.subscriptions))
+    metrics.gauge('sfu_frames_forwarded_total', 'Frames sent to SFU viewers',
+                  lambda: sfu.forwarded, type='counter')
+    metrics.gauge('sfu_frames_dropped_total',
+                  'Frames skipped for slow or joining SFU viewers',
+                  lambda: sfu.dropped, type='counter')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Front-end files are loaded, hashed and compressed once at startup
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'))
+
+def render_index():
+    """Render the page once; it only depends on startup configuration"""
+    with app.app_context():
+        html = render_template('index.html', transports=transports,
+                               serializer=serializer,
+                               webrtc_mode=WEBRTC_MODE,
+                               asset_url=static_assets.url)
+    return Asset(html.encode('utf-8'), 'text/html')
+
+index_page = render_index()
 
 @app.route('/')
 def index():
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <script src="https://cdn.jsdelivr.net/npm/hls.js@latest"></script>
-        <title>Camera + Chat</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                margin: 20px;
-            }
-            #container {
-                display: flex;
-                gap: 20px;
-                max-width: 1200px;
-                margin: 0 auto;
-            }
-            #video-container {
-                flex: 2;
-            }
-            #chat-container {
-                flex: 1;
-                min-width: 300px;
-            }
-            #video-feed, #user-video {
-                width: 100%;
-                background: #000;
-                border-radius: 8px;
-                margin-bottom: 10px;
-            }
-            #user-video {
-                max-height: 300px;
-                object-fit: cover;
-            }
-            .video-section {
-                margin-bottom: 20px;
-            }
-            .video-section h3 {
-                margin-bottom: 10px;
-                color: #333;
-            }
-            #camera-controls {
-                margin-bottom: 10px;
-            }
-            #camera-controls button {
-                margin-right: 10px;
-                padding: 8px 16px;
-                background: #28a745;
-                color: white;
-                border: none;
-                border-radius: 4px;
-                cursor: pointer;
-            }
-            #camera-controls button:hover {
-                background: #218838;
-            }
-            #camera-controls button:disabled {
-                background: #6c757d;
-                cursor: not-allowed;
-            }
-            .stop-btn {
-                background: #dc3545 !important;
-            }
-            .stop-btn:hover {
-                background: #c82333 !important;
-            }
-            #chat-box {
-                height: 400px;
-                overflow-y: auto;
-                border: 1px solid #ddd;
-                padding: 10px;
-                margin-bottom: 10px;
-                background: #f9f9f9;
-                border-radius: 8px;
-                font-size: 14px;
-            }
-            #chat-form {
-                display: flex;
-                gap: 10px;
-                flex-wrap: wrap;
-            }
-            #user {
-                width: 100px;
-                padding: 8px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }
-            #message {
-                flex: 1;
-                min-width: 150px;
-                padding: 8px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }
-            button {
-                padding: 8px 16px;
-                background: #007bff;
-                color: white;
-                border: none;
-                border-radius: 4px;
-                cursor: pointer;
-            }
-            button:hover {
-                background: #0056b3;
-            }
-            .message {
-                margin-bottom: 5px;
-                padding: 5px;
-                border-radius: 4px;
-            }
-            .status {
-                color: #666;
-                font-style: italic;
-            }
-            .connection-status {
-                padding: 5px 10px;
-                margin-bottom: 10px;
-                border-radius: 4px;
-                font-size: 12px;
-            }
-            .connected {
-                background: #d4edda;
-                color: #155724;
-            }
-            .disconnected {
-                background: #f8d7da;
-                color: #721c24;
-            }
-            .viewer-count {
-                padding: 5px 10px;
-                margin-bottom: 10px;
-                background: #e7f3ff;
-                color: #0c5460;
-                border-radius: 4px;
-                font-size: 12px;
-                text-align: center;
-                font-weight: bold;
-            }
-            .camera-error {
-                color: #721c24;
-                background: #f8d7da;
-                padding: 10px;
-                border-radius: 4px;
-                margin-bottom: 10px;
-            }
-            .broadcast-controls {
-                margin: 10px 0;
-            }
-            .broadcast-controls button {
-                margin-right: 10px;
-                margin-bottom: 5px;
-            }
-            .stream-status {
-                padding: 10px;
-                margin: 10px 0;
-                border-radius: 4px;
-                font-weight: bold;
-                text-align: center;
-            }
-            .stream-active {
-                background: #d4edda;
-                color: #155724;
-            }
-            .stream-inactive {
-                background: #f8d7da;
-                color: #721c24;
-            }
-            .modal {
-                position: fixed;
-                z-index: 1000;
-                left: 0;
-                top: 0;
-                width: 100%;
-                height: 100%;
-                background-color: rgba(0,0,0,0.5);
-            }
-            .modal-content {
-                background-color: #fefefe;
-                margin: 15% auto;
-                padding: 20px;
-                border-radius: 8px;
-                width: 80%;
-                max-width: 600px;
-            }
-            .close {
-                color: #aaa;
-                float: right;
-                font-size: 28px;
-                font-weight: bold;
-                cursor: pointer;
-            }
-            .close:hover {
-                color: black;
-            }
-            .rtmp-info {
-                background: #f8f9fa;
-                padding: 15px;
-                border-radius: 4px;
-                margin: 10px 0;
-                font-family: monospace;
-            }
-            .broadcasting {
-                background: #dc3545 !important;
-                animation: pulse 2s infinite;
-            }
-            @keyframes pulse {
-                0% { opacity: 1; }
-                50% { opacity: 0.7; }
-                100% { opacity: 1; }
-            }
-        </style>
-    </head>
-    <body>
-        <h1>Live Camera with Chat</h1>
-        <div id="container">
-            <div id="video-container">
-                <div class="video-section">
-                    <h3>🔴 Live Stream</h3>
-                    <div id="stream-status" class="stream-status">
-                        No one is streaming
-                    </div>
-                    
-                    <!-- Broadcast Controls -->
-                    <div id="broadcast-controls" class="broadcast-controls">
-                        <button id="start-broadcast" onclick="startBroadcast()">📹 Start Broadcasting</button>
-                        <button id="stop-broadcast" onclick="stopBroadcast()" disabled>⏹️ Stop Broadcasting</button>
-                        <button id="get-rtmp-info" onclick="getRTMPInfo()">📡 Get RTMP Info</button>
-                    </div>
-                    
-                    <!-- Stream Display -->
-                    <video id="stream-video" autoplay playsinline controls style="display: none; width: 100%; max-height: 400px; background: #000; border-radius: 8px;">
-                        Your browser doesn't support video playback.
-                    </video>
-                    
-                    <!-- RTMP Info Modal -->
-                    <div id="rtmp-modal" class="modal" style="display: none;">
-                        <div class="modal-content">
-                            <span class="close" onclick="closeRTMPModal()">&times;</span>
-                            <h3>📡 RTMP Streaming Setup</h3>
-                            <div id="rtmp-info"></div>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="video-section">
-                    <h3>Your Camera (Preview)</h3>
-                    <div id="camera-controls">
-                        <button id="start-camera" onclick="startCamera()">Start Camera</button>
-                        <button id="stop-camera" onclick="stopCamera()" class="stop-btn" disabled>Stop Camera</button>
-                    </div>
-                    <video id="user-video" autoplay playsinline muted style="max-height: 250px;"></video>
-                    <div id="camera-error" class="camera-error" style="display: none;">
-                        Camera access denied or not available. Please allow camera access and try again.
-                    </div>
-                </div>
-            </div>
-            <div id="chat-container">
-                <div id="connection-status" class="connection-status disconnected">
-                    Disconnected
-                </div>
-                <div id="viewer-count" class="viewer-count">
-                    👥 0 viewers online
-                </div>
-                <div id="chat-box"></div>
-                <form id="chat-form" onsubmit="sendMessage(event)">
-                    <input id="user" type="text" placeholder="Your name" required>
-                    <input id="message" type="text" placeholder="Type message" required>
-                    <button type="submit">Send</button>
-                </form>
-            </div>
-        </div>
-
-        <script src="https://cdn.socket.io/4.5.4/socket.io.min.js"></script>
-        <script>
-            // Enhanced connection with fallback options
-            const socket = io({
-                transports: ['websocket', 'polling'],
-                upgrade: true,
-                rememberUpgrade: true,
-                timeout: 5000,
-                forceNew: true
-            });
-            
-            const chatBox = document.getElementById('chat-box');
-            const statusDiv = document.getElementById('connection-status');
-            const viewerCountDiv = document.getElementById('viewer-count');
-            const userVideo = document.getElementById('user-video');
-            const streamVideo = document.getElementById('stream-video');
-            const streamStatus = document.getElementById('stream-status');
-            const startBroadcastBtn = document.getElementById('start-broadcast');
-            const stopBroadcastBtn = document.getElementById('stop-broadcast');
-            const startBtn = document.getElementById('start-camera');
-            const stopBtn = document.getElementById('stop-camera');
-            const cameraError = document.getElementById('camera-error');
-            
-            let mediaStream = null;
-            let peerConnection = null;
-            let isBroadcasting = false;
-            let currentStreamInfo = { active: false };
-            let hlsPlayer = null;
-            
-            // WebRTC configuration
-            const rtcConfig = {
-                iceServers: [
-                    { urls: 'stun:stun.l.google.com:19302' },
-                    { urls: 'stun:stun1.l.google.com:19302' }
-                ]
-            };
-            
-            // Broadcasting functions
-            async function startBroadcast() {
-                const userName = document.getElementById('user').value.trim() || 'Anonymous';
-                
-                try {
-                    if (!mediaStream) {
-                        await startCamera();
-                    }
-                    
-                    // Get RTMP key first
-                    const rtmpResponse = await fetch('/stream/rtmp-key');
-                    const rtmpData = await rtmpResponse.json();
-                    
-                    const response = await new Promise((resolve) => {
-                        socket.emit('start_broadcast', { 
-                            user_name: userName,
-                            stream_key: rtmpData.stream_key 
-                        }, resolve);
-                    });
-                    
-                    if (response.success) {
-                        isBroadcasting = true;
-                        startBroadcastBtn.disabled = true;
-                        stopBroadcastBtn.disabled = false;
-                        startBroadcastBtn.classList.add('broadcasting');
-                        
-                        // Start WebRTC broadcasting
-                        await setupWebRTCBroadcast(userName);
-                        
-                        addMessage('System', 'You are now broadcasting!', 'status');
-                    } else {
-                        alert(response.message);
-                    }
-                } catch (error) {
-                    console.error('Error starting broadcast:', error);
-                    alert('Failed to start broadcasting');
-                }
-            }
-            
-            async function stopBroadcast() {
-                const response = await new Promise((resolve) => {
-                    socket.emit('stop_broadcast', {}, resolve);
-                });
-                
-                if (response.success) {
-                    isBroadcasting = false;
-                    startBroadcastBtn.disabled = false;
-                    stopBroadcastBtn.disabled = true;
-                    startBroadcastBtn.classList.remove('broadcasting');
-                    
-                    // Stop WebRTC
-                    if (peerConnection) {
-                        peerConnection.close();
-                        peerConnection = null;
-                    }
-                    
-                    addMessage('System', 'Broadcasting stopped', 'status');
-                }
-            }
-            
-            async function setupWebRTCBroadcast(userName) {
-                try {
-                    peerConnection = new RTCPeerConnection(rtcConfig);
-                    
-                    // Add local stream to peer connection
-                    mediaStream.getTracks().forEach(track => {
-                        peerConnection.addTrack(track, mediaStream);
-                    });
-                    
-                    // Create and send offer
-                    const offer = await peerConnection.createOffer();
-                    await peerConnection.setLocalDescription(offer);
-                    
-                    socket.emit('webrtc_offer', {
-                        offer: offer,
-                        streamer_name: userName
-                    });
-                    
-                } catch (error) {
-                    console.error('Error setting up WebRTC:', error);
-                }
-            }
-            
-            async function getRTMPInfo() {
-                try {
-                    const response = await fetch('/stream/rtmp-key');
-                    const data = await response.json();
-                    
-                    const modal = document.getElementById('rtmp-modal');
-                    const infoDiv = document.getElementById('rtmp-info');
-                    
-                    infoDiv.innerHTML = `
-                        <div class="rtmp-info">
-                            <h4>📺 For OBS Studio:</h4>
-                            <p><strong>Server:</strong> ${data.rtmp_url}</p>
-                            <p><strong>Stream Key:</strong> ${data.stream_key}</p>
-                        </div>
-                        
-                        <div class="rtmp-info">
-                            <h4>📱 Setup Instructions:</h4>
-                            <ol>
-                                <li>Open OBS Studio</li>
-                                <li>Go to Settings → Stream</li>
-                                <li>Service: Custom</li>
-                                <li>Server: <code>${data.rtmp_url}</code></li>
-                                <li>Stream Key: <code>${data.stream_key}</code></li>
-                                <li>Click OK and Start Streaming!</li>
-                            </ol>
-                        </div>
-                        
-                        <div class="rtmp-info">
-                            <h4>🎬 Alternative Software:</h4>
-                            <p>You can use any RTMP-compatible software like Streamlabs, XSplit, or mobile apps with these same settings.</p>
-                        </div>
-                        
-                        <div class="rtmp-info">
-                            <p><strong>Note:</strong> Currently using WebRTC for browser-to-browser streaming. RTMP server integration coming soon!</p>
-                        </div>
-                    `;
-                    
-                    modal.style.display = 'block';
-                } catch (error) {
-                    console.error('Error getting RTMP info:', error);
-                    alert('Failed to get RTMP information');
-                }
-            }
-            
-            function closeRTMPModal() {
-                document.getElementById('rtmp-modal').style.display = 'none';
-            }
-            
-            // Camera functions
-            async function startCamera() {
-                try {
-                    cameraError.style.display = 'none';
-                    
-                    mediaStream = await navigator.mediaDevices.getUserMedia({
-                        video: {
-                            width: { ideal: 640 },
-                            height: { ideal: 480 },
-                            facingMode: 'user'
-                        },
-                        audio: false
-                    });
-                    
-                    userVideo.srcObject = mediaStream;
-                    startBtn.disabled = true;
-                    stopBtn.disabled = false;
-                    
-                    addMessage('System', 'Camera started successfully', 'status');
-                    
-                } catch (error) {
-                    console.error('Error accessing camera:', error);
-                    cameraError.style.display = 'block';
-                    cameraError.textContent = `Camera error: ${error.message}`;
-                    addMessage('System', 'Failed to access camera', 'status');
-                }
-            }
-            
-            function stopCamera() {
-                if (mediaStream) {
-                    mediaStream.getTracks().forEach(track => track.stop());
-                    mediaStream = null;
-                }
-                userVideo.srcObject = null;
-                startBtn.disabled = false;
-                stopBtn.disabled = true;
-                cameraError.style.display = 'none';
-                
-                addMessage('System', 'Camera stopped', 'status');
-            }
-            
-            // Auto-start camera on page load
-            window.addEventListener('load', () => {
-                startCamera();
-            });
-            
-            // More detailed connection logging
-            socket.on('connect', () => {
-                console.log('Connected to WebSocket server with transport:', socket.io.engine.transport.name);
-                statusDiv.textContent = `Connected (${socket.io.engine.transport.name})`;
-                statusDiv.className = 'connection-status connected';
-                
-                // Add a system message
-                addMessage('System', 'Connected to chat', 'status');
-            });
-            
-            socket.on('disconnect', (reason) => {
-                console.log('Disconnected from WebSocket server. Reason:', reason);
-                statusDiv.textContent = `Disconnected (${reason})`;
-                statusDiv.className = 'connection-status disconnected';
-                
-                // Add a system message
-                addMessage('System', `Disconnected: ${reason}`, 'status');
-            });
-            
-            // Transport upgrade logging
-            socket.io.on('upgrade', () => {
-                console.log('Upgraded to transport:', socket.io.engine.transport.name);
-            });
-            
-            // Handle viewer count updates
-            socket.on('viewer_count', (data) => {
-                console.log('Viewer count update:', data.count);
-                const plural = data.count === 1 ? 'viewer' : 'viewers';
-                viewerCountDiv.textContent = `👥 ${data.count} ${plural} online`;
-            });
-            
-            // Handle stream events
-            socket.on('stream_started', (data) => {
-                console.log('Stream started:', data);
-                streamStatus.textContent = `🔴 LIVE: ${data.streamer_name}`;
-                streamStatus.className = 'stream-status stream-active';
-                addMessage('System', data.message, 'status');
-                
-                if (!isBroadcasting && data.stream_key) {
-                    setupHLSPlayback(data.stream_key);
-                }
-            });
-            
-            socket.on('stream_stopped', (data) => {
-                console.log('Stream stopped:', data);
-                streamStatus.textContent = 'No one is streaming';
-                streamStatus.className = 'stream-status stream-inactive';
-                streamVideo.style.display = 'none';
-                
-                // Clean up HLS player if it exists
-                if (hlsPlayer) {
-                    hlsPlayer.destroy();
-                    hlsPlayer = null;
-                }
-                
-                addMessage('System', data.message, 'status');
-            });
-            
-            socket.on('stream_info', (data) => {
-                currentStreamInfo = data;
-                if (data.active) {
-                    streamStatus.textContent = `🔴 LIVE: ${data.streamer_name}`;
-                    streamStatus.className = 'stream-status stream-active';
-                    
-                    if (!isBroadcasting && data.stream_key) {
-                        setupHLSPlayback(data.stream_key);
-                    }
-                } else {
-                    streamStatus.textContent = 'No one is streaming';
-                    streamStatus.className = 'stream-status stream-inactive';
-                    streamVideo.style.display = 'none';
-                }
-            });
-            
-            function setupHLSPlayback(streamKey) {
-                                    const host = window.location.hostname;
-    const hlsUrl = `http://${host}:8000/live/${streamKey}/index.m3u8`;
-    
-    console.log('Setting up HLS playback from:', hlsUrl);
-                const appUrl = window.location.href.split('/').slice(0, 3).join('/');
-                
-                console.log('Setting up HLS playback from:', hlsUrl);
-                
-                if (Hls.isSupported()) {
-                    if (hlsPlayer) {
-                        hlsPlayer.destroy();
-                    }
-                    
-                    hlsPlayer = new Hls();
-                    hlsPlayer.loadSource(hlsUrl);
-                    hlsPlayer.attachMedia(streamVideo);
-                    hlsPlayer.on(Hls.Events.MANIFEST_PARSED, function() {
-                        streamVideo.play().catch(e => console.error('Error playing video:', e));
-                        streamVideo.style.display = 'block';
-                    });
-                    
-                    hlsPlayer.on(Hls.Events.ERROR, function(event, data) {
-                        console.error('HLS Error:', data);
-                        if (data.fatal) {
-                            switch(data.type) {
-                                case Hls.ErrorTypes.NETWORK_ERROR:
-                                    console.error('Fatal network error encountered, trying to recover');
-                                    hlsPlayer.startLoad();
-                                    break;
-                                case Hls.ErrorTypes.MEDIA_ERROR:
-                                    console.error('Fatal media error encountered, trying to recover');
-                                    hlsPlayer.recoverMediaError();
-                                    break;
-                                default:
-                                    console.error('Unrecoverable error encountered');
-                                    setupHLSPlayback(streamKey);
-                                    break;
-                            }
-                        }
-                    });
-                } else if (streamVideo.canPlayType('application/vnd.apple.mpegurl')) {
-                    // For Safari
-                    streamVideo.src = hlsUrl;
-                    streamVideo.addEventListener('loadedmetadata', function() {
-                        streamVideo.play().catch(e => console.error('Error playing video:', e));
-                        streamVideo.style.display = 'block';
-                    });
-                } else {
-                    console.error('HLS is not supported in this browser');
-                }
-            }
-            
-            // WebRTC handling for viewers
-            socket.on('webrtc_offer', async (data) => {
-                if (data.streamer_id !== socket.id) {
-                    console.log('Received WebRTC offer from:', data.streamer_name);
-                    
-                    try {
-                        const viewerPeerConnection = new RTCPeerConnection(rtcConfig);
-                        
-                        // Handle incoming stream
-                        viewerPeerConnection.ontrack = (event) => {
-                            console.log('Received remote stream');
-                            streamVideo.srcObject = event.streams[0];
-                            streamVideo.style.display = 'block';
-                        };
-                        
-                        await viewerPeerConnection.setRemoteDescription(new RTCSessionDescription(data.offer));
-                        const answer = await viewerPeerConnection.createAnswer();
-                        await viewerPeerConnection.setLocalDescription(answer);
-                        
-                        socket.emit('webrtc_answer', {
-                            answer: answer,
-                            streamer_id: data.streamer_id
-                        });
-                        
-                    } catch (error) {
-                        console.error('Error handling WebRTC offer:', error);
-                    }
-                }
-            });
-            
-            // Handle status messages
-            socket.on('status', (data) => {
-                console.log('Status:', data);
-                addMessage('System', data.msg, 'status');
-            });
-            
-            // Handle chat messages
-            socket.on('chat_message', (data) => {
-                console.log('Received message:', data);
-                addMessage(data.user, data.msg);
-            });
-            
-            function addMessage(user, msg, type = 'message') {
-                const msgElement = document.createElement('div');
-                msgElement.className = `message ${type}`;
-                msgElement.innerHTML = `<strong>${user}:</strong> ${msg}`;
-                chatBox.appendChild(msgElement);
-                chatBox.scrollTop = chatBox.scrollHeight;
-            }
-            
-            function sendMessage(event) {
-                event.preventDefault(); // Prevent form submission
-                
-                const user = document.getElementById('user').value.trim();
-                const msg = document.getElementById('message').value.trim();
-                
-                if (user && msg) {
-                    if (socket.connected) {
-                        console.log('Sending message:', {user, msg});
-                        socket.emit('chat_message', {user, msg});
-                        document.getElementById('message').value = '';
-                    } else {
-                        alert('Not connected to server. Please wait for reconnection.');
-                    }
-                } else {
-                    alert('Please enter both name and message');
-                }
-            }
-            
-            // Allow Enter key to send message
-            document.getElementById('message').addEventListener('keypress', (e) => {
-                if (e.key === 'Enter') {
-                    sendMessage(e);
-                }
-            });
-            
-            // Handle connection errors with more detail
-            socket.on('connect_error', (error) => {
-                console.error('Connection error:', error);
-                statusDiv.textContent = `Connection Error: ${error.message}`;
-                statusDiv.className = 'connection-status disconnected';
-                addMessage('System', `Connection error: ${error.message}`, 'status');
-            });
-            
-            // Handle reconnection attempts
-            socket.on('reconnect_attempt', (attemptNumber) => {
-                console.log('Reconnection attempt:', attemptNumber);
-                statusDiv.textContent = `Reconnecting... (attempt ${attemptNumber})`;
-                addMessage('System', `Reconnecting... (attempt ${attemptNumber})`, 'status');
-            });
-            
-            socket.on('reconnect', (attemptNumber) => {
-                console.log('Reconnected after', attemptNumber, 'attempts');
-                addMessage('System', `Reconnected after ${attemptNumber} attempts`, 'status');
-            });
-            
-            // Clean up camera on page unload
-            window.addEventListener('beforeunload', () => {
-                stopCamera();
-                if (hlsPlayer) {
-                    hlsPlayer.destroy();
-                }
-            });
-        </script>
-    </body>
-    </html>
-    ''')
+    # Revalidated on every visit so deploys show up at once, but a returning
+    # viewer only costs a 304
+    return index_page.response('no-cache')
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    return static_assets.response(filename)
 
 if __name__ == '__main__':
     print('Starting server...')
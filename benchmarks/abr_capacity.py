@@ -0,0 +1,234 @@
+"""Concurrent ABR-transcoded streams per core.
+
+Runs the ABR scheduler (abr.py) in this process on synthetic sources: ffmpeg
+reads a `--source` lavfi test pattern with a tone in real time, as it would
+an RTMP stream. Every rendition of the ladder is kept watched. For 1 to
+`--streams` streams, in each mode:
+
+- `unmanaged`: no budget and no CPU ceilings, every rendition runs
+- `managed`: the scheduler's budget (`--cpu-target` of the cores) and its
+  degradation above 90% CPU
+
+After `--warmup` seconds it measures for `--seconds` the machine's CPU, the
+renditions running and how fast each one writes media against the wall
+clock (a rendition keeps up at 0.95 or better). Streams per core is the most
+streams whose renditions all kept up, over the cores.
+
+`--calibrate` first runs each rendition alone and fits the cost model
+(ABR_DECODE_COST and ABR_PIXELS_PER_CORE) to the CPU it used.
+
+    python benchmarks/abr_capacity.py --streams 4 --calibrate
+"""
+import argparse
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import eventlet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from flask_socketio import SocketIO  # noqa: E402
+
+from abr import ABRScheduler, DEFAULT_LADDER, CPUMeter  # noqa: E402
+from event_log import EventLog  # noqa: E402
+from state_store import MemoryStateStore  # noqa: E402
+
+SEGMENT_RE = re.compile(r'^index(\d+)\.ts$')
+
+
+def source_args(args):
+    def input_args(source):
+        return ['-re', '-f', 'lavfi', '-i',
+                f'testsrc2=size={args.source}:rate={args.fps}[out0];'
+                f'sine=frequency=440[out1]']
+    return input_args
+
+
+def newest_segment(folder):
+    """(number, mtime) of the newest finished segment, or None"""
+    newest = None
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return None
+    for entry in entries:
+        match = SEGMENT_RE.match(entry.name)
+        if match and (newest is None or int(match[1]) > newest[0]):
+            try:
+                newest = (int(match[1]), entry.stat().st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+
+def process_cpu(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except FileNotFoundError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def make_scheduler(args, media_root, managed, ladder=None):
+    socketio = SocketIO(Flask(__name__), async_mode='eventlet')
+    options = dict(ladder=ladder or args.ladder, ffmpeg=args.ffmpeg,
+                   preset=args.preset, fps=args.fps,
+                   pixels_per_core=args.pixels_per_core,
+                   decode_cost=args.decode_cost, idle_timeout=3600)
+    if managed:
+        options['cpu_target'] = args.cpu_target
+    else:
+        options.update(cpu_target=1000, cpu_high=2)
+    return ABRScheduler(socketio, MemoryStateStore(),
+                        EventLog(stream=io.StringIO(), level='warning'),
+                        media_root, source_args(args), **options)
+
+
+def measure(scheduler, args):
+    """Machine CPU, and each running rendition's media seconds per second"""
+    def watch():
+        for playback_id in scheduler.streams:
+            for rendition in scheduler.ladder:
+                scheduler.watched(playback_id, rendition.name)
+
+    deadline = time.monotonic() + args.warmup
+    while time.monotonic() < deadline:
+        watch()
+        eventlet.sleep(1)
+    meter = CPUMeter()
+    start = {}
+    for playback_id, transcodes in scheduler.streams.items():
+        for name, transcode in transcodes.items():
+            if transcode.process is not None:
+                start[playback_id, name] = newest_segment(
+                    scheduler._folder(playback_id, transcode.rendition))
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        watch()
+        eventlet.sleep(1)
+    cpu = meter.read()
+    speeds = {}
+    for (playback_id, name), first in start.items():
+        rendition = next(r for r in scheduler.ladder if r.name == name)
+        last = newest_segment(scheduler._folder(playback_id, rendition))
+        transcode = scheduler.streams[playback_id].get(name)
+        if transcode is None or transcode.process is None:
+            # Stopped during the measurement, by degradation
+            continue
+        if first is None or last is None or last[1] <= first[1]:
+            speeds[playback_id, name] = 0.0
+        else:
+            speeds[playback_id, name] = round(
+                (last[0] - first[0]) * scheduler.segment_time /
+                (last[1] - first[1]), 3)
+    return cpu, speeds
+
+
+def run(streams, managed, args):
+    media_root = tempfile.mkdtemp()
+    scheduler = make_scheduler(args, media_root, managed)
+    try:
+        for n in range(streams):
+            scheduler.publish(f'bench{n}', f'bench{n}')
+            for rendition in scheduler.ladder:
+                scheduler.watched(f'bench{n}', rendition.name)
+        # Start what the watched renditions ask for
+        scheduler.schedule(check_cpu=False)
+        cpu, speeds = measure(scheduler, args)
+        return {'streams': streams,
+                'mode': 'managed' if managed else 'unmanaged',
+                'cpu': round(cpu, 3),
+                'renditions': len(speeds),
+                'estimated_cores': round(scheduler.running_cost(), 2),
+                'running': sorted(len(s['running']) for s in
+                                  scheduler.stats()['streams'].values()),
+                'min_speed': min(speeds.values(), default=None),
+                'keeps_up': all(s >= 0.95 for s in speeds.values()),
+                'degraded': scheduler.degraded}
+    finally:
+        scheduler.stop()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def calibrate(args):
+    """Fit decode_cost and pixels_per_core to single renditions"""
+    points = []
+    for rendition in make_scheduler(args, '', False).ladder:
+        media_root = tempfile.mkdtemp()
+        scheduler = make_scheduler(args, media_root, False,
+                                   ladder=f'{rendition.name}:'
+                                   f'{rendition.width}x{rendition.height}:'
+                                   f'{rendition.bitrate}')
+        try:
+            scheduler.publish('calibrate', 'calibrate')
+            process = scheduler.streams['calibrate'][rendition.name].process
+            eventlet.sleep(args.warmup)
+            before = process_cpu(process.pid)
+            eventlet.sleep(args.seconds)
+            cores = (process_cpu(process.pid) - before) / args.seconds
+        finally:
+            scheduler.stop()
+            shutil.rmtree(media_root, ignore_errors=True)
+        pixels = rendition.width * rendition.height * args.fps
+        points.append((pixels, cores))
+        print(f'{rendition.name:>8}: {cores:.3f} cores', flush=True)
+    # Least squares line through (pixels per second, cores)
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / \
+        max(sum((x - mean_x) ** 2 for x, _ in points), 1)
+    decode_cost = max(mean_y - slope * mean_x, 0)
+    pixels_per_core = 1 / slope if slope > 0 else args.pixels_per_core
+    print(f'ABR_DECODE_COST={decode_cost:.3f} '
+          f'ABR_PIXELS_PER_CORE={pixels_per_core:.3g}', flush=True)
+    return decode_cost, pixels_per_core
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--ladder', default=DEFAULT_LADDER)
+    parser.add_argument('--source', default='1280x720')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--preset', default='veryfast')
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--pixels-per-core', type=float, default=84e6)
+    parser.add_argument('--decode-cost', type=float, default=0.14)
+    parser.add_argument('--cpu-target', type=float, default=0.8)
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--modes', default='unmanaged,managed')
+    parser.add_argument('--calibrate', action='store_true')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        args.decode_cost, args.pixels_per_core = calibrate(args)
+    cores = len(os.sched_getaffinity(0))
+    best = {}
+    for mode in [m for m in args.modes.split(',') if m]:
+        for streams in range(1, args.streams + 1):
+            result = run(streams, mode == 'managed', args)
+            if result['keeps_up']:
+                best[mode] = streams
+            print(f"{mode:>10} {streams} streams: {result['renditions']} "
+                  f"renditions (estimated {result['estimated_cores']} "
+                  f"cores), CPU {result['cpu']:.0%}, slowest at "
+                  f"{result['min_speed']}x real time"
+                  f"{'' if result['keeps_up'] else ' - falling behind'}, "
+                  f"{result['degraded']} degradations, renditions per "
+                  f"stream {result['running']}", flush=True)
+        print(f"{mode:>10}: {best.get(mode, 0) / cores:.2f} streams per core "
+              f"with every rendition keeping up ({cores} cores)", flush=True)
+
+
+if __name__ == '__main__':
+    main()
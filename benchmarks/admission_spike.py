@@ -0,0 +1,236 @@
+"""Latency for connected clients while a 10x connect spike arrives.
+
+Starts the app in a child process (see loadtest.py) and connects
+`--clients` websocket clients. `--probes` of them keep calling
+`get_viewer_count` (every `--interval`) and one sends chat (every
+`--chat-interval`), which measures ack round trips and chat delivery for
+clients that were already there. Then `--spike` times as many
+new clients connect at once from another process to watch a stream, so the
+probes' chat in the lobby doesn't fan out to them. Shed handshakes come back
+when the 503 says to; refused connects wait in line as the server tells them
+and retry with their ticket.
+
+Each mode is a fresh server: `off` admits everyone at once, `rate` caps
+accepts at `--rate` per second and `rate+lag` also pauses admission while the
+event loop lags more than `--max-lag-ms`. The report gives latency before,
+during and after the spike and how long the spike took to get in.
+
+    python benchmarks/admission_spike.py --clients 200 --spike 10
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+import eventlet
+
+# Imported from this directory; loadtest sets up the path to the app
+from loadtest import (ServerProcess, connect_all, disconnect_all,
+                      raise_fd_limit, summarize)
+from sio_client import WebSocketClient
+
+
+class WaitingClient(WebSocketClient):
+    """Keeps the server's refusal and can retry on the same connection"""
+    refusal = None
+    retries = 0
+    shed = 0
+
+    def _handshake(self):
+        """Open the websocket, coming back for as long as it is shed"""
+        while True:
+            try:
+                return self._open()
+            except ConnectionError as exc:
+                if ' 503 ' not in str(exc):
+                    raise
+            length = 0
+            while True:
+                line = self._rfile.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            retry_after = json.loads(self._rfile.read(length))['retry_after']
+            self._sock.close()
+            self.shed += 1
+            eventlet.sleep(retry_after)
+
+    def _handle_socketio(self, pkt):
+        if pkt[:1] == '4' and not self._connected.ready():
+            self.refusal = json.loads(pkt[1:]).get('data') or {}
+        super()._handle_socketio(pkt)
+
+    def join(self, auth, timeout):
+        """Connect, waiting in line for as long as the server asks"""
+        self._auth = auth
+        with eventlet.Timeout(timeout):
+            self._handshake()
+            sid = self._connected.wait()
+            while sid is None:
+                self.retries += 1
+                eventlet.sleep(self.refusal.get('retry_after', 1))
+                ticket = self.refusal.get('ticket') or self._auth.get('ticket')
+                self._auth = dict(auth, ticket=ticket)
+                self._connected = eventlet.event.Event()
+                self._send('40' + json.dumps(self._auth))
+                sid = self._connected.wait()
+        self.sid = sid
+        self.connected = True
+
+
+def spike(port, count, concurrency, timeout, stream_id, results):
+    """Runs in its own process so the probes' timings stay clean"""
+    raise_fd_limit()
+    joined, latencies, retries, shed, failures = [], [], [], [], [0]
+    start = time.perf_counter()
+
+    def join(_):
+        client = WaitingClient('127.0.0.1', port)
+        began = time.perf_counter()
+        try:
+            client.join({'chat_batch': True, 'stream_id': stream_id},
+                        timeout)
+        except (OSError, ConnectionError, eventlet.Timeout):
+            failures[0] += 1
+            return
+        latencies.append(time.perf_counter() - began)
+        retries.append(client.retries)
+        shed.append(client.shed)
+        joined.append(client)
+
+    pool = eventlet.GreenPool(concurrency)
+    for _ in pool.imap(join, range(count)):
+        pass
+    results.put({'joined': len(joined), 'failures': failures[0],
+                 'elapsed': round(time.perf_counter() - start, 1),
+                 'join_s': summarize(latencies),
+                 'max_retries': max(retries, default=0),
+                 'shed': sum(shed), 'max_shed': max(shed, default=0)})
+    # Stay connected until the parent has taken its last samples
+    eventlet.sleep(5)
+    for client in joined:
+        client._close()
+
+
+def run(mode, args):
+    env = {'LOG_LEVEL': 'warning', 'RATE_LIMITS': '',
+           'CHAT_BATCH_MODE': 'off'}
+    if mode != 'off':
+        env['ADMISSION_RATE'] = str(args.rate)
+    if mode == 'rate+lag':
+        env['ADMISSION_MAX_LAG_MS'] = str(args.max_lag_ms)
+    server = ServerProcess(env)
+    try:
+        # Existing clients get in before admission control has to act
+        clients = []
+        while len(clients) < args.clients:
+            batch, _ = connect_all(server, 'websocket',
+                                   min(args.rate // 2 or 50,
+                                       args.clients - len(clients)), 50)
+            clients += batch
+            eventlet.sleep(1)
+        probes = clients[:args.probes]
+        stream_id = clients[-1].call('start_broadcast',
+                                     {'user_name': 'bench'})['stream_id']
+        samples = []  # (phase, kind, seconds)
+        phase = ['before']
+
+        def on_chat(data):
+            if data.get('user') == 'probe':
+                samples.append((phase[0], 'chat',
+                                time.time() - float(data['msg'])))
+
+        probes[0].on('chat_message', on_chat)
+
+        def chat():
+            while phase[0] != 'done':
+                probes[1].emit('chat_message',
+                               {'user': 'probe', 'msg': repr(time.time())})
+                eventlet.sleep(args.chat_interval)
+
+        def probe(client):
+            while phase[0] != 'done':
+                start = time.perf_counter()
+                try:
+                    client.call('get_viewer_count', timeout=30)
+                except eventlet.Timeout:
+                    pass
+                samples.append((phase[0], 'ack',
+                                time.perf_counter() - start))
+                eventlet.sleep(args.interval)
+
+        for client in probes:
+            eventlet.spawn(probe, client)
+        eventlet.spawn(chat)
+        eventlet.sleep(args.settle)
+
+        # A fresh interpreter: a forked one would run our probes too
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        phase[0] = 'spike'
+        worker = context.Process(target=spike, args=(
+            server.port, args.clients * args.spike, args.concurrency,
+            args.timeout, stream_id, results))
+        worker.start()
+        while results.empty():
+            eventlet.sleep(0.1)
+        outcome = results.get()
+        phase[0] = 'after'
+        eventlet.sleep(args.settle)
+        phase[0] = 'done'
+        worker.join()
+
+        result = {'mode': mode}
+        for name in ('before', 'spike', 'after'):
+            for kind in ('ack', 'chat'):
+                result[f'{name}_{kind}_ms'] = summarize(
+                    [s for p, k, s in samples if p == name and k == kind])
+        result.update(outcome)
+        disconnect_all(clients)
+        return result
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--spike', type=int, default=10,
+                        help='new clients as a multiple of --clients')
+    parser.add_argument('--probes', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('--chat-interval', type=float, default=0.5)
+    parser.add_argument('--rate', type=int, default=100,
+                        help='ADMISSION_RATE for the rate modes')
+    parser.add_argument('--max-lag-ms', type=float, default=200)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--settle', type=float, default=3)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--modes', default='off,rate,rate+lag')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    print(f'{"mode":<10}{"phase":<8}{"acks":>6}{"ack p50":>9}{"p99":>9}'
+          f'{"p999":>9}{"chats":>7}{"chat p50":>10}{"p99":>9}{"p999":>9}'
+          f'   (ms)')
+    for mode in [m for m in args.modes.split(',') if m]:
+        result = run(mode, args)
+        for name in ('before', 'spike', 'after'):
+            ack = result[f'{name}_ack_ms']
+            chat = result[f'{name}_chat_ms']
+            print(f'{mode:<10}{name:<8}{ack["count"]:>6}{ack["p50"]!s:>9}'
+                  f'{ack["p99"]!s:>9}{ack["p999"]!s:>9}{chat["count"]:>7}'
+                  f'{chat["p50"]!s:>10}{chat["p99"]!s:>9}'
+                  f'{chat["p999"]!s:>9}', flush=True)
+        print(f'{"":<10}spike: {result["joined"]} joined in '
+              f'{result["elapsed"]} s, {result["failures"]} failed, '
+              f'join p50 {result["join_s"]["p50"]} ms, '
+              f'{result["shed"]} handshakes shed (at most '
+              f'{result["max_shed"]} per client), at most '
+              f'{result["max_retries"]} waiting-room retries', flush=True)
+
+
+if __name__ == '__main__':
+    main()
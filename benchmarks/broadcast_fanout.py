@@ -0,0 +1,116 @@
+"""CPU per broadcast with python-socketio's per-recipient encoding versus
+the encode-once Broadcaster, for 1k and 10k recipients.
+
+Runs in one process without network I/O: each recipient is a real
+Engine.IO socket object in a room, and after every emit the queued packets
+are taken off each socket and turned into what its transport would write
+(a websocket frame, optionally permessage-deflate compressed, or a
+long-polling payload). Reported CPU covers the emit and those writes, not
+the system calls.
+
+    python benchmarks/broadcast_fanout.py --recipients 1000,10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio  # noqa: E402
+from engineio.payload import Payload  # noqa: E402
+from engineio.socket import Socket  # noqa: E402
+from eventlet.websocket import RFC6455WebSocket  # noqa: E402
+
+from broadcast import Broadcaster, SharedFrames  # noqa: E402
+
+CHAT = {'user': 'viewer42', 'msg': 'that play was unbelievable, again!',
+        'id': 123456, 'ts': 1792266328.736}
+PAYLOADS = {
+    'chat_message': ('chat_message', CHAT),
+    'chat_batch (50)': ('chat_batch', {'messages': [
+        dict(CHAT, id=CHAT['id'] + n) for n in range(50)]}),
+}
+DEFLATE = {'permessage-deflate': {'server_no_context_takeover': False}}
+
+
+def make_server(count, encode_once, deflate):
+    server = socketio.Server(async_mode='eventlet')
+    if encode_once:
+        Broadcaster(server, deflate_level=6 if deflate else None).install()
+    sockets = []
+    for number in range(count):
+        eio_sid = f'eio{number:017d}'
+        socket = server.eio.sockets[eio_sid] = Socket(server.eio, eio_sid)
+        socket.connected = True
+        sid = server.manager.connect(eio_sid, '/')
+        server.manager.enter_room(sid, '/', 'room')
+        # Browsers offer permessage-deflate; stock eventlet accepts it with
+        # context takeover, one compressor per connection
+        socket.ws = RFC6455WebSocket(None, {}, 13,
+                                     extensions=DEFLATE if deflate else {})
+        sockets.append(socket)
+    return server, sockets
+
+
+def write_websocket(socket):
+    written = 0
+    while not socket.queue.empty():
+        message = socket.queue.get_nowait().encode()
+        if isinstance(message, SharedFrames):
+            written += len(message.frame(bool(socket.ws.extensions)))
+        else:
+            written += len(socket.ws._pack_message(message))
+    return written
+
+
+def write_polling(socket):
+    packets = []
+    while not socket.queue.empty():
+        packets.append(socket.queue.get_nowait())
+    return len(Payload(packets=packets).encode())
+
+
+def run(count, transport, deflate, encode_once, event, data, repeat):
+    server, sockets = make_server(count, encode_once, deflate)
+    write = write_polling if transport == 'polling' else write_websocket
+    emit_cpu = write_cpu = 0
+    written = 0
+    for _ in range(repeat):
+        start = time.process_time()
+        server.emit(event, data, room='room')
+        middle = time.process_time()
+        written = sum(write(socket) for socket in sockets)
+        end = time.process_time()
+        emit_cpu += middle - start
+        write_cpu += end - middle
+    return emit_cpu / repeat, write_cpu / repeat, written / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', default='1000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"payload":<16}{"transport":>18}{"recipients":>11}'
+          f'{"per-socket ms":>15}{"encode-once ms":>16}{"speedup":>9}'
+          f'{"us/recipient":>14}{"bytes":>7}')
+    for name, (event, data) in PAYLOADS.items():
+        for transport, deflate in (('websocket', False),
+                                   ('websocket+deflate', True),
+                                   ('polling', False)):
+            for count in [int(c) for c in args.recipients.split(',') if c]:
+                before = run(count, transport, deflate, False, event, data,
+                             args.repeat)
+                after = run(count, transport, deflate, True, event, data,
+                            args.repeat)
+                old, new = sum(before[:2]), sum(after[:2])
+                print(f'{name:<16}{transport:>18}{count:>11,}'
+                      f'{old * 1000:>15.1f}{new * 1000:>16.1f}'
+                      f'{old / new:>8.1f}x{new / count * 1e6:>14.2f}'
+                      f'{after[2]:>7.0f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
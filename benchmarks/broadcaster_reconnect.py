@@ -0,0 +1,77 @@
+"""Broadcaster reconnecting while the server is at capacity.
+
+Runs the real Socket.IO handlers in-process with ADMISSION_MAX_SESSIONS set:
+a broadcaster starts a stream with its stream key, viewers fill every
+ordinary slot, then the broadcaster's connection drops. The report shows
+whether it gets back in with its key (it should, on a reserved slot), and
+that a viewer and a freshly minted key are still turned away. After the
+reconnect grace the dropped key is turned away too.
+
+    python benchmarks/broadcaster_reconnect.py --max-sessions 50 --reserve 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-sessions', type=int, default=50)
+    parser.add_argument('--reserve', type=int, default=5)
+    parser.add_argument('--grace', type=int, default=1,
+                        help='BROADCASTER_RECONNECT_GRACE, in seconds')
+    args = parser.parse_args()
+
+    os.environ.update(LOG_LEVEL='warning',
+                      ADMISSION_MAX_SESSIONS=str(args.max_sessions),
+                      ADMISSION_BROADCASTER_RESERVE=str(args.reserve),
+                      BROADCASTER_RECONNECT_GRACE=str(args.grace))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app, socketio, stream_keys
+
+    def connect(stream_key=None):
+        auth = {'stream_key': stream_key} if stream_key else {}
+        client = socketio.test_client(app, auth=auth)
+        return client if client.is_connected() else None
+
+    key = stream_keys.mint()
+    broadcaster = connect()
+    broadcaster.emit('start_broadcast', {'user_name': 'bench',
+                                         'stream_key': key}, callback=True)
+    viewers = []
+    while True:
+        viewer = connect()
+        if viewer is None:
+            break
+        viewers.append(viewer)
+    broadcaster.disconnect()
+    # The broadcaster's slot went free; take it so the server stays full
+    while True:
+        viewer = connect()
+        if viewer is None:
+            break
+        viewers.append(viewer)
+    print(f'at capacity with {len(viewers)} viewers')
+
+    def attempt(label, stream_key=None):
+        client = connect(stream_key)
+        print(f'{label:>28}: {"admitted" if client else "refused"}')
+        if client is not None:
+            client.disconnect()
+
+    attempt('viewer')
+    attempt('freshly minted key', stream_keys.mint())
+    attempt('dropped broadcaster', key)
+    time.sleep(args.grace + 0.5)
+    attempt('broadcaster after the grace', key)
+    for viewer in viewers:
+        viewer.disconnect()
+
+
+if __name__ == '__main__':
+    main()
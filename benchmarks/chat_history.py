@@ -0,0 +1,104 @@
+"""Memory and replay cost of the per-room chat history.
+
+Fills one room's history with N messages, sized so it really holds all of
+them (unless --history/--history-kb cap it), the way the chat batcher does:
+IDs are reserved from the state store once per batch of --batch messages,
+then the batch is recorded. It reports the memory the history takes and the
+fill cost per message, then times replaying the last K messages and paging
+back through the whole history. Run at 1%, 10% and 100% of N, replay and
+page costs stay flat however many messages the room holds.
+
+    python benchmarks/chat_history.py --messages 100000 --replay 50
+    python benchmarks/chat_history.py --store sqlite:////tmp/bench.db
+
+Memory is only measured for the default in-process store.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import ChatHistoryStore  # noqa: E402
+from state_store import create_state_store  # noqa: E402
+
+
+def fill(history, count, batch):
+    now = time.time()
+    for start in range(0, count, batch):
+        size = min(batch, count - start)
+        first = history.reserve('room', size)
+        history.add('room', [{'id': first + i, 'ts': now,
+                              'user': f'user{(start + i) % 100}',
+                              'msg': f'message number {start + i} ' * 3}
+                             for i in range(size)])
+
+
+def build(args, count):
+    max_messages = args.history or count
+    max_bytes = args.history_kb * 1024 if args.history_kb else float('inf')
+    history = ChatHistoryStore(create_state_store(args.store), max_messages,
+                               max_bytes)
+    history.drop('room')
+    if args.store:
+        start = time.perf_counter()
+        fill(history, count, args.batch)
+        return history, None, time.perf_counter() - start
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    fill(history, count, args.batch)
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return history, used, elapsed
+
+
+def replay_cost(history, replay, rounds=2000):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        history.page('room', limit=replay)
+    replay_us = (time.perf_counter() - start) / rounds * 1e6
+    # Follow the cursor all the way back, one page at a time
+    start = time.perf_counter()
+    pages, kept, cursor = 0, 0, None
+    while True:
+        page = history.page('room', cursor, replay)
+        pages += 1
+        kept += len(page['messages'])
+        cursor = page['cursor']
+        if cursor is None:
+            break
+    page_us = (time.perf_counter() - start) / pages * 1e6
+    return replay_us, page_us, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--replay', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=20,
+                        help='messages per chat batch (one ID reservation)')
+    parser.add_argument('--history', type=int, default=None,
+                        help='messages kept per room (default: all of them)')
+    parser.add_argument('--history-kb', type=int, default=None,
+                        help='bytes kept per room (default: no limit)')
+    parser.add_argument('--store', default=None,
+                        help='state store URL (default: in-process memory)')
+    args = parser.parse_args()
+
+    for count in (args.messages // 100, args.messages // 10, args.messages):
+        history, used, elapsed = build(args, count)
+        replay_us, page_us, kept = replay_cost(history, args.replay)
+        memory = f'{used / 1024:,.0f} KB, ' if used is not None else ''
+        print(f'{count:>8,} messages: {kept:,} kept, {memory}'
+              f'fill {elapsed / count * 1e6:.1f} us/msg, '
+              f'replay last {args.replay} {replay_us:.1f} us, '
+              f'{page_us:.1f} us/page', flush=True)
+        history.drop('room')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Durable chat log: writer throughput and chat_message handler latency.
+
+Measures how many messages per second the background writer commits for
+each fsync policy, then sends chat messages through the real Socket.IO
+handler with the log disabled and enabled and compares handler p50/p99.
+
+    python benchmarks/chat_log.py --messages 200000 --handler-messages 20000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as livestream
+from chat_log import ChatLog, FSYNC_MODES  # noqa: E402
+
+
+def throughput(path, fsync, messages):
+    log = ChatLog(path, fsync=fsync, queue_size=messages)
+    start = time.perf_counter()
+    for i in range(messages):
+        log.append('lobby', time.time(), f'user{i % 100}', f'message {i}')
+    enqueued = time.perf_counter() - start
+    log.close()
+    elapsed = time.perf_counter() - start
+    return {
+        'written': log.written,
+        'per_sec': log.written / elapsed,
+        'batches': log.batches,
+        'append_us': enqueued / messages * 1e6,
+    }
+
+
+def handler_latency(chat_log, messages):
+    livestream.chat_log = chat_log
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        client = livestream.socketio.test_client(livestream.app,
+                                                  auth={'chat_batch': True})
+        for i in range(messages):
+            start = time.perf_counter()
+            client.emit('chat_message', {'user': 'bench', 'msg': f'm{i}'})
+            samples.append(time.perf_counter() - start)
+            if i % 1000 == 0:
+                client.get_received()
+        client.disconnect()
+    samples.sort()
+    return {
+        'p50': samples[len(samples) // 2] * 1e6,
+        'p99': samples[int(len(samples) * 0.99)] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--handler-messages', type=int, default=20000)
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+
+    for fsync in FSYNC_MODES:
+        result = throughput(os.path.join(folder, f'{fsync}.db'), fsync,
+                            args.messages)
+        print(f'fsync={fsync:<6}: {result["per_sec"]:,.0f} messages/s '
+              f'in {result["batches"]} batches, '
+              f'append {result["append_us"]:.2f} us')
+
+    for label, chat_log in (
+            ('log off', None),
+            ('log on', ChatLog(os.path.join(folder, 'handler.db'),
+                               fsync='full'))):
+        result = handler_latency(chat_log, args.handler_messages)
+        print(f'{label:>7}: handler p50 {result["p50"]:.1f} us, '
+              f'p99 {result["p99"]:.1f} us')
+        if chat_log is not None:
+            chat_log.close()
+            print(f'         {chat_log.stats()}')
+
+
+if __name__ == '__main__':
+    main()
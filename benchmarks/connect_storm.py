@@ -0,0 +1,91 @@
+"""Connect-storm benchmark for viewer_count publication.
+
+Connects N clients as fast as possible, first with a viewer_count broadcast
+on every connect (VIEWER_COUNT_INTERVAL=0) and then with the coalescing
+ticker, and reports viewer_count packets emitted and hub latency measured by
+a probe green thread.
+
+    python benchmarks/connect_storm.py --clients 2000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+import app as server  # noqa: E402
+
+
+def run(clients, interval):
+    socketio = server.socketio
+    server.VIEWER_COUNT_INTERVAL = interval
+    server.viewer_count_task = None
+    stats = {'viewer_count': 0, 'packets': 0, 'lag': []}
+
+    emit_internal = socketio.server._emit_internal
+
+    def counting_emit_internal(eio_sid, event, *args, **kwargs):
+        stats['packets'] += 1
+        if event == 'viewer_count':
+            stats['viewer_count'] += 1
+        emit_internal(eio_sid, event, *args, **kwargs)
+
+    running = True
+
+    def probe():
+        # How late does a 1 ms timer fire while the storm is running?
+        while running:
+            start = time.perf_counter()
+            socketio.sleep(0.001)
+            stats['lag'].append(time.perf_counter() - start - 0.001)
+
+    viewers = []
+    socketio.server._emit_internal = counting_emit_internal
+    socketio.start_background_task(probe)
+    start = time.perf_counter()
+    for i in range(clients):
+        viewers.append(socketio.test_client(server.app,
+                                            auth={'chat_batch': True}))
+        if i % 10 == 0:
+            socketio.sleep(0)
+    elapsed = time.perf_counter() - start
+    socketio.sleep(max(interval, 0) * 2 + 0.01)
+    running = False
+    socketio.sleep(0.01)
+    socketio.server._emit_internal = emit_internal
+
+    for viewer in viewers:
+        viewer.disconnect()
+    lag = sorted(stats['lag']) or [0]
+    return {
+        'mode': f'ticker {interval}s' if interval > 0 else 'per-connect',
+        'viewer_count': stats['viewer_count'],
+        'packets': stats['packets'],
+        'connects_per_sec': clients / elapsed,
+        'p99_lag_ms': lag[int(len(lag) * 0.99)] * 1000,
+        'max_lag_ms': lag[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    for interval in (0, args.interval):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run(args.clients, interval)
+        print('{mode:>12}: {viewer_count:,} viewer_count packets '
+              '({packets:,} total), {connects_per_sec:,.0f} connects/s, '
+              'hub lag p99 {p99_lag_ms:.1f} ms max {max_lag_ms:.1f} ms'
+              .format(**result))
+
+
+if __name__ == '__main__':
+    main()
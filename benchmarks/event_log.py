@@ -0,0 +1,91 @@
+"""Per-event logging overhead: print() vs. the queued structured event log.
+
+Times the logging call a chat handler makes, for the old print() of the
+full message and for EventLog.info, writing to /dev/null and to a slow sink
+that takes a millisecond per write (a congested pipe or log shipper). The
+/dev/null case runs flat out and again paced at --rate events/s, closer to
+a busy server; flat out, the drainer's formatting competes with the caller
+for the GIL and can't keep up.
+
+    python benchmarks/event_log.py --events 100000 --rate 20000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_log import EventLog  # noqa: E402
+
+
+class SlowSink:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure(call, events, rate=None):
+    samples = []
+    next_at = time.perf_counter()
+    for i in range(events):
+        if rate:
+            # Spin, like a handler busy with other work, until the next slot
+            next_at += 1 / rate
+            while time.perf_counter() < next_at:
+                pass
+        start = time.perf_counter()
+        call(i)
+        samples.append(time.perf_counter() - start)
+    return {'mean_us': sum(samples) / events * 1e6,
+            'p99_us': percentile(samples, 99) * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--slow-events', type=int, default=2000)
+    parser.add_argument('--rate', type=int, default=20000,
+                        help='events/s for the paced /dev/null run')
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, 'w')
+    for sink_name, sink, events, rate in (
+            ('/dev/null', devnull, args.events, None),
+            (f'{args.rate // 1000}k/s', devnull, args.events, args.rate),
+            ('slow sink', SlowSink(0.001), args.slow_events, None)):
+        def print_message(i):
+            print(f'Received message from user{i % 100}: hello world {i}')
+
+        with contextlib.redirect_stdout(sink):
+            before = measure(print_message, events, rate)
+
+        log = EventLog(stream=sink, flush_interval=0.05)
+
+        def log_message(i):
+            log.info('chat_message', sid='abcdefgh', room='lobby',
+                     user=f'user{i % 100}', length=14)
+
+        after = measure(log_message, events, rate)
+        time.sleep(0.2)
+        log.flush()
+        print(f'{sink_name:>10}: print() mean {before["mean_us"]:.2f} us '
+              f'p99 {before["p99_us"]:.2f} us | EventLog mean '
+              f'{after["mean_us"]:.2f} us p99 {after["p99_us"]:.2f} us '
+              f'({log.written:,} written, {log.dropped:,} dropped)')
+
+
+if __name__ == '__main__':
+    main()
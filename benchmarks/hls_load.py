@@ -0,0 +1,116 @@
+"""HLS segment load test against the in-process HLS server.
+
+Writes a synthetic playlist and segments to a temporary media root, serves
+the app with eventlet's WSGI server and has N keep-alive viewers poll the
+playlist and fetch segments for a while, with the memory cache enabled and
+disabled (every segment from disk through send_file).
+
+    python benchmarks/hls_load.py --viewers 2000 --seconds 10
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import eventlet
+from eventlet import wsgi
+from eventlet.green import socket
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+
+def write_media(root, segments, segment_size):
+    folder = os.path.join(root, 'live', 'bench')
+    os.makedirs(folder)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2',
+             '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(segments):
+        with open(os.path.join(folder, f'index{i}.ts'), 'wb') as f:
+            f.write(os.urandom(segment_size))
+        lines += ['#EXTINF:2.000,', f'index{i}.ts']
+    with open(os.path.join(folder, 'index.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def fetch(sock, reader, path):
+    sock.sendall(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    length = 0
+    while True:
+        line = reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return reader.read(length)
+
+
+def run(port, viewers, seconds, segments):
+    stats = {'segments': 0, 'bytes': 0, 'playlists': 0}
+    deadline = time.time() + seconds
+
+    def viewer(offset):
+        sock = socket.create_connection(('127.0.0.1', port))
+        reader = sock.makefile('rb')
+        i = offset
+        while time.time() < deadline:
+            fetch(sock, reader, '/live/bench/index.m3u8')
+            stats['playlists'] += 1
+            body = fetch(sock, reader, f'/live/bench/index{i % segments}.ts')
+            stats['segments'] += 1
+            stats['bytes'] += len(body)
+            i += 1
+        sock.close()
+
+    pool = eventlet.GreenPool(viewers)
+    start = time.time()
+    for n in range(viewers):
+        pool.spawn(viewer, n)
+    pool.waitall()
+    elapsed = time.time() - start
+    return {
+        'segments_per_sec': stats['segments'] / elapsed,
+        'mb_per_sec': stats['bytes'] / elapsed / 1e6,
+        'playlists_per_sec': stats['playlists'] / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--segments', type=int, default=6)
+    parser.add_argument('--segment-kb', type=int, default=200)
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp()
+    write_media(media_root, args.segments, args.segment_kb * 1024)
+    os.environ['MEDIA_ROOT'] = media_root
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app, hls_server
+
+    listener = eventlet.listen(('127.0.0.1', 0), backlog=4096)
+    port = listener.getsockname()[1]
+    eventlet.spawn(wsgi.server, listener, app, log_output=False,
+                   max_size=args.viewers * 2)
+
+    for label, cache_bytes in (('memory cache', 256 * 1024 * 1024),
+                               ('disk only', 0)):
+        hls_server.cache.max_bytes = cache_bytes
+        for path in hls_server.cache.paths():
+            hls_server.cache.discard(path)
+        hls_server.scan()
+        result = run(port, args.viewers, args.seconds, args.segments)
+        print(f'{label:>12}: {result["segments_per_sec"]:,.0f} segments/s, '
+              f'{result["mb_per_sec"]:,.1f} MB/s, '
+              f'{result["playlists_per_sec"]:,.0f} playlists/s '
+              f'({args.viewers} viewers)')
+
+
+if __name__ == '__main__':
+    main()
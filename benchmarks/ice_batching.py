@@ -0,0 +1,178 @@
+"""Packets and time-to-connected for a wave of concurrent WebRTC negotiations.
+
+Starts the app in a child process (see loadtest.py), connects one streamer
+and `--viewers` viewers over websocket, then has every viewer send
+`webrtc_join` at once. Each side trickles `--candidates` ICE candidates,
+`--gather-interval` ms apart, and ends with the end-of-candidates marker.
+A negotiation counts as connected once both sides have the other's answer
+or offer and its final candidate batch.
+
+Runs once with one packet per candidate (WEBRTC_CANDIDATE_WINDOW_MS=0) and
+once per coalescing window given, and reports the candidate packets the
+clients received, time-to-connected percentiles and any batch that arrived
+out of order.
+
+    python benchmarks/ice_batching.py --viewers 500 --windows 0,20
+"""
+import argparse
+import time
+
+import eventlet
+
+# Imported from this directory; loadtest sets up the path to the app
+from loadtest import (ServerProcess, connect_all, disconnect_all,
+                      raise_fd_limit, summarize)
+from sio_client import create_client
+
+
+def candidate(index):
+    return {'candidate': f'candidate:{index} 1 udp {2000 - index} '
+                         f'127.0.0.1 {9000 + index} typ host',
+            'sdpMid': '0', 'sdpMLineIndex': 0, 'index': index}
+
+
+def trickle(client, target_id, count, interval):
+    for index in range(count):
+        client.emit('webrtc_ice_candidate', {'target_id': target_id,
+                                             'candidate': candidate(index)})
+        eventlet.sleep(interval)
+    client.emit('webrtc_ice_candidate', {'target_id': target_id,
+                                         'candidate': None})
+
+
+class Receiver:
+    """Candidate batches seen by one client, checked for order"""
+
+    def __init__(self):
+        self.packets = 0
+        self.candidates = 0
+        self.errors = 0
+        self.next = {}
+        self.done = {}
+
+    def __call__(self, data):
+        self.packets += 1
+        self.candidates += len(data['candidates'])
+        from_id = data['from_id']
+        seq, index = self.next.get(from_id, (0, 0))
+        if data['seq'] != seq:
+            self.errors += 1
+        for item in data['candidates']:
+            if item['index'] != index:
+                self.errors += 1
+            index += 1
+        self.next[from_id] = (data['seq'] + 1, index)
+        if data['end']:
+            self.done[from_id] = time.perf_counter()
+
+
+def run(server, args, window):
+    streamer = create_client('127.0.0.1', server.port, 'websocket')
+    streamer.connect(auth={'chat_batch': True})
+    stream_id = streamer.call('start_broadcast',
+                              {'user_name': 'bench'})['stream_id']
+    viewers, failures = connect_all(
+        server, 'websocket', args.viewers, args.concurrency,
+        auth={'chat_batch': True, 'stream_id': stream_id})
+    interval = args.gather_interval / 1000
+
+    streamer_rx = Receiver()
+    answered = {}
+    streamer.on('webrtc_ice_candidates', streamer_rx)
+    streamer.on('webrtc_answer', lambda data: answered.__setitem__(
+        data['viewer_id'], time.perf_counter()))
+
+    def on_viewer_joined(data):
+        viewer_id = data['viewer_id']
+        streamer.emit('webrtc_offer', {
+            'offer': {'type': 'offer', 'sdp': 'v=0' + ' ' * 2000},
+            'viewer_id': viewer_id, 'streamer_name': 'bench'})
+        eventlet.spawn(trickle, streamer, viewer_id, args.candidates,
+                       interval)
+
+    streamer.on('webrtc_viewer_joined', on_viewer_joined)
+
+    receivers = []
+    for viewer in viewers:
+        rx = Receiver()
+        receivers.append(rx)
+        viewer.on('webrtc_ice_candidates', rx)
+
+        def on_offer(data, viewer=viewer):
+            viewer.emit('webrtc_answer', {
+                'answer': {'type': 'answer', 'sdp': 'v=0' + ' ' * 2000},
+                'streamer_id': data['streamer_id']})
+            eventlet.spawn(trickle, viewer, data['streamer_id'],
+                           args.candidates, interval)
+
+        viewer.on('webrtc_offer', on_offer)
+
+    started = time.perf_counter()
+    for viewer in viewers:
+        viewer.emit('webrtc_join', {'stream_id': stream_id})
+
+    deadline = started + args.timeout
+    while time.perf_counter() < deadline:
+        if (len(streamer_rx.done) == len(viewers) and
+                all(rx.done for rx in receivers)):
+            break
+        eventlet.sleep(0.05)
+
+    times = []
+    for viewer, rx in zip(viewers, receivers):
+        ends = [rx.done.get(streamer.sid), streamer_rx.done.get(viewer.sid),
+                answered.get(viewer.sid)]
+        if None not in ends:
+            times.append(max(ends) - started)
+    packets = streamer_rx.packets + sum(rx.packets for rx in receivers)
+    candidates = streamer_rx.candidates + sum(rx.candidates
+                                              for rx in receivers)
+    result = {
+        'window_ms': window,
+        'viewers': len(viewers),
+        'connect_failures': failures,
+        'connected': len(times),
+        'candidate_packets': packets,
+        'candidates': candidates,
+        'candidates_per_packet': round(candidates / max(packets, 1), 1),
+        'order_errors': streamer_rx.errors + sum(rx.errors
+                                                 for rx in receivers),
+        'time_to_connected_ms': summarize(times),
+    }
+    streamer.call('stop_broadcast', {})
+    disconnect_all(viewers + [streamer])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=500)
+    parser.add_argument('--candidates', type=int, default=12,
+                        help='ICE candidates gathered by each side')
+    parser.add_argument('--gather-interval', type=float, default=5,
+                        help='ms between candidates')
+    parser.add_argument('--windows', default='0,20',
+                        help='coalescing windows to compare, in ms')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    for window in [float(w) for w in args.windows.split(',') if w]:
+        server = ServerProcess({'LOG_LEVEL': 'warning', 'RATE_LIMITS': '',
+                                'WEBRTC_CANDIDATE_WINDOW_MS': str(window)})
+        try:
+            result = run(server, args, window)
+        finally:
+            server.stop()
+        ttc = result['time_to_connected_ms']
+        print(f"window {window:5.1f} ms: {result['connected']}/"
+              f"{result['viewers']} connected, "
+              f"{result['candidate_packets']} candidate packets "
+              f"({result['candidates_per_packet']} per packet), "
+              f"time-to-connected p50 {ttc['p50']} ms p99 {ttc['p99']} ms, "
+              f"{result['order_errors']} out of order", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Requests/sec for the index page: render per request vs. precompiled.
+
+"before" compiles and renders the whole page (template, CSS and JS inlined)
+with render_template_string on every hit, like the old route; "after" is the
+precompiled `/` route, both for a first visit and for a returning viewer
+revalidating with If-None-Match.
+
+    python benchmarks/index_page.py --requests 5000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+from flask import render_template_string  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, static_assets, transports
+
+
+def inline_page():
+    """The page as one template string, the way the old route held it"""
+    def read(*parts):
+        with open(os.path.join(ROOT, *parts), encoding='utf-8') as f:
+            return f.read()
+
+    page = read('templates', 'index.html')
+    page = page.replace(
+        '<link rel="stylesheet" href="{{ asset_url(\'app.css\') }}">',
+        '<style>' + read('static', 'app.css') + '</style>')
+    return page.replace(
+        '<script src="{{ asset_url(\'app.js\') }}"></script>',
+        '<script>' + read('static', 'app.js') + '</script>')
+
+
+INLINE_PAGE = inline_page()
+
+
+@app.route('/bench/render-per-request')
+def render_per_request():
+    return render_template_string(INLINE_PAGE, transports=transports,
+                                  asset_url=static_assets.url)
+
+
+def measure(client, path, requests, headers=None):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    etag = client.get('/').headers['ETag']
+    cases = [
+        ('before: render per request', '/bench/render-per-request', None),
+        ('after: first visit (gzip)', '/', {'Accept-Encoding': 'gzip'}),
+        ('after: returning viewer', '/', {'If-None-Match': etag}),
+    ]
+    for label, path, headers in cases:
+        rate, status = measure(client, path, args.requests, headers)
+        print(f'{label:>28}: {rate:,.0f} req/s (HTTP {status})')
+
+
+if __name__ == '__main__':
+    main()
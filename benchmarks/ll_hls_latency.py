@@ -0,0 +1,329 @@
+"""HLS delivery latency, classic segments vs LL-HLS parts.
+
+Starts the app in a child process (see loadtest.py) with MEDIA_ROOT in a
+temporary directory, then feeds it the way node-media-server's ffmpeg
+would: `--feed synthetic` writes MPEG-TS parts (or classic 2 s segments)
+and the playlist in real time, with a keyframe every `--gop` seconds;
+`--feed ffmpeg` runs a real ffmpeg on a test source instead. Every part
+carries the presentation time of its first frame, which maps back to the
+moment it was captured.
+
+`--viewers` clients then play for `--seconds`. In `classic` mode they poll
+the playlist like hls.js does (every target duration, half that while
+nothing changes) and fetch new segments. In `ll` mode (HLS_LOW_LATENCY=on)
+they fetch the preload hint, which the server holds until the part exists,
+then reload the playlist with `_HLS_msn`/`_HLS_part`. The report gives how
+long after its last frame was captured each segment or part arrived, the
+playlist requests per media request, and a glass-to-glass estimate that
+adds the hold-back a player keeps from the live edge (3 target durations
+for classic HLS, PART-HOLD-BACK for LL-HLS).
+
+    python benchmarks/ll_hls_latency.py --viewers 200 --seconds 30
+"""
+import argparse
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import eventlet
+from eventlet.green import socket
+
+# Imported from this directory; loadtest sets up the path to the app
+from loadtest import ServerProcess, raise_fd_limit, summarize
+
+VIDEO_PID = 0x100
+PART_INF_RE = re.compile(r'#EXT-X-PART:DURATION=([\d.]+),URI="([^"]+)"')
+HINT_RE = re.compile(r'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="([^"]+)"')
+
+
+def ts_packet(pid, payload, unit_start=False, random_access=False,
+              counter=0):
+    """One 188-byte packet; the adaptation field pads short payloads"""
+    header = bytes([0x47, (0x40 if unit_start else 0) | pid >> 8, pid & 0xff])
+    room = 184 - len(payload)
+    if room == 0 and not random_access:
+        return header + bytes([0x10 | counter & 0x0f]) + payload
+    flags = 0x40 if random_access else 0
+    adaptation = bytes([max(room - 1, 1), flags]) + b'\xff' * (room - 2)
+    return header + bytes([0x30 | counter & 0x0f]) + adaptation + \
+        payload[:184 - len(adaptation)]
+
+
+def synthetic_ts(pts, keyframe, size):
+    """PAT, PMT with one H.264 stream, then a video PES starting at `pts`
+    (90 kHz) and padding up to about `size` bytes. Not decodable video,
+    just what the packager and this harness look at."""
+    pat = bytes([0, 0x00, 0xb0, 13, 0, 1, 0xc1, 0, 0, 0, 1, 0xf0, 0x00]) + \
+        b'\0' * 4
+    pmt = bytes([0, 0x02, 0xb0, 18, 0, 1, 0xc1, 0, 0, 0xe1, 0x00, 0xf0, 0,
+                 0x1b, 0xe1, 0x00, 0xf0, 0]) + b'\0' * 4
+    pts_bytes = bytes([0x21 | (pts >> 29) & 0x0e, (pts >> 22) & 0xff,
+                       0x01 | (pts >> 14) & 0xfe, (pts >> 7) & 0xff,
+                       0x01 | (pts << 1) & 0xfe])
+    pes = b'\0\0\1\xe0\0\0\x80\x80\x05' + pts_bytes
+    packets = [ts_packet(0, pat, True), ts_packet(0x1000, pmt, True),
+               ts_packet(VIDEO_PID, pes + b'\0' * 100, True, keyframe)]
+    for counter in range(1, max(size // 188 - 3, 0) + 1):
+        packets.append(ts_packet(VIDEO_PID, b'\0' * 184, counter=counter))
+    return b''.join(packets)
+
+
+def first_pts(data):
+    """Seconds of the first video PES's presentation time, or None"""
+    for offset in range(0, len(data) - 187, 188):
+        packet = data[offset:offset + 188]
+        if not packet[1] & 0x40:
+            continue
+        start = 5 + packet[4] if packet[3] & 0x20 else 4
+        pes = packet[start:]
+        if pes[:3] == b'\0\0\1' and 0xe0 <= pes[3] <= 0xef and pes[7] & 0x80:
+            p = pes[9:14]
+            return ((p[0] >> 1 & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15 |
+                    p[3] << 7 | p[4] >> 1) / 90000
+    return None
+
+
+def write_atomic(path, data):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def synthetic_feed(folder, mode, args, running, start):
+    """Writes what ffmpeg would, in real time, until `running` is cleared"""
+    if mode == 'll':
+        unit, list_size = args.part_time, 30
+    else:
+        unit, list_size = args.gop, 3
+    size = int(args.bitrate * unit / 8)
+    per_keyframe = round(args.gop / unit)
+    listed = []
+    n = 0
+    while running[0]:
+        # Part n holds what was captured from start + n * unit on
+        end = start + (n + 1) * unit
+        eventlet.sleep(max(0, end - time.time()))
+        keyframe = n % per_keyframe == 0
+        name = f'index{n}.ts'
+        write_atomic(os.path.join(folder, name),
+                     synthetic_ts(int(n * unit * 90000), keyframe, size))
+        listed.append((n, name))
+        if len(listed) > list_size:
+            _, expired = listed.pop(0)
+            os.remove(os.path.join(folder, expired))
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 f'#EXT-X-TARGETDURATION:{max(1, round(unit))}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{listed[0][0]}']
+        for _, listed_name in listed:
+            lines += [f'#EXTINF:{unit:.6f},', listed_name]
+        write_atomic(os.path.join(folder, 'index.m3u8'),
+                     ('\n'.join(lines) + '\n').encode())
+        n += 1
+
+
+def ffmpeg_feed(folder, mode, args):
+    if mode == 'll':
+        flags = ['-hls_time', str(args.part_time), '-hls_list_size', '30',
+                 '-hls_flags', 'split_by_time+delete_segments+temp_file']
+    else:
+        flags = ['-hls_time', str(args.gop), '-hls_list_size', '3',
+                 '-hls_flags', 'delete_segments']
+    return subprocess.Popen(
+        ['ffmpeg', '-loglevel', 'error', '-re', '-f', 'lavfi', '-i',
+         'testsrc=size=640x360:rate=30', '-c:v', 'libx264', '-preset',
+         'veryfast', '-tune', 'zerolatency', '-g', str(int(30 * args.gop)),
+         '-b:v', str(args.bitrate), '-f', 'hls', *flags,
+         os.path.join(folder, 'index.m3u8')])
+
+
+def fetch(sock, reader, path):
+    """(status, body) over a keep-alive connection"""
+    sock.sendall(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    status = int(reader.readline().split()[1])
+    length = 0
+    while True:
+        line = reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return status, reader.read(length)
+
+
+class Viewer:
+    def __init__(self, port, clock, samples, stats):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.reader = self.sock.makefile('rb')
+        self.clock = clock
+        self.samples = samples
+        self.stats = stats
+
+    def get(self, path, kind):
+        status, body = fetch(self.sock, self.reader, '/live/bench/' + path)
+        self.stats[kind] += 1
+        if status != 200:
+            self.stats['errors'] += 1
+        return status, body
+
+    def record(self, body, duration):
+        pts = first_pts(body)
+        if pts is not None:
+            captured = self.clock(pts) + duration
+            self.samples.append(time.time() - captured)
+
+    def classic(self, deadline, target):
+        seen = set()
+        while time.time() < deadline:
+            _, body = self.get('index.m3u8', 'playlists')
+            new = []
+            duration = None
+            for line in body.decode().splitlines():
+                if line.startswith('#EXTINF:'):
+                    duration = float(line[8:].split(',')[0])
+                elif line and not line.startswith('#') and line not in seen:
+                    new.append((line, duration))
+            # Players start near the live edge
+            if not seen:
+                new = new[-1:]
+                seen.update(line for line in body.decode().splitlines()
+                            if line and not line.startswith('#'))
+            for name, duration in new:
+                seen.add(name)
+                status, media = self.get(name, 'media')
+                if status == 200:
+                    self.record(media, duration)
+            eventlet.sleep(target if new else target / 2)
+
+    def low_latency(self, deadline, part_time):
+        _, body = self.get('index.m3u8', 'playlists')
+        while time.time() < deadline:
+            text = body.decode()
+            hint = HINT_RE.search(text)
+            if hint is None:
+                eventlet.sleep(0.1)
+                _, body = self.get('index.m3u8', 'playlists')
+                continue
+            sequence = int(re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)',
+                                     text)[1])
+            # The hinted part comes after the parts of the open segment
+            msn = sequence + text.count('#EXTINF:')
+            part = len(PART_INF_RE.findall(text.rsplit('#EXTINF:', 1)[-1]))
+            status, media = self.get(hint[1], 'media')
+            if status == 200:
+                self.record(media, part_time)
+            _, body = self.get(
+                f'index.m3u8?_HLS_msn={msn}&_HLS_part={part}', 'playlists')
+
+    def close(self):
+        self.sock.close()
+
+
+def run(mode, args):
+    media_root = tempfile.mkdtemp()
+    folder = os.path.join(media_root, 'live', 'bench')
+    os.makedirs(folder)
+    env = {'LOG_LEVEL': 'warning', 'MEDIA_ROOT': media_root,
+           'HLS_LOW_LATENCY': 'on' if mode == 'll' else 'off',
+           'HLS_PART_TARGET': str(args.part_target),
+           'HLS_SEGMENT_TARGET': str(args.gop)}
+    server = ServerProcess(env)
+    running = [True]
+    feed = None
+    try:
+        feed_start = time.time()
+        if args.feed == 'ffmpeg':
+            feed = ffmpeg_feed(folder, mode, args)
+        else:
+            feed = eventlet.spawn(synthetic_feed, folder, mode, args,
+                                  running, feed_start)
+        # Give the playlist a few segments before the viewers arrive
+        eventlet.sleep(args.gop * 2 + 1)
+        if args.feed == 'ffmpeg':
+            # -re keeps ffmpeg's timestamps in step with the wall clock, from
+            # an offset: take the file it wrote soonest after its last frame
+            # as written right away (which leaves out the encoder's delay)
+            duration = args.part_time if mode == 'll' else args.gop
+            starts = []
+            for name in os.listdir(folder):
+                if name.endswith('.ts'):
+                    path = os.path.join(folder, name)
+                    with open(path, 'rb') as f:
+                        pts = first_pts(f.read())
+                    if pts is not None:
+                        starts.append(os.stat(path).st_mtime - duration - pts)
+            feed_start = min(starts)
+
+        def clock(pts):
+            return feed_start + pts
+
+        samples, stats = [], {'playlists': 0, 'media': 0, 'errors': 0}
+        result = {'mode': mode}
+        deadline = time.time() + args.seconds
+
+        def watch(_):
+            viewer = Viewer(server.port, clock, samples, stats)
+            try:
+                if mode == 'll':
+                    viewer.low_latency(deadline, args.part_time)
+                else:
+                    viewer.classic(deadline, args.gop)
+            finally:
+                viewer.close()
+
+        with server.measure(result):
+            pool = eventlet.GreenPool(args.viewers)
+            for _ in pool.imap(watch, range(args.viewers)):
+                pass
+        hold_back = 3 * args.part_target if mode == 'll' else 3 * args.gop
+        delay = summarize(samples)
+        result.update(stats, delay_ms=delay, hold_back_s=hold_back,
+                      glass_ms=delay['p50'] and
+                      round(delay['p50'] + hold_back * 1000))
+        return result
+    finally:
+        running[0] = False
+        if isinstance(feed, subprocess.Popen):
+            feed.terminate()
+            feed.wait()
+        elif feed is not None:
+            feed.kill()
+        server.stop()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--feed', choices=('synthetic', 'ffmpeg'),
+                        default='synthetic')
+    parser.add_argument('--gop', type=float, default=2,
+                        help='keyframe interval, also the segment target')
+    parser.add_argument('--part-target', type=float, default=0.334)
+    parser.add_argument('--bitrate', type=int, default=2000000)
+    parser.add_argument('--modes', default='classic,ll')
+    args = parser.parse_args()
+    # As the app tells ffmpeg to cut
+    args.part_time = math.floor(args.gop / math.ceil(
+        args.gop / (args.part_target * 0.9)) * 1e6) / 1e6
+
+    raise_fd_limit()
+    for mode in [m for m in args.modes.split(',') if m]:
+        result = run(mode, args)
+        delay = result['delay_ms']
+        print(f"{mode:>8}: {result['media']} media and "
+              f"{result['playlists']} playlist requests "
+              f"({result['playlists'] / max(result['media'], 1):.2f} per "
+              f"media), {result['errors']} errors; arrival after capture "
+              f"p50 {delay['p50']} p99 {delay['p99']} ms; est. "
+              f"glass-to-glass {result['glass_ms']} ms (hold-back "
+              f"{result['hold_back_s']:.2f} s); server CPU "
+              f"{result['server']['cpu_percent']}%", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,488 @@
+"""Localhost load test of the Socket.IO and HTTP surfaces of one app process.
+
+Starts the app in a child process (eventlet WSGI server, no connection cap)
+and drives it with simulated Socket.IO clients over websocket and polling:
+
+    connect     connect/disconnect storm
+    chat        chat fan-out to every connected client
+    broadcast   start_broadcast/stop_broadcast churn seen from the lobby
+    webrtc      offer/answer and ICE candidate relay between streamer/viewer
+    http        keep-alive load on /, /stream/info and /stream/rtmp-key
+
+Each scenario reports throughput, p50/p99/p999 latency and the server's CPU
+and RSS. The clients run in this process, on the same machine, so give the
+server its own core where possible. Results are written as JSON; pass an earlier file with --compare to
+see the change between versions.
+
+    python benchmarks/loadtest.py --clients 2000 --output results.json
+    python benchmarks/loadtest.py --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import socket as std_socket
+import subprocess
+import sys
+import time
+
+import eventlet
+from eventlet import wsgi
+from eventlet.green import socket
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+from sio_client import create_client, http_request  # noqa: E402
+
+SCENARIOS = ('connect', 'chat', 'broadcast', 'webrtc', 'http')
+HTTP_PATHS = ('/', '/stream/info', '/stream/rtmp-key')
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(port):
+    """Runs in the child process"""
+    raise_fd_limit()
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app
+    listener = eventlet.listen(('127.0.0.1', port), backlog=4096)
+    wsgi.server(listener, app, log_output=False, max_size=1000000)
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds"""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0, 'p50': None, 'p99': None, 'p999': None}
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1,
+                                 int(len(samples) * p))] * 1000, 3)
+    return {'count': len(samples), 'p50': pct(0.5), 'p99': pct(0.99),
+            'p999': pct(0.999)}
+
+
+class ServerProcess:
+    def __init__(self, env):
+        with std_socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve',
+             '--port', str(self.port)],
+            env=dict(os.environ, **env), cwd=ROOT)
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                break
+            except OSError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    raise RuntimeError('server did not start')
+                eventlet.sleep(0.1)
+
+    def cpu_seconds(self):
+        with open(f'/proc/{self.process.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self):
+        with open(f'/proc/{self.process.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    @contextlib.contextmanager
+    def measure(self, result):
+        """Record CPU use and RSS of the server while the block runs"""
+        peak = [self.rss_mb()]
+        running = [True]
+
+        def sample():
+            while running[0]:
+                peak[0] = max(peak[0], self.rss_mb())
+                eventlet.sleep(0.25)
+
+        sampler = eventlet.spawn(sample)
+        cpu, start = self.cpu_seconds(), time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            running[0] = False
+            sampler.wait()
+            cpu = self.cpu_seconds() - cpu
+            result['elapsed_s'] = round(elapsed, 3)
+            result['server'] = {
+                'cpu_seconds': round(cpu, 3),
+                'cpu_percent': round(cpu / elapsed * 100, 1),
+                'rss_mb': round(self.rss_mb(), 1),
+                'peak_rss_mb': round(max(peak[0], self.rss_mb()), 1),
+            }
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def connect_all(server, transport, count, concurrency, auth=None,
+                latencies=None):
+    """Connect `count` clients; returns (clients, failures)"""
+    clients, failures = [], [0]
+
+    def connect(_):
+        client = create_client('127.0.0.1', server.port, transport)
+        start = time.perf_counter()
+        try:
+            client.connect(auth=auth or {'chat_batch': True})
+        except (OSError, ConnectionError, eventlet.Timeout):
+            failures[0] += 1
+            return
+        if latencies is not None:
+            latencies.append(time.perf_counter() - start)
+        clients.append(client)
+
+    pool = eventlet.GreenPool(concurrency)
+    for _ in pool.imap(connect, range(count)):
+        pass
+    return clients, failures[0]
+
+
+def disconnect_all(clients):
+    pool = eventlet.GreenPool(500)
+    for _ in pool.imap(lambda c: c.disconnect(), clients):
+        pass
+    # Let the server process the disconnects before the next scenario
+    eventlet.sleep(1)
+
+
+def scenario_connect(server, args, transport):
+    result = {'scenario': 'connect', 'transport': transport,
+              'clients': args.clients}
+    latencies = []
+    with server.measure(result):
+        start = time.perf_counter()
+        clients, failures = connect_all(server, transport, args.clients,
+                                        args.concurrency, latencies=latencies)
+        connect_elapsed = time.perf_counter() - start
+        disconnect_all(clients)
+    result['throughput'] = round(len(clients) / connect_elapsed, 1)
+    result['failures'] = failures
+    result['latency_ms'] = summarize(latencies)
+    return result
+
+
+def scenario_chat(server, args, transport):
+    result = {'scenario': 'chat', 'transport': transport,
+              'clients': args.clients, 'rate': args.rate}
+    latencies = []
+
+    def on_batch(data):
+        now = time.time()
+        latencies.extend(now - m['sent'] for m in data['messages']
+                         if 'sent' in m)
+
+    clients, failures = connect_all(server, transport, args.clients,
+                                    args.concurrency)
+    for client in clients:
+        client.on('chat_batch', on_batch)
+    sent = 0
+    with server.measure(result):
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration and clients:
+            due = int((time.perf_counter() - start) * args.rate) + 1
+            while sent < due:
+                clients[sent % len(clients)].emit('chat_message', {
+                    'user': f'user{sent}', 'msg': 'hello world',
+                    'sent': time.time()})
+                sent += 1
+            eventlet.sleep(0.001)
+        # Wait for the last batches
+        eventlet.sleep(1)
+    expected = sent * len(clients)
+    result['failures'] = failures
+    result['messages'] = sent
+    result['deliveries'] = len(latencies)
+    result['delivered_ratio'] = round(len(latencies) / expected, 4) \
+        if expected else 0
+    result['throughput'] = round(len(latencies) / result['elapsed_s'], 1)
+    result['latency_ms'] = summarize(latencies)
+    disconnect_all(clients)
+    return result
+
+
+def scenario_broadcast(server, args, transport):
+    result = {'scenario': 'broadcast', 'transport': transport,
+              'clients': args.clients, 'streamers': args.streamers}
+    announcements = [0]
+    latencies = []
+    viewers, failures = connect_all(server, transport, args.clients,
+                                    args.concurrency)
+    for viewer in viewers:
+        viewer.on('stream_started',
+                  lambda data: announcements.__setitem__(
+                      0, announcements[0] + 1))
+    streamers, more_failures = connect_all(server, transport, args.streamers,
+                                           args.concurrency)
+    cycles = [0]
+
+    def churn(streamer):
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            for event, data in (('start_broadcast', {'user_name': 'bench'}),
+                                ('stop_broadcast', {})):
+                start = time.perf_counter()
+                try:
+                    streamer.call(event, data)
+                except eventlet.Timeout:
+                    result['timeouts'] = result.get('timeouts', 0) + 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+            cycles[0] += 1
+
+    with server.measure(result):
+        pool = eventlet.GreenPool(len(streamers) or 1)
+        for _ in pool.imap(churn, streamers):
+            pass
+        eventlet.sleep(1)
+    result['failures'] = failures + more_failures
+    result['cycles'] = cycles[0]
+    result['announcements'] = announcements[0]
+    result['throughput'] = round(cycles[0] / result['elapsed_s'], 1)
+    result['latency_ms'] = summarize(latencies)
+    disconnect_all(viewers + streamers)
+    return result
+
+
+def scenario_webrtc(server, args, transport):
+    result = {'scenario': 'webrtc', 'transport': transport,
+              'pairs': args.pairs}
+    answers, candidates = [], []
+    pairs = []
+    failures = 0
+    for i in range(args.pairs):
+        streamer = create_client('127.0.0.1', server.port, transport)
+        try:
+            streamer.connect(auth={'chat_batch': True})
+            stream_id = streamer.call('start_broadcast',
+                                      {'user_name': f'streamer{i}'})['stream_id']
+            viewer = create_client('127.0.0.1', server.port, transport)
+            viewer.connect(auth={'chat_batch': True, 'stream_id': stream_id})
+            viewer.call('webrtc_join', {'stream_id': stream_id})
+        except (OSError, ConnectionError, eventlet.Timeout):
+            failures += 1
+            continue
+
+        def on_offer(data, viewer=viewer):
+            viewer.emit('webrtc_answer', {
+                'answer': {'type': 'answer', 'sent': data['offer']['sent']},
+                'streamer_id': data['streamer_id']})
+
+        def on_answer(data):
+            answers.append(time.time() - data['answer']['sent'])
+
+        def on_candidates(data):
+            now = time.time()
+            candidates.extend(now - candidate['sent']
+                              for candidate in data['candidates'])
+
+        viewer.on('webrtc_offer', on_offer)
+        viewer.on('webrtc_ice_candidates', on_candidates)
+        streamer.on('webrtc_answer', on_answer)
+        pairs.append((streamer, viewer))
+
+    def negotiate(pair):
+        streamer, viewer = pair
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            streamer.emit('webrtc_offer', {
+                'offer': {'type': 'offer', 'sdp': 'v=0' + ' ' * 2000,
+                          'sent': time.time()},
+                'viewer_id': viewer.sid,
+                'streamer_name': 'bench'})
+            for _ in range(args.candidates):
+                streamer.emit('webrtc_ice_candidate', {
+                    'target_id': viewer.sid,
+                    'candidate': {'candidate': 'candidate:1 1 udp 1 '
+                                  '127.0.0.1 9 typ host', 'sent': time.time()}})
+            streamer.emit('webrtc_ice_candidate', {
+                'target_id': viewer.sid, 'candidate': None})
+            eventlet.sleep(args.negotiation_interval)
+
+    with server.measure(result):
+        pool = eventlet.GreenPool(len(pairs) or 1)
+        for _ in pool.imap(negotiate, pairs):
+            pass
+        eventlet.sleep(1)
+    result['failures'] = failures
+    result['negotiations'] = len(answers)
+    result['candidates'] = len(candidates)
+    result['throughput'] = round(len(answers) / result['elapsed_s'], 1)
+    result['latency_ms'] = summarize(answers)
+    result['candidate_latency_ms'] = summarize(candidates)
+    disconnect_all([client for pair in pairs for client in pair])
+    return result
+
+
+def scenario_http(server, args, path):
+    result = {'scenario': 'http', 'path': path,
+              'connections': args.http_connections}
+    latencies = []
+    errors = [0]
+
+    def worker(_):
+        sock = socket.create_connection(('127.0.0.1', server.port))
+        conn = (sock, sock.makefile('rb'))
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _, _ = http_request(*conn, 'GET', path,
+                                            headers={'Accept-Encoding': 'gzip'})
+            except (OSError, ValueError):
+                errors[0] += 1
+                sock = socket.create_connection(('127.0.0.1', server.port))
+                conn = (sock, sock.makefile('rb'))
+                continue
+            if status >= 400:
+                errors[0] += 1
+            latencies.append(time.perf_counter() - start)
+        sock.close()
+
+    with server.measure(result):
+        pool = eventlet.GreenPool(args.http_connections)
+        for _ in pool.imap(worker, range(args.http_connections)):
+            pass
+    result['errors'] = errors[0]
+    result['throughput'] = round(len(latencies) / result['elapsed_s'], 1)
+    result['latency_ms'] = summarize(latencies)
+    return result
+
+
+def run(args):
+    env = {'LOG_LEVEL': 'warning'}
+    if not args.rate_limits:
+        # Measure the server, not the flood protection
+        env['RATE_LIMITS'] = ''
+    server = ServerProcess(env)
+    results = []
+    try:
+        for name in args.scenarios:
+            if name == 'http':
+                targets = HTTP_PATHS
+            else:
+                targets = args.transports
+            for target in targets:
+                scenario = globals()[f'scenario_{name}']
+                result = scenario(server, args, target)
+                results.append(result)
+                print(format_result(result), flush=True)
+    finally:
+        server.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (f'{result["scenario"]}:'
+            f'{result.get("transport") or result.get("path")}')
+
+
+def format_result(result):
+    latency = result['latency_ms']
+    return (f'{result_key(result):<28} {result["throughput"]:>10,.1f}/s  '
+            f'p50 {latency["p50"]} ms  p99 {latency["p99"]} ms  '
+            f'p999 {latency["p999"]} ms  cpu {result["server"]["cpu_percent"]}%  '
+            f'rss {result["server"]["peak_rss_mb"]} MB')
+
+
+def compare(base, current):
+    """Print throughput and p99 change per scenario"""
+    if base['meta']['args'] != current['meta']['args']:
+        print('note: the runs used different arguments')
+    before = {result_key(r): r for r in base['results']}
+    for result in current['results']:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+
+        def change(new, previous):
+            if not previous or new is None:
+                return 'n/a'
+            return f'{(new - previous) / previous * 100:+.1f}%'
+        print(f'{result_key(result):<28} throughput '
+              f'{change(result["throughput"], old["throughput"]):>8}  p99 '
+              f'{change(result["latency_ms"]["p99"], old["latency_ms"]["p99"]):>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--transports', default='websocket,polling')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='connection attempts in flight')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=20,
+                        help='chat messages per second')
+    parser.add_argument('--streamers', type=int, default=10)
+    parser.add_argument('--pairs', type=int, default=50)
+    parser.add_argument('--candidates', type=int, default=8,
+                        help='ICE candidates per negotiation')
+    parser.add_argument('--negotiation-interval', type=float, default=1.0)
+    parser.add_argument('--http-connections', type=int, default=50)
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="keep the app's default rate limits")
+    parser.add_argument('--output', help='write results as JSON here')
+    parser.add_argument('--compare', help='earlier JSON results to compare')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    raise_fd_limit()
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    args.transports = [t for t in args.transports.split(',') if t]
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items()
+                     if k not in ('serve', 'port', 'output', 'compare')},
+        },
+        'results': run(args),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Per-event cost of the /metrics instrumentation.
+
+Times a no-op handler bare and wrapped the way instrument_socketio wraps
+handlers, the per-recipient emit counter and the fan-out participant
+counter, and reports the added cost per call in nanoseconds.
+
+    python benchmarks/metrics_overhead.py --calls 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics, _timed  # noqa: E402
+
+
+def per_call_ns(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000000)
+    parser.add_argument('--recipients', type=int, default=1000)
+    args = parser.parse_args()
+    metrics = Metrics()
+
+    def handler():
+        return None
+
+    timed = _timed(handler,
+                   metrics.counter('received', 'bench', event='bench'),
+                   metrics.histogram('latency', 'bench', handler='bench'))
+    bare = per_call_ns(handler, args.calls)
+    wrapped = per_call_ns(timed, args.calls)
+    print(f'handler timing: {wrapped - bare:.0f} ns/event '
+          f'({bare:.0f} ns bare, {wrapped:.0f} ns wrapped)')
+
+    emitted = {}
+
+    def count_emit(event='chat_batch'):
+        counter = emitted.get(event)
+        if counter is None:
+            counter = emitted[event] = metrics.counter('emitted', 'bench',
+                                                       event=event)
+        counter.value += 1
+
+    print(f'emit counter:   {per_call_ns(count_emit, args.calls):.0f} '
+          f'ns/recipient')
+
+    participants = [(str(i), str(i)) for i in range(args.recipients)]
+    fanout = metrics.histogram('fanout', 'bench', buckets=(1, 10, 100, 1000))
+
+    def counted():
+        count = 0
+        for participant in participants:
+            count += 1
+            yield participant
+        fanout.observe(count)
+
+    rounds = max(args.calls // args.recipients, 1)
+    bare = per_call_ns(lambda: [p for p in participants], rounds)
+    wrapped = per_call_ns(lambda: [p for p in counted()], rounds)
+    print(f'fan-out count:  {(wrapped - bare) / args.recipients:.0f} '
+          f'ns/recipient')
+
+
+if __name__ == '__main__':
+    main()
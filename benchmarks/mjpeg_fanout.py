@@ -0,0 +1,91 @@
+"""Shared-producer MJPEG fan-out with many simulated /video_feed consumers.
+
+Runs the FrameBroadcaster with a synthetic 30 KB JPEG source and N green
+thread consumers (10% of them slow), and reports frames delivered, frames
+dropped for slow consumers, CPU time per delivered frame and memory per
+consumer.
+
+    python benchmarks/mjpeg_fanout.py --consumers 1000 --seconds 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import socketio
+from frame_broadcaster import FrameBroadcaster  # noqa: E402
+
+
+class SyntheticSource:
+    content_type = 'image/jpeg'
+    paced = False
+
+    def __init__(self, size):
+        self.frame = b'\xff\xd8' + os.urandom(size) + b'\xff\xd9'
+
+    def read(self):
+        return self.frame
+
+
+def run(consumers, seconds, fps):
+    broadcaster = FrameBroadcaster(socketio, SyntheticSource(30000), fps=fps)
+    stats = {'frames': 0, 'bytes': 0}
+    running = True
+
+    def consume(slow):
+        stream = broadcaster.stream()
+        for chunk in stream:
+            stats['frames'] += 1
+            stats['bytes'] += len(chunk)
+            # A slow consumer takes four frame intervals to write each frame
+            socketio.sleep(4.0 / fps if slow else 0)
+            if not running:
+                break
+        stream.close()
+
+    tracemalloc.start()
+    base_memory = tracemalloc.get_traced_memory()[0]
+    cpu = time.process_time()
+    for i in range(consumers):
+        socketio.start_background_task(consume, i % 10 == 0)
+    socketio.sleep(seconds)
+    memory = tracemalloc.get_traced_memory()[0] - base_memory
+    running = False
+    socketio.sleep(1)
+    cpu = time.process_time() - cpu
+    tracemalloc.stop()
+    return {
+        'consumers': consumers,
+        'produced': broadcaster.seq,
+        'frames': stats['frames'],
+        'dropped': broadcaster.dropped,
+        'us_per_frame': cpu / max(stats['frames'], 1) * 1e6,
+        'kb_per_consumer': memory / consumers / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--consumers', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--fps', type=float, default=15)
+    args = parser.parse_args()
+
+    for consumers in (args.consumers // 10, args.consumers):
+        result = run(consumers, args.seconds, args.fps)
+        print('{consumers:>6} consumers: {produced} frames produced, '
+              '{frames:,} delivered, {dropped:,} dropped, '
+              '{us_per_frame:.1f} us CPU/frame, '
+              '{kb_per_consumer:.2f} KB/consumer'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Chat delivery latency for well-behaved clients next to one flooding client.
+
+Runs the real Socket.IO handlers in-process: N clients send chat at a steady
+aggregate rate while one extra client sends `--flood` messages for every
+normal one. Reports p50/p99 delivery latency of the normal clients' messages
+(measured from their scheduled send time) alone, then next to the flood
+with rate limiting off and with the drop and disconnect policies.
+
+Then fires `--burst-events` events at once through a delay-policy limit (the
+policy used for ICE candidates) and reports how many ran, whether in the
+order they arrived, and when the last one did.
+
+    python benchmarks/rate_limit.py --clients 100 --messages 1000 --flood 50
+"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+
+import eventlet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, socketio, chat_batcher, rate_limiter
+from rate_limiter import RateLimiter  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(clients, messages, rate, flood):
+    viewers = [socketio.test_client(app, auth={'chat_batch': True})
+               for _ in range(clients)]
+    flooder = socketio.test_client(app, auth={'chat_batch': True})
+
+    # Start every run with the batcher's load estimate from idle and without
+    # the previous run's garbage
+    chat_batcher._rate.clear()
+    gc.collect()
+    send_packet = socketio.server._send_packet
+    latencies = []
+    delivered = set()
+
+    def timing_send_packet(eio_sid, pkt):
+        if pkt.data and pkt.data[0] == 'chat_batch':
+            now = time.perf_counter()
+            for message in pkt.data[1]['messages']:
+                if 'sent' in message:
+                    latencies.append(now - message['sent'])
+                    delivered.add(message['sent'])
+        send_packet(eio_sid, pkt)
+
+    socketio.server._send_packet = timing_send_packet
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    try:
+        for i in range(messages):
+            for _ in range(flood):
+                # The disconnect policy ends the flood
+                if not flooder.is_connected():
+                    break
+                flooder.emit('chat_message', {'user': 'flood', 'msg': 'spam'})
+            arrival = start + i * interval
+            socketio.sleep(max(0, arrival - time.perf_counter()))
+            viewers[i % clients].emit('chat_message', {
+                'user': f'user{i % clients}', 'msg': 'hello', 'sent': arrival})
+        socketio.sleep(chat_batcher.max_window * 2)
+        chat_batcher.flush_all()
+    finally:
+        socketio.server._send_packet = send_packet
+    for client in viewers + [flooder]:
+        if client.is_connected():
+            client.disconnect()
+    return {
+        'delivered': len(delivered),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def delay_order(events, rate, burst):
+    """Send `events` at once through a delay limit; returns the order they
+    ran in and the seconds until the last one did"""
+    limiter = RateLimiter({'bench_delay': (rate, burst, 'delay')})
+    ran = []
+
+    @limiter.limit('bench_delay', key_func=lambda: 'bench',
+                   sleep=socketio.sleep)
+    def handler(i):
+        ran.append(i)
+
+    pool = eventlet.GreenPool(events)
+    start = time.perf_counter()
+    for i in range(events):
+        pool.spawn(handler, i)
+    pool.waitall()
+    return ran, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='messages per second from the normal clients')
+    parser.add_argument('--flood', type=int, default=50,
+                        help='flood messages per normal message')
+    parser.add_argument('--burst-events', type=int, default=20)
+    parser.add_argument('--delay-limit', default='50/5',
+                        help='rate/burst of the delay policy case')
+    args = parser.parse_args()
+
+    limit = rate_limiter.limits['chat_message']
+    for label, limits, flood in (('no flood', limit, 0),
+                                 ('limits off', (1e9, 1e9, 'drop'), args.flood),
+                                 ('drop', limit, args.flood),
+                                 ('disconnect', limit[:2] + ('disconnect',),
+                                  args.flood)):
+        rate_limiter.limits['chat_message'] = limits
+        rejected_before = rate_limiter.rejected['chat_message']
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run(args.clients, args.messages, args.rate, flood)
+        rejected = rate_limiter.rejected['chat_message']
+        print(f'{label:>10}: {result["delivered"]}/{args.messages} normal '
+              f'messages delivered, p50 {result["p50_ms"]:.1f} ms, '
+              f'p99 {result["p99_ms"]:.1f} ms, {rejected - rejected_before:,} '
+              f'flood events rejected')
+
+    rate, _, burst = args.delay_limit.partition('/')
+    ran, elapsed = delay_order(args.burst_events, float(rate), float(burst))
+    in_order = 'in order' if ran == sorted(ran) else 'OUT OF ORDER'
+    print(f'{"delay":>10}: {len(ran)}/{args.burst_events} simultaneous events '
+          f'ran at {args.delay_limit}, {in_order}, the last after '
+          f'{elapsed * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""JSON versus MessagePack encoding of the app's Socket.IO packets.
+
+Encodes and decodes realistic payloads with python-socketio's own packet
+classes (the default JSON one and the one SOCKETIO_SERIALIZER=msgpack
+selects) and reports time per packet and bytes on the wire. Engine.IO adds
+one framing byte over websocket either way; over long-polling a binary
+packet is base64-encoded, shown in the last column.
+
+Needs msgpack (pip install msgpack).
+
+    python benchmarks/serializers.py --seconds 0.5
+"""
+import argparse
+import random
+import string
+import time
+
+from socketio import packet
+from socketio.msgpack_packet import MsgPackPacket
+
+random.seed(1)
+
+
+def text(length):
+    return ''.join(random.choice(string.ascii_letters + '     ')
+                   for _ in range(length))
+
+
+def chat(number):
+    return {'user': f'viewer{number}', 'msg': text(random.randint(10, 80)),
+            'id': 1000 + number, 'ts': 1792266328.736 + number / 10}
+
+
+def sdp(kind):
+    """An SDP offer or answer shaped like a browser's, audio and video"""
+    lines = ['v=0', 'o=- 4611731400430051336 2 IN IP4 127.0.0.1', 's=-',
+             't=0 0', 'a=group:BUNDLE 0 1', 'a=extmap-allow-mixed',
+             'a=msid-semantic: WMS stream']
+    for mid, media, payloads in (('0', 'audio', range(111, 127)),
+                                 ('1', 'video', range(96, 128))):
+        lines += [f'm={media} 9 UDP/TLS/RTP/SAVPF ' +
+                  ' '.join(map(str, payloads)), 'c=IN IP4 0.0.0.0',
+                  'a=rtcp:9 IN IP4 0.0.0.0', f'a=ice-ufrag:{text(4)}',
+                  f'a=ice-pwd:{text(24)}', 'a=ice-options:trickle',
+                  'a=fingerprint:sha-256 ' + ':'.join(
+                      f'{random.randrange(256):02X}' for _ in range(32)),
+                  f'a=setup:{"actpass" if kind == "offer" else "active"}',
+                  f'a=mid:{mid}', 'a=sendrecv', 'a=rtcp-mux']
+        for payload in payloads:
+            lines += [f'a=rtpmap:{payload} {media.upper()}{payload}/90000',
+                      f'a=rtcp-fb:{payload} nack',
+                      f'a=fmtp:{payload} level-asymmetry-allowed=1;'
+                      f'packetization-mode=1;profile-level-id=42e01f']
+        lines += [f'a=ssrc:{random.randrange(2**32)} cname:{text(16)}']
+    return {'type': kind, 'sdp': '\r\n'.join(lines) + '\r\n'}
+
+
+def candidate(index):
+    return {'candidate': f'candidate:{random.randrange(2**32)} 1 udp '
+                         f'{2122260223 - index} 192.168.1.{index} '
+                         f'{50000 + index} typ host generation 0 '
+                         f'ufrag {text(4)} network-id 1',
+            'sdpMid': '0', 'sdpMLineIndex': 0}
+
+
+STREAM = {'stream_id': 'XFcnwAk7', 'active': True,
+          'streamer_id': 'f2oPOcpz4_HNgZOeAAAB', 'streamer_name': 'someone',
+          'playback_id': None, 'ingest': None, 'started_at': 1792266328.736}
+
+PAYLOADS = {
+    'viewer_count': ['viewer_count', {'count': 1234}],
+    'chat_message': ['chat_message', chat(1)],
+    'chat_batch (50)': ['chat_batch', {'messages': [chat(n)
+                                                    for n in range(50)]}],
+    'stream_list (20)': ['stream_list', {'streams': [STREAM] * 20}],
+    'webrtc_offer': ['webrtc_offer', {'offer': sdp('offer'),
+                                      'streamer_id': STREAM['streamer_id'],
+                                      'streamer_name': 'someone'}],
+    'webrtc_answer': ['webrtc_answer', {'answer': sdp('answer'),
+                                        'viewer_id': STREAM['streamer_id']}],
+    'ice_candidates (8)': ['webrtc_ice_candidates', {
+        'from_id': STREAM['streamer_id'], 'end': False, 'seq': 3,
+        'candidates': [candidate(n) for n in range(8)]}],
+}
+
+
+def per_call(func, seconds):
+    """Mean seconds per call of `func` over about `seconds`"""
+    count, start = 0, time.perf_counter()
+    while True:
+        for _ in range(100):
+            func()
+        count += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return elapsed / count
+
+
+def measure(packet_class, data, seconds):
+    pkt = packet_class(packet.EVENT, data=data, namespace='/')
+    encoded = pkt.encode()
+    size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+    encode = per_call(pkt.encode, seconds)
+    if packet_class is MsgPackPacket:
+        decode = per_call(lambda: MsgPackPacket(encoded_packet=encoded),
+                          seconds)
+    else:
+        decode = per_call(lambda: packet.Packet(encoded_packet=encoded),
+                          seconds)
+    return size, encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=0.5,
+                        help='time spent on each measurement')
+    args = parser.parse_args()
+
+    print(f'{"payload":<20}{"format":>8}{"bytes":>8}{"encode us":>11}'
+          f'{"decode us":>11}{"polling bytes":>15}')
+    for name, data in PAYLOADS.items():
+        for label, packet_class in (('json', packet.Packet),
+                                    ('msgpack', MsgPackPacket)):
+            size, encode, decode = measure(packet_class, data, args.seconds)
+            polling = size if label == 'json' else 1 + (size + 2) // 3 * 4
+            print(f'{name:<20}{label:>8}{size:>8}{encode * 1e6:>11.2f}'
+                  f'{decode * 1e6:>11.2f}{polling:>15}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Memory per session and disconnect cost of the indexed session store.
+
+Fills a SessionStore with `--sessions` sessions spread over `--streams`
+streams (one broadcaster each) and reports the memory it holds, per 100k
+sessions, next to the bare set and dict it replaced. Then times removing
+sessions from stores of growing size, to show disconnect cleanup does not
+depend on how many sessions are connected.
+
+    python benchmarks/session_memory.py --sessions 100000 --streams 100
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import BROADCASTER, SessionStore  # noqa: E402
+
+
+def sid(number):
+    # Same length as Socket.IO sids
+    return f'{number:020d}'
+
+
+def fill(count, streams):
+    names = [f'stream{number}' for number in range(streams)]
+    store = SessionStore()
+    for number in range(count):
+        key = sid(number)
+        store.add(key, 'websocket' if number % 4 else 'polling')
+        store.set_stream(key, names[number % streams])
+        if number < streams:
+            store.set_role(key, BROADCASTER)
+    return store
+
+
+def fill_baseline(count, streams):
+    names = [f'stream{number}' for number in range(streams)]
+    connected_users, viewer_streams = set(), {}
+    for number in range(count):
+        key = sid(number)
+        connected_users.add(key)
+        viewer_streams[key] = names[number % streams]
+    return connected_users, viewer_streams
+
+
+def measure(func, *args):
+    """Bytes held by what `func` returns, less the sid strings themselves"""
+    tracemalloc.start()
+    result = func(*args)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, used - args[0] * sys.getsizeof(sid(0))
+
+
+def disconnect_cost(count, streams, removals):
+    store = fill(count, streams)
+    victims = [sid(number) for number in random.sample(range(count), removals)]
+    start = time.perf_counter()
+    for key in victims:
+        store.remove(key)
+    return (time.perf_counter() - start) / removals * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--streams', type=int, default=100)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--removals', type=int, default=1000)
+    args = parser.parse_args()
+
+    scale = 100000 / args.sessions
+    store, used = measure(fill, args.sessions, args.streams)
+    _, baseline = measure(fill_baseline, args.sessions, args.streams)
+    print(f'session store: {used * scale / 2**20:.1f} MiB per 100k sessions '
+          f'({used / args.sessions:.0f} bytes each, sid strings excluded)')
+    print(f'set + dict it replaced: {baseline * scale / 2**20:.1f} MiB '
+          f'per 100k sessions (no role, transport or stream indexes)')
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        store.snapshot()
+        timings.append(time.perf_counter() - start)
+    print(f'snapshot of {len(store)} sessions: '
+          f'{min(timings) * 1000:.3f} ms')
+
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        cost = disconnect_cost(size, args.streams, min(args.removals, size))
+        print(f'{size:>9,} sessions: {cost:6.0f} ns per disconnect',
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Forwarded streams per core for the SFU relay, entirely on loopback.
+
+Publishes a synthetic VP8 track (pre-encoded once, so the publisher does no
+encoding) to an in-process SFU and attaches aiortc viewers that count the
+frames they receive without decoding them. For each viewer count, reports
+delivered frame rate, frames dropped by the SFU, the CPU time of the SFU's
+own thread and the resulting forwarded streams per fully used core.
+
+Needs aiortc (pip install -r requirements-sfu.txt).
+
+    python benchmarks/sfu_forwarding.py --viewers 1,10,25,50 --duration 10
+"""
+import argparse
+import asyncio
+import fractions
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import av  # noqa: E402
+from aiortc import (MediaStreamTrack, RTCPeerConnection,  # noqa: E402
+                    RTCRtpSender, RTCSessionDescription)
+
+from sfu import SFU  # noqa: E402
+
+WIDTH, HEIGHT = 640, 360
+
+
+def encode_frames(count, fps, bitrate):
+    """A loop of VP8 frames with a keyframe every second"""
+    context = av.CodecContext.create('libvpx', 'w')
+    context.width, context.height = WIDTH, HEIGHT
+    context.pix_fmt = 'yuv420p'
+    context.time_base = fractions.Fraction(1, fps)
+    context.gop_size = fps
+    context.bit_rate = bitrate
+    noise = os.urandom(WIDTH * HEIGHT * 2)
+    frames = []
+    for index in range(count):
+        frame = av.VideoFrame(WIDTH, HEIGHT, 'yuv420p')
+        for number, plane in enumerate(frame.planes):
+            if number == 0:
+                plane.update(noise[index * 7:][:plane.buffer_size])
+            else:
+                plane.update(bytes([128]) * plane.buffer_size)
+        frame.pts = index
+        frames += [bytes(packet) for packet in context.encode(frame)]
+    frames += [bytes(packet) for packet in context.encode(None)]
+    return frames
+
+
+class SyntheticTrack(MediaStreamTrack):
+    """Pre-encoded frames, paced at `fps`"""
+    kind = 'video'
+
+    def __init__(self, frames, fps):
+        super().__init__()
+        self.frames = frames
+        self.fps = fps
+        self.index = 0
+        self.start = None
+
+    async def recv(self):
+        if self.start is None:
+            self.start = time.perf_counter()
+        due = self.start + self.index / self.fps
+        await asyncio.sleep(max(0, due - time.perf_counter()))
+        packet = av.Packet(self.frames[self.index % len(self.frames)])
+        packet.pts = self.index * 90000 // self.fps
+        packet.time_base = fractions.Fraction(1, 90000)
+        self.index += 1
+        return packet
+
+
+class FrameCounter:
+    """Stands in for a viewer receiver's decoder queue"""
+
+    def __init__(self, receiver):
+        self.frames = 0
+        self._queue = receiver._RTCRtpReceiver__decoder_queue
+        receiver._RTCRtpReceiver__decoder_queue = self
+
+    def put(self, item):
+        if item is None:
+            self._queue.put(None)
+        else:
+            self.frames += 1
+
+    def get(self):
+        return self._queue.get()
+
+
+def description(pc):
+    return {'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type}
+
+
+def vp8_only(transceiver):
+    transceiver.setCodecPreferences([
+        codec for codec in RTCRtpSender.getCapabilities('video').codecs
+        if codec.mimeType in ('video/VP8', 'video/rtx')])
+
+
+async def sfu_thread_time(sfu):
+    async def thread_time():
+        return time.thread_time()
+    return await asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(thread_time(), sfu._loop))
+
+
+async def run(frames, viewers, args):
+    sfu = SFU()
+    publisher = RTCPeerConnection()
+    vp8_only(publisher.addTransceiver(SyntheticTrack(frames, args.fps),
+                                      direction='sendonly'))
+    await publisher.setLocalDescription(await publisher.createOffer())
+    answer = await asyncio.to_thread(sfu.publish, 'bench',
+                                     description(publisher))
+    await publisher.setRemoteDescription(RTCSessionDescription(**answer))
+    # Wait for the first frames to reach the SFU
+    while not sfu.publications['bench'][1].get('video') or \
+            not sfu.publications['bench'][1]['video'].frames:
+        await asyncio.sleep(0.05)
+
+    pcs, counters = [], []
+    for number in range(viewers):
+        pc = RTCPeerConnection()
+        vp8_only(pc.addTransceiver('video', direction='recvonly'))
+        await pc.setLocalDescription(await pc.createOffer())
+        answer = await asyncio.to_thread(sfu.subscribe, 'bench',
+                                         f'viewer{number}', description(pc))
+        await pc.setRemoteDescription(RTCSessionDescription(**answer))
+        counters.append(FrameCounter(pc.getTransceivers()[0].receiver))
+        pcs.append(pc)
+
+    # Let every viewer connect and reach a keyframe before measuring
+    await asyncio.sleep(args.warmup)
+    received = sum(counter.frames for counter in counters)
+    published = sfu.publications['bench'][1]['video'].frames
+    forwarded, dropped = sfu.forwarded, sfu.dropped
+    cpu, start = await sfu_thread_time(sfu), time.perf_counter()
+    await asyncio.sleep(args.duration)
+    cpu = await sfu_thread_time(sfu) - cpu
+    elapsed = time.perf_counter() - start
+    received = sum(counter.frames for counter in counters) - received
+    published = sfu.publications['bench'][1]['video'].frames - published
+    forwarded, dropped = sfu.forwarded - forwarded, sfu.dropped - dropped
+
+    for pc in pcs + [publisher]:
+        await pc.close()
+    await asyncio.to_thread(sfu.unpublish, 'bench')
+    cpu_share = cpu / elapsed
+    return {
+        'viewers': viewers,
+        'published_fps': round(published / elapsed, 1),
+        'viewer_fps': round(received / elapsed / viewers, 1),
+        'forwarded': forwarded,
+        'dropped': dropped,
+        'sfu_cpu_percent': round(cpu_share * 100, 1),
+        'streams_per_core': round(viewers / cpu_share) if cpu_share else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', default='1,10,25,50')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=1000000)
+    args = parser.parse_args()
+
+    frames = encode_frames(args.fps * 4, args.fps, args.bitrate)
+    for viewers in [int(v) for v in args.viewers.split(',') if v]:
+        result = asyncio.run(run(frames, viewers, args))
+        print(f"{result['viewers']:4d} viewers: "
+              f"{result['viewer_fps']}/{result['published_fps']} fps "
+              f"delivered, {result['dropped']} dropped, SFU thread "
+              f"{result['sfu_cpu_percent']}% CPU, "
+              f"~{result['streams_per_core']} streams/core", flush=True)
+
+
+if __name__ == '__main__':
+    main()
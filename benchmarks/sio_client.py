@@ -0,0 +1,322 @@
+"""Minimal Socket.IO v5 / Engine.IO v4 client for load generation.
+
+Speaks the wire protocol directly over eventlet green sockets, so thousands
+of clients fit in one process without extra dependencies. Supports the
+polling and websocket transports (no upgrade, no binary packets).
+
+    client = create_client('127.0.0.1', 5000, 'websocket')
+    client.on('chat_batch', handle_batch)
+    client.connect(auth={'chat_batch': True})
+    client.emit('chat_message', {'user': 'bench', 'msg': 'hi'})
+    stream_id = client.call('start_broadcast', {'user_name': 'bench'})
+"""
+import base64
+import json
+import os
+import struct
+import time
+
+import eventlet
+import eventlet.event
+import eventlet.semaphore
+from eventlet.green import socket
+
+
+def http_request(sock, reader, method, path, body=b'', headers=None):
+    """One HTTP/1.1 request on a keep-alive connection; returns
+    (status, headers, body)"""
+    lines = [f'{method} {path} HTTP/1.1', 'Host: localhost',
+             f'Content-Length: {len(body)}']
+    lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+    sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+    status_line = reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    response_headers = {}
+    while True:
+        line = reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    if response_headers.get('transfer-encoding') == 'chunked':
+        chunks = []
+        while True:
+            size = int(reader.readline().split(b';')[0], 16)
+            if size == 0:
+                reader.readline()
+                break
+            chunks.append(reader.read(size))
+            reader.readline()
+        data = b''.join(chunks)
+    else:
+        data = reader.read(int(response_headers.get('content-length', 0)))
+    return status, response_headers, data
+
+
+class SocketIOClient:
+    transport = None
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sid = None
+        self.eio_sid = None
+        self.handlers = {}
+        self.connected = False
+        self.closed = False
+        self._connected = eventlet.event.Event()
+        self._acks = {}
+        self._ack_id = 0
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def connect(self, auth=None, timeout=10):
+        """Open the transport and the default namespace; returns the sid"""
+        self._auth = auth
+        with eventlet.Timeout(timeout):
+            self._open()
+            self.sid = self._connected.wait()
+        if self.sid is None:
+            raise ConnectionError('connection refused by server')
+        self.connected = True
+        return self.sid
+
+    def emit(self, event, data=None, callback=None):
+        payload = [event] if data is None else [event, data]
+        ack = ''
+        if callback is not None:
+            self._ack_id += 1
+            ack = str(self._ack_id)
+            self._acks[self._ack_id] = callback
+        self._send('42' + ack + json.dumps(payload, separators=(',', ':')))
+
+    def call(self, event, data=None, timeout=10):
+        """Emit and wait for the handler's return value"""
+        done = eventlet.event.Event()
+        self.emit(event, data, callback=lambda *args: done.send(
+            args[0] if args else None))
+        with eventlet.Timeout(timeout):
+            return done.wait()
+
+    def disconnect(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._send('41')
+                self._send('1')
+            except OSError:
+                pass
+            self._close()
+
+    def _handle(self, pkt):
+        """Process one Engine.IO packet"""
+        kind = pkt[:1]
+        if kind == '0':
+            self.eio_sid = json.loads(pkt[1:])['sid']
+            self._send('40' + (json.dumps(self._auth) if self._auth else ''))
+        elif kind == '2':
+            self._send('3' + pkt[1:])
+        elif kind == '1':
+            self.closed = True
+        elif kind == '4':
+            self._handle_socketio(pkt[1:])
+
+    def _handle_socketio(self, pkt):
+        kind = pkt[:1]
+        body = pkt[1:]
+        if kind == '0':
+            self._connected.send(json.loads(body)['sid'])
+        elif kind == '4':
+            if not self._connected.ready():
+                self._connected.send(None)
+        elif kind == '1':
+            self.connected = False
+            self.closed = True
+        elif kind in ('2', '3'):
+            split = body.find('[')
+            ack_id = body[:split]
+            data = json.loads(body[split:])
+            if kind == '3':
+                callback = self._acks.pop(int(ack_id), None)
+                if callback:
+                    callback(*data)
+                return
+            handler = self.handlers.get(data[0])
+            if handler is not None:
+                handler(*data[1:])
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _send(self, pkt):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class PollingClient(SocketIOClient):
+    """Long-polling transport; sends are queued and POSTed in batches"""
+    transport = 'polling'
+
+    def _connection(self):
+        sock = socket.create_connection((self.host, self.port))
+        return sock, sock.makefile('rb')
+
+    def _path(self):
+        path = f'/socket.io/?EIO=4&transport=polling&t={time.time()}'
+        if self.eio_sid:
+            path += f'&sid={self.eio_sid}'
+        return path
+
+    def _open(self):
+        self._get = self._connection()
+        self._post = None
+        self._outbox = []
+        self._sending = False
+        status, _, data = http_request(*self._get, 'GET', self._path())
+        if status != 200:
+            raise ConnectionError(f'handshake failed with HTTP {status}')
+        for pkt in data.decode().split('\x1e'):
+            self._handle(pkt)
+        self._reader = eventlet.spawn(self._poll)
+
+    def _poll(self):
+        while not self.closed:
+            try:
+                status, _, data = http_request(*self._get, 'GET', self._path())
+            except (OSError, ValueError, eventlet.Timeout):
+                break
+            if status != 200:
+                break
+            for pkt in data.decode().split('\x1e'):
+                self._handle(pkt)
+        self.closed = True
+        if not self._connected.ready():
+            self._connected.send(None)
+
+    def _send(self, pkt):
+        self._outbox.append(pkt)
+        if not self._sending:
+            self._sending = True
+            eventlet.spawn(self._flush)
+
+    def _flush(self):
+        try:
+            while self._outbox:
+                body = '\x1e'.join(self._outbox).encode()
+                self._outbox = []
+                if self._post is None:
+                    self._post = self._connection()
+                http_request(*self._post, 'POST', self._path(), body,
+                             {'Content-Type': 'text/plain;charset=UTF-8'})
+        except OSError:
+            self.closed = True
+        finally:
+            self._sending = False
+
+    def _close(self):
+        # Deliver the goodbye packets before dropping the connections
+        while self._sending:
+            eventlet.sleep(0.001)
+        self._sending = True
+        self._flush()
+        for conn in (self._get, self._post):
+            if conn is not None:
+                conn[0].close()
+
+
+class WebSocketClient(SocketIOClient):
+    """Direct websocket transport with a minimal RFC 6455 framer"""
+    transport = 'websocket'
+
+    def _open(self):
+        self._sock = socket.create_connection((self.host, self.port))
+        self._write_lock = eventlet.semaphore.Semaphore()
+        self._rfile = self._sock.makefile('rb')
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (f'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+                   f'Host: localhost\r\nUpgrade: websocket\r\n'
+                   f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n'
+                   f'Sec-WebSocket-Version: 13\r\n\r\n')
+        self._sock.sendall(request.encode())
+        status = self._rfile.readline()
+        if b' 101 ' not in status:
+            raise ConnectionError(f'websocket upgrade failed: {status!r}')
+        while self._rfile.readline() not in (b'\r\n', b''):
+            pass
+        self._reader = eventlet.spawn(self._read_loop)
+
+    def _read_loop(self):
+        try:
+            while not self.closed:
+                opcode, payload = self._read_frame()
+                if opcode == 1:
+                    self._handle(payload.decode())
+                elif opcode == 8:
+                    break
+                elif opcode == 9:
+                    self._write_frame(10, payload)
+        except (OSError, ValueError, struct.error):
+            pass
+        self.closed = True
+        if not self._connected.ready():
+            self._connected.send(None)
+
+    def _read_exact(self, size):
+        data = self._rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError('connection closed')
+        return data
+
+    def _read_frame(self):
+        message = b''
+        opcode = 0
+        while True:
+            first, second = self._read_exact(2)
+            length = second & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', self._read_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._read_exact(8))[0]
+            if second & 0x80:
+                mask = self._read_exact(4)
+                data = bytes(b ^ mask[i % 4]
+                             for i, b in enumerate(self._read_exact(length)))
+            else:
+                data = self._read_exact(length)
+            opcode = first & 0x0f or opcode
+            message += data
+            if first & 0x80:
+                return opcode, message
+
+    def _write_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 65536:
+            header += bytes([0x80 | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', length)
+        mask = os.urandom(4)
+        # XOR the payload with the repeated mask as one big integer
+        repeated = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^
+                  int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+        with self._write_lock:
+            self._sock.sendall(header + mask + masked)
+
+    def _send(self, pkt):
+        self._write_frame(1, pkt.encode())
+
+    def _close(self):
+        self._sock.close()
+
+
+def create_client(host, port, transport='websocket'):
+    cls = WebSocketClient if transport == 'websocket' else PollingClient
+    return cls(host, port)
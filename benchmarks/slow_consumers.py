@@ -0,0 +1,156 @@
+"""Server memory with slow clients, with and without bounded send queues.
+
+Starts the app in a child process (see loadtest.py) and connects
+`--clients` websocket clients. `--slow-fraction` of them read at
+`--slow-speed` of the chat rate, with small receive buffers so the backlog
+stays on the server. One client then sends `--rate` chat messages per
+second (unbatched, `--size` bytes each) for `--duration` seconds.
+
+Each policy is a fresh server: `unbounded` (no limit), `drop` (collapse
+and drop_oldest) and `disconnect` (collapse, then disconnect after
+`--max-lag` seconds full). The report gives the server's RSS at the start,
+at its peak and at the end, the messages the fast clients received, and
+the server's own slow-consumer counters.
+
+    python benchmarks/slow_consumers.py --clients 100 --duration 60
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+import eventlet
+from eventlet.green import socket
+
+# Imported from this directory; loadtest sets up the path to the app
+from loadtest import ServerProcess, connect_all, disconnect_all, raise_fd_limit
+from sio_client import WebSocketClient
+
+POLICIES = {
+    'unbounded': {'OUTBOUND_QUEUE_POLICY': '', 'OUTBOUND_QUEUE_LIMIT': '1000000000'},
+    'drop': {'OUTBOUND_QUEUE_POLICY': 'collapse,drop_oldest'},
+    'disconnect': {'OUTBOUND_QUEUE_POLICY': 'collapse,disconnect'},
+}
+
+
+class SlowClient(WebSocketClient):
+    """Takes `delay` seconds over every frame it reads"""
+    delay = 1.0
+
+    def _open(self):
+        super()._open()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+    def _read_frame(self):
+        if self._connected.ready():
+            eventlet.sleep(self.delay)
+        return super()._read_frame()
+
+
+def connect_slow(server, count, delay):
+    clients = []
+    for _ in range(count):
+        client = SlowClient('127.0.0.1', server.port)
+        client.delay = delay
+        client.connect(auth={'chat_batch': True})
+        clients.append(client)
+    return clients
+
+
+def run(policy, args):
+    env = dict(POLICIES[policy], LOG_LEVEL='warning', RATE_LIMITS='',
+               CHAT_BATCH_MODE='off', OUTBOUND_MAX_LAG=str(args.max_lag))
+    if 'OUTBOUND_QUEUE_LIMIT' not in env:
+        env['OUTBOUND_QUEUE_LIMIT'] = str(args.limit)
+    server = ServerProcess(env)
+    try:
+        slow_count = int(args.clients * args.slow_fraction)
+        fast, failures = connect_all(server, 'websocket',
+                                     args.clients - slow_count,
+                                     args.concurrency)
+        slow = connect_slow(server, slow_count,
+                            1 / (args.rate * args.slow_speed))
+        received = [0]
+
+        def count(data):
+            received[0] += 1
+
+        for client in fast:
+            client.on('chat_message', count)
+        sender = fast[0]
+        eventlet.sleep(1)
+
+        rss = [server.rss_mb()]
+        start = rss[0]
+        message = {'user': 'bench', 'msg': 'x' * args.size}
+        sent = 0
+        began = time.perf_counter()
+        next_sample = began + 1
+        while time.perf_counter() - began < args.duration:
+            sender.emit('chat_message', message)
+            sent += 1
+            now = time.perf_counter()
+            if now >= next_sample:
+                rss.append(server.rss_mb())
+                next_sample += 1
+            eventlet.sleep(max(0, began + sent / args.rate -
+                               time.perf_counter()))
+        eventlet.sleep(2)
+        rss.append(server.rss_mb())
+        with urllib.request.urlopen(
+                f'http://127.0.0.1:{server.port}/stats', timeout=10) as r:
+            outbound = json.load(r)['outbound']
+        result = {
+            'policy': policy,
+            'fast_clients': len(fast),
+            'slow_clients': len(slow),
+            'connect_failures': failures,
+            'sent': sent,
+            'fast_delivery': round(received[0] / (sent * len(fast)), 4),
+            'rss_start_mb': round(start, 1),
+            'rss_peak_mb': round(max(rss), 1),
+            'rss_end_mb': round(rss[-1], 1),
+            'rss_mb_per_second': [round(v, 1) for v in rss],
+            'dropped': outbound['dropped'],
+            'disconnected': outbound['disconnected'],
+            'max_lag': outbound['max_lag'],
+        }
+        for client in slow:
+            client.closed = True
+            client._sock.close()
+        disconnect_all(fast)
+        return result
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--slow-fraction', type=float, default=0.1)
+    parser.add_argument('--slow-speed', type=float, default=0.01)
+    parser.add_argument('--rate', type=float, default=50,
+                        help='chat messages per second')
+    parser.add_argument('--size', type=int, default=4000)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--max-lag', type=float, default=10)
+    parser.add_argument('--policies', default=','.join(POLICIES))
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    for policy in [p for p in args.policies.split(',') if p]:
+        result = run(policy, args)
+        print(f"{policy:>10}: RSS {result['rss_start_mb']} -> peak "
+              f"{result['rss_peak_mb']} -> end {result['rss_end_mb']} MB, "
+              f"fast clients got {result['fast_delivery']:.1%} of "
+              f"{result['sent']} messages, {result['dropped']} dropped, "
+              f"{result['disconnected']} disconnected, max lag "
+              f"{result['max_lag']} s", flush=True)
+        print(f"{'':>12}RSS per second: {result['rss_mb_per_second']}",
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
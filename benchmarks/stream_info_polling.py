@@ -0,0 +1,131 @@
+"""Keeping up with /stream/info: plain polling, conditional GET, long-poll.
+
+Starts the app in a child process (see loadtest.py). A broadcaster starts
+and stops a stream every `--change-every` seconds over Socket.IO, and
+`--clients` keep-alive HTTP clients follow /stream/info for `--seconds`:
+
+- `poll`: a plain GET every `--interval` seconds, like the old clients
+- `conditional`: the same with If-None-Match, answered by a 304 while
+  nothing changed
+- `longpoll`: `?wait_version=N` with If-None-Match, sent again as soon as
+  it returns
+
+The report gives the requests and body bytes per client per minute, the
+server's CPU, and how long after each change the clients saw it.
+
+    python benchmarks/stream_info_polling.py --clients 500 --seconds 30
+"""
+import argparse
+import json
+import time
+
+import eventlet
+from eventlet.green import socket
+
+# Imported from this directory; loadtest sets up the path to the app
+from loadtest import ServerProcess, raise_fd_limit, summarize
+from sio_client import create_client, http_request
+
+
+def broadcaster(port, every, changes, running):
+    client = create_client('127.0.0.1', port)
+    client.connect()
+    try:
+        live = False
+        while running[0]:
+            eventlet.sleep(every)
+            changes.append(time.time())
+            client.call('stop_broadcast' if live else 'start_broadcast',
+                        {'user_name': 'bench'})
+            live = not live
+    finally:
+        client.disconnect()
+
+
+def follow(port, mode, args, deadline, changes, samples, stats):
+    sock = socket.create_connection(('127.0.0.1', port))
+    reader = sock.makefile('rb')
+    version = etag = None
+    try:
+        while time.time() < deadline:
+            path = '/stream/info'
+            headers = {}
+            if mode != 'poll' and etag is not None:
+                headers['If-None-Match'] = etag
+            if mode == 'longpoll' and version is not None:
+                path += f'?wait_version={version}'
+            status, response_headers, body = http_request(
+                sock, reader, 'GET', path, headers=headers)
+            stats['requests'] += 1
+            stats['bytes'] += len(body)
+            stats[status] = stats.get(status, 0) + 1
+            if status == 200:
+                seen = json.loads(body)['version']
+                # The first response only tells where the client starts
+                if version is not None and seen != version and changes:
+                    samples.append(time.time() - changes[-1])
+                version = seen
+                etag = response_headers.get('etag')
+            if mode != 'longpoll':
+                eventlet.sleep(args.interval)
+    finally:
+        sock.close()
+
+
+def run(mode, args):
+    server = ServerProcess({'LOG_LEVEL': 'warning',
+                            'STREAM_INFO_MAX_WAIT': str(args.max_wait)})
+    changes, samples = [], []
+    stats = {'requests': 0, 'bytes': 0}
+    running = [True]
+    changer = eventlet.spawn(broadcaster, server.port, args.change_every,
+                             changes, running)
+    result = {'mode': mode}
+    try:
+        deadline = time.time() + args.seconds
+        with server.measure(result):
+            pool = eventlet.GreenPool(args.clients)
+            for n in range(args.clients):
+                pool.spawn(follow, server.port, mode, args, deadline,
+                           changes, samples, stats)
+                # Spread the pollers over the interval
+                if mode != 'longpoll':
+                    eventlet.sleep(args.interval / args.clients)
+            pool.waitall()
+        running[0] = False
+        changer.wait()
+    finally:
+        changer.kill()
+        server.stop()
+    minutes = args.clients * args.seconds / 60
+    result.update(stats, changes=len(changes), seen_after_ms=summarize(samples),
+                  requests_per_minute=round(stats['requests'] / minutes, 1),
+                  bytes_per_minute=round(stats['bytes'] / minutes))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--interval', type=float, default=1,
+                        help='seconds between polls')
+    parser.add_argument('--change-every', type=float, default=3)
+    parser.add_argument('--max-wait', type=float, default=30)
+    parser.add_argument('--modes', default='poll,conditional,longpoll')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    for mode in [m for m in args.modes.split(',') if m]:
+        result = run(mode, args)
+        seen = result['seen_after_ms']
+        print(f"{mode:>12}: {result['requests_per_minute']} requests and "
+              f"{result['bytes_per_minute']} body bytes per client per "
+              f"minute ({result.get(200, 0)} 200s, {result.get(304, 0)} "
+              f"304s); {result['changes']} changes seen after p50 "
+              f"{seen['p50']} p99 {seen['p99']} ms; server CPU "
+              f"{result['server']['cpu_percent']}%", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Stream key validations per second, as done on the RTMP publish path.
+
+Times StreamKeys.verify on a single core for genuine keys, forged keys (a
+valid-looking key with the wrong signature), expired keys and malformed
+input. rtmp_server.js runs the same check in Node on every publish.
+
+    python benchmarks/stream_key_validation.py --count 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_keys import StreamKeys  # noqa: E402
+
+
+def rate(func, keys):
+    start = time.perf_counter()
+    for key in keys:
+        func(key)
+    return len(keys) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    keys = StreamKeys('bench-secret')
+    genuine = [keys.mint() for _ in range(args.count)]
+    forged = [key[:-8] + '00000000' for key in genuine]
+    expired = [StreamKeys('bench-secret', ttl=-60).mint()
+               for _ in range(args.count)]
+    malformed = ['stream-3-1700000000'] * args.count
+    assert all(keys.verify(key) for key in genuine[:1000])
+    assert not any(keys.verify(key) for key in forged[:1000] + expired[:1000])
+
+    for name, batch in (('genuine', genuine), ('forged', forged),
+                        ('expired', expired), ('malformed', malformed)):
+        print(f'{name:>10}: {rate(keys.verify, batch):12,.0f} keys/s',
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Fan-out throughput scaling from 1 to N worker processes.
+
+Starts a local broker, splits a fixed audience across N app workers connected
+through SOCKETIO_MESSAGE_QUEUE=local://..., publishes chat messages to the
+queue and reports delivered packets/sec for each worker count.
+
+    python benchmarks/worker_scaling.py --clients 5000 --messages 100 --max-workers 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Handler logs would drown out the results
+os.environ.setdefault('LOG_LEVEL', 'warning')
+
+
+def worker(clients, messages):
+    """Runs inside one worker process; SOCKETIO_MESSAGE_QUEUE is already set"""
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import socketio
+    server = socketio.server
+
+    # Register simulated clients directly with the manager
+    server.manager_initialized = True
+    server.manager.initialize()
+    for i in range(clients):
+        server.manager.connect(f'bench-{i}', '/')
+
+    expected = clients * messages
+    stats = {'count': 0, 'start': None}
+
+    def send_packet(eio_sid, pkt):
+        pkt.encode()
+        if stats['start'] is None:
+            stats['start'] = time.time()
+        stats['count'] += 1
+        if stats['count'] == expected:
+            print(f'DONE {stats["start"]} {time.time()} {expected}', flush=True)
+
+    server._send_packet = send_packet
+    socketio.sleep(1)
+    print('READY', flush=True)
+    while stats['count'] < expected:
+        socketio.sleep(0.1)
+
+
+def run(url, workers, clients, messages):
+    from local_broker import LocalBrokerManager
+
+    env = dict(os.environ, SOCKETIO_MESSAGE_QUEUE=url)
+    procs = [subprocess.Popen(
+        [sys.executable, __file__, '--worker', '--clients',
+         str(clients // workers), '--messages', str(messages)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)]
+    for proc in procs:
+        assert proc.stdout.readline().strip() == 'READY'
+
+    publisher = LocalBrokerManager(url, write_only=True)
+    for i in range(messages):
+        publisher.emit('chat_message', {'user': f'user{i}', 'msg': 'hello'},
+                       namespace='/')
+
+    starts, ends, delivered = [], [], 0
+    for proc in procs:
+        _, start, end, count = proc.stdout.readline().split()
+        starts.append(float(start))
+        ends.append(float(end))
+        delivered += int(count)
+        proc.wait()
+    return delivered / (max(ends) - min(starts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.clients, args.messages)
+        return
+
+    from local_broker import UnixBrokerServer
+
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    broker = UnixBrokerServer(path)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    url = f'local://{path}'
+
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        rate = run(url, workers, args.clients, args.messages)
+        baseline = baseline or rate
+        print(f'{workers:>3} workers: {rate:,.0f} packets/s '
+              f'({rate / baseline:.2f}x)')
+        workers *= 2
+    broker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
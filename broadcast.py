@@ -0,0 +1,222 @@
+import functools
+import struct
+import zlib
+
+from engineio import packet as eio_packet
+from engineio.async_drivers.eventlet import WebSocketWSGI
+from socketio import packet
+from socketio.base_manager import BaseManager
+from socketio.pubsub_manager import PubSubManager
+
+
+def websocket_frame(payload, binary, compressed=False):
+    """A complete, unmasked server-to-client WebSocket frame"""
+    first = (0x82 if binary else 0x81) | (0x40 if compressed else 0)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', first, 126, length)
+    else:
+        header = struct.pack('!BBQ', first, 127, length)
+    return header + payload
+
+
+def deflate(payload, level):
+    """permessage-deflate body of a message sent without context takeover"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    # The trailing empty block is implied by the extension
+    return data[:-4]
+
+
+class SharedFrames:
+    """The WebSocket frames of one message, each built on first use"""
+    __slots__ = ('payload', 'binary', 'level', 'plain', 'compressed')
+
+    def __init__(self, payload, binary, level=None):
+        self.payload = payload
+        self.binary = binary
+        self.level = level
+        self.plain = self.compressed = None
+
+    def frame(self, deflated):
+        if deflated and self.level is not None:
+            if self.compressed is None:
+                self.compressed = websocket_frame(
+                    deflate(self.payload, self.level), self.binary, True)
+            return self.compressed
+        if self.plain is None:
+            self.plain = websocket_frame(self.payload, self.binary)
+        return self.plain
+
+
+class SharedPacket(eio_packet.Packet):
+    """An Engine.IO message queued, unchanged, for every recipient.
+
+    `encode()` hands the websocket writer the prebuilt frames and
+    `encode(b64=True)` gives long-polling its payload text; each is computed
+    once however many sockets send the packet. `event` names the Socket.IO
+    event inside, for the send queue's policies.
+    """
+
+    def __init__(self, data, level=None, event=None):
+        super().__init__(eio_packet.MESSAGE, data)
+        self.event = event
+        payload = data if self.binary else ('4' + data).encode()
+        self.frames = SharedFrames(payload, self.binary, level)
+        self.polling = None
+
+    def encode(self, b64=False):
+        if not b64:
+            return self.frames
+        if self.polling is None:
+            self.polling = super().encode(b64=True)
+        return self.polling
+
+
+class SharedFrameWebSocketWSGI(WebSocketWSGI):
+    """Engine.IO's eventlet websocket, able to write SharedFrames as they are.
+
+    With `deflate`, permessage-deflate is accepted without server context
+    takeover, so a message compressed once is valid on every connection;
+    otherwise the extension is declined.
+    """
+
+    def __init__(self, handler, server, deflate=False):
+        super().__init__(handler, server)
+        self.deflate = deflate
+        self.handler = functools.partial(self._handle, handler)
+
+    def _negotiate_permessage_deflate(self, extensions):
+        if not self.deflate:
+            return None
+        config = super()._negotiate_permessage_deflate(extensions)
+        if config is not None:
+            config['server_no_context_takeover'] = True
+        return config
+
+    def _handle(self, handler, ws):
+        config = getattr(ws, 'extensions', {}).get('permessage-deflate')
+        # Shared frames are compressed with the full window
+        deflated = config is not None and \
+            config.get('server_max_window_bits', zlib.MAX_WBITS) == zlib.MAX_WBITS
+        send = ws.send
+
+        def send_shared(message, **kwargs):
+            if isinstance(message, SharedFrames):
+                ws._send(message.frame(deflated))
+            else:
+                send(message, **kwargs)
+
+        ws.send = send_shared
+        return handler(ws)
+
+
+class Broadcaster:
+    """Encode-once delivery for everything the Socket.IO server emits.
+
+    python-socketio builds and encodes a packet for each recipient of an
+    emit. Once installed on the client manager, an emit is encoded once into
+    a SharedPacket and the same object is appended to every recipient's
+    Engine.IO queue; the websocket frame (compressed with `deflate_level`
+    when the payload has at least `deflate_min` bytes) and the long-polling
+    text are likewise built once. Emits with a callback, packets with binary
+    attachments and recipients without a local Engine.IO socket (such as the
+    Flask-SocketIO test client's) take python-socketio's own path.
+
+    `on_emit`, if set, is called with the event and the number of sockets
+    each encode-once emit was queued for. Callbacks added with `listen` see
+    every emit of their event delivered on this worker, whichever worker
+    sent it.
+    """
+
+    def __init__(self, server, deflate_level=None, deflate_min=512):
+        self.server = server
+        self.deflate_level = deflate_level
+        self.deflate_min = deflate_min
+        self.on_emit = None
+        self.emits = 0
+        self.recipients = 0
+        self._listeners = {}
+
+    def listen(self, event, callback):
+        """Call `callback(room, data)` for each delivered emit of `event`"""
+        self._listeners.setdefault(event, []).append(callback)
+
+    def _delivered(self, event, room, data):
+        for callback in self._listeners.get(event, ()):
+            callback(room, data)
+
+    def install(self):
+        manager = self.server.manager
+        self._emit_each = functools.partial(BaseManager.emit, manager)
+        if isinstance(manager, PubSubManager):
+            # Emits from every worker are delivered locally by _handle_emit
+            handle_emit = manager._handle_emit
+
+            def handle_local_emit(message):
+                self._delivered(message['event'], message.get('room'),
+                                message['data'])
+                if message.get('callback') is not None:
+                    return handle_emit(message)
+                self.emit(message['event'], message['data'],
+                          namespace=message.get('namespace'),
+                          room=message.get('room'),
+                          skip_sid=message.get('skip_sid'))
+
+            manager._handle_emit = handle_local_emit
+        else:
+            def emit(event, data, namespace=None, room=None, **kwargs):
+                self._delivered(event, room, data)
+                return self.emit(event, data, namespace=namespace, room=room,
+                                 **kwargs)
+
+            manager.emit = emit
+        eio = self.server.eio
+        eio._async = dict(eio._async, websocket=functools.partial(
+            SharedFrameWebSocketWSGI, deflate=self.deflate_level is not None))
+
+    def emit(self, event, data, namespace=None, room=None, skip_sid=None,
+             callback=None, **kwargs):
+        namespace = namespace or '/'
+        manager = self.server.manager
+        if callback is not None:
+            return self._emit_each(event, data, namespace=namespace,
+                                   room=room, skip_sid=skip_sid,
+                                   callback=callback)
+        if namespace not in manager.rooms:
+            return
+        # Same argument handling as python-socketio's _emit_internal
+        if isinstance(data, tuple):
+            args = list(data)
+        elif data is not None:
+            args = [data]
+        else:
+            args = []
+        encoded = self.server.packet_class(
+            packet.EVENT, namespace=namespace, data=[event] + args).encode()
+        if isinstance(encoded, list):
+            return self._emit_each(event, data, namespace=namespace,
+                                   room=room, skip_sid=skip_sid)
+        shared = SharedPacket(encoded, self.deflate_level
+                              if len(encoded) >= self.deflate_min else None,
+                              event)
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        sockets = self.server.eio.sockets
+        sent = 0
+        for sid, eio_sid in manager.get_participants(namespace, room):
+            if sid in skip_sid:
+                continue
+            socket = sockets.get(eio_sid)
+            if socket is None:
+                self.server._emit_internal(eio_sid, event, data, namespace)
+            else:
+                socket.send(shared)
+                sent += 1
+        if sent:
+            self.emits += 1
+            self.recipients += sent
+            if self.on_emit is not None:
+                self.on_emit(event, sent)
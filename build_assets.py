@@ -0,0 +1,27 @@
+"""Fetch the pinned vendor scripts into static/vendor so the app self-hosts them.
+
+Run once at build time (the deploy workflow does); without it the page falls
+back to loading the same pinned versions from their CDNs.
+"""
+import os
+import urllib.request
+
+from static_assets import VENDOR_SOURCES
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+def main():
+    for name, url in VENDOR_SOURCES.items():
+        path = os.path.join(STATIC_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f'Fetching {url}')
+        with urllib.request.urlopen(url, timeout=30) as response:
+            body = response.read()
+        with open(path, 'wb') as f:
+            f.write(body)
+        print(f'Saved {name} ({len(body)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
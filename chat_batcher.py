@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+BATCH_PREFIX = 'chat_batch:'
+
+
+def batch_room(room):
+    """Socket.IO room of the clients in `room` that take `chat_batch`"""
+    return BATCH_PREFIX + room
+
+
+def legacy_room(room):
+    """Socket.IO room of the clients in `room` that only understand single
+    `chat_message` events"""
+    return f'chat_message:{room}'
+
+
+class ChatBatcher:
+    """Coalesce chat messages into one `chat_batch` packet per flush window.
+
+    A quiet room is flushed as soon as a message arrives, so batching adds no
+    latency there. Under load the window grows with the square root of the
+    room's message rate (bounded by `max_window`), and a batch is flushed
+    early once it reaches `max_batch` messages.
+
+    Sockets join their room's `batch_room` or `legacy_room` through `join`,
+    so each format reaches its clients on every worker. A room's state is
+    dropped when its stream ends, and rooms with no message for `idle_ttl`
+    seconds are evicted from the front of an LRU as messages arrive (an idle
+    room is flushed at once anyway, so only its rate estimate is lost).
+
+    Messages are numbered with IDs from `history` as their batch is sent,
+    and the batch is published once. Once `install`ed, every batch
+    delivered to this worker, from any worker, is recorded in `history` and
+    expanded into single `chat_message` events here, only for a room that
+    has legacy clients on this worker.
+    """
+
+    def __init__(self, socketio, history, min_window=0.02, max_window=0.25,
+                 max_batch=50, enabled=True, idle_ttl=60):
+        self.socketio = socketio
+        self.history = history
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self.idle_ttl = idle_ttl
+        # Clients on this worker that only understand single `chat_message`
+        # events
+        self.legacy_sids = set()
+        self._pending = {}
+        self._scheduled = set()
+        self._last_flush = {}
+        # Least recently used room first
+        self._last_message = OrderedDict()
+        self._rate = {}
+        self._lock = threading.Lock()
+        self.broadcaster = None
+
+    def install(self, broadcaster):
+        self.broadcaster = broadcaster
+        broadcaster.listen('chat_batch', self._delivered_batch)
+        broadcaster.listen('chat_message', self._delivered_message)
+
+    def _delivered_batch(self, room, data):
+        if not isinstance(room, str) or not room.startswith(BATCH_PREFIX):
+            return
+        room = room[len(BATCH_PREFIX):]
+        self.history.add(room, data['messages'])
+        legacy = legacy_room(room)
+        if self.socketio.server.manager.rooms.get('/', {}).get(legacy):
+            # Sent from here only: every worker expands the batch it received
+            for message in data['messages']:
+                self.broadcaster.emit('chat_message', message, room=legacy)
+
+    def _delivered_message(self, room, data):
+        # Only unbatched messages go to the room itself
+        if not self.enabled and isinstance(room, str):
+            self.history.add(room, [data])
+
+    def add_legacy_client(self, sid):
+        self.legacy_sids.add(sid)
+
+    def remove_client(self, sid):
+        self.legacy_sids.discard(sid)
+
+    def _chat_room(self, sid, room):
+        return legacy_room(room) if sid in self.legacy_sids else \
+            batch_room(room)
+
+    def join(self, sid, room):
+        """Send `room`'s chat to a socket, in the format it understands"""
+        self.socketio.server.enter_room(sid, self._chat_room(sid, room),
+                                        namespace='/')
+
+    def leave(self, sid, room):
+        self.socketio.server.leave_room(sid, self._chat_room(sid, room),
+                                        namespace='/')
+
+    def window(self, room=None):
+        """Current flush window for a room, adapted to its recent load"""
+        load = self._rate.get(room, 0.0) * self.min_window
+        return min(self.max_window, self.min_window * max(load, 1.0) ** 0.5)
+
+    def add(self, message, room):
+        """Queue a chat message for the next batch sent to `room`"""
+        if not self.enabled:
+            self._send(room, [message])
+            return
+
+        delay = None
+        now = time.monotonic()
+        with self._lock:
+            gap = max(now - self._last_message.get(room, 0.0), 1e-6)
+            self._last_message[room] = now
+            self._last_message.move_to_end(room)
+            self._evict(now)
+            self._rate[room] = self._rate.get(room, 0.0) * 0.9 + 0.1 / gap
+            pending = self._pending.setdefault(room, [])
+            pending.append(message)
+            flush_now = len(pending) >= self.max_batch
+            if not flush_now and room not in self._scheduled:
+                idle = now - self._last_flush.get(room, 0.0)
+                if idle >= self.window(room):
+                    flush_now = True
+                else:
+                    self._scheduled.add(room)
+                    delay = self.window(room) - idle
+
+        if flush_now:
+            self.flush(room)
+        elif delay is not None:
+            self.socketio.start_background_task(self._flush_later, room, delay)
+
+    def _evict(self, now):
+        last_message = self._last_message
+        while last_message:
+            room, last = next(iter(last_message.items()))
+            if now - last < self.idle_ttl:
+                break
+            del last_message[room]
+            self._rate.pop(room, None)
+            self._last_flush.pop(room, None)
+
+    def drop(self, room):
+        """Forget a room whose stream ended, with anything still pending"""
+        with self._lock:
+            self._pending.pop(room, None)
+            self._scheduled.discard(room)
+            self._last_message.pop(room, None)
+            self._rate.pop(room, None)
+            self._last_flush.pop(room, None)
+
+    def flush(self, room):
+        """Send everything pending for `room` right away"""
+        with self._lock:
+            batch = self._pending.pop(room, None)
+            self._last_flush[room] = time.monotonic()
+        if batch:
+            self._send(room, batch)
+
+    def flush_all(self):
+        for room in list(self._pending):
+            self.flush(room)
+
+    def _flush_later(self, room, delay):
+        self.socketio.sleep(delay)
+        with self._lock:
+            if room not in self._scheduled:
+                # Dropped meanwhile
+                return
+            self._scheduled.discard(room)
+        self.flush(room)
+
+    def _send(self, room, batch):
+        first_id = self.history.reserve(room, len(batch))
+        for offset, message in enumerate(batch):
+            message['id'] = first_id + offset
+        if not self.enabled:
+            for message in batch:
+                self.socketio.emit('chat_message', message, to=room)
+            return
+
+        self.socketio.emit('chat_batch', {'messages': batch},
+                           to=batch_room(room))
@@ -0,0 +1,121 @@
+class ChatRecord:
+    __slots__ = ('id', 'ts', 'user', 'msg', 'size')
+
+    def __init__(self, id, ts, user, msg):
+        self.id = id
+        self.ts = ts
+        self.user = user
+        self.msg = msg
+        self.size = len(user) + len(msg)
+
+    def to_dict(self):
+        return {'id': self.id, 'ts': self.ts, 'user': self.user,
+                'msg': self.msg}
+
+
+class ChatHistory:
+    """The most recent messages of one room, capped by count and bytes.
+
+    Records live in a fixed-size ring indexed by message ID, so reading the
+    last K messages or a page before a cursor costs O(K) no matter how many
+    messages the room has seen. Messages from several workers may arrive
+    slightly out of ID order; they take their slot all the same.
+    """
+
+    def __init__(self, max_messages=1000, max_bytes=256 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.first_id = 1
+        self.last_id = 0
+        self._ring = [None] * max_messages
+
+    def add(self, record):
+        ring = self._ring
+        if self.last_id == 0 or record.id - self.first_id >= 2 * len(ring):
+            # First message, or far past everything held: start over there
+            self._ring = ring = [None] * len(ring)
+            self.size = 0
+            self.first_id = self.last_id = record.id
+        elif record.id < self.first_id:
+            if self.last_id - record.id >= len(ring):
+                return
+            # Sent from another worker just before what we hold
+            self.first_id = record.id
+        while record.id - self.first_id >= len(ring):
+            self._evict()
+        slot = record.id % len(ring)
+        if ring[slot] is not None:
+            return
+        ring[slot] = record
+        self.last_id = max(self.last_id, record.id)
+        self.size += record.size
+        while self.size > self.max_bytes and self.first_id < self.last_id:
+            self._evict()
+
+    def _evict(self):
+        slot = self.first_id % len(self._ring)
+        record = self._ring[slot]
+        if record is not None:
+            self.size -= record.size
+            self._ring[slot] = None
+        self.first_id += 1
+
+    def page(self, before=None, limit=50):
+        """Up to `limit` messages older than ID `before`, oldest first"""
+        end = self.last_id + 1 if before is None else \
+            max(min(before, self.last_id + 1), self.first_id)
+        ring = self._ring
+        messages = []
+        id = end - 1
+        while id >= self.first_id and len(messages) < limit:
+            record = ring[id % len(ring)]
+            # A gap is a message still on its way from another worker
+            if record is not None:
+                messages.append(record.to_dict())
+            id -= 1
+        messages.reverse()
+        return messages
+
+
+class ChatHistoryStore:
+    """Chat history for every room, kept by each worker.
+
+    Message IDs come from a per-room counter in the shared state store,
+    taken a whole batch at a time with `reserve`. Every worker records the
+    batches delivered to it, wherever they were sent from, so each holds
+    the same recent history (from the time it started).
+    """
+
+    def __init__(self, store, max_messages=1000, max_bytes=256 * 1024):
+        self.store = store
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.rooms = {}
+
+    def reserve(self, room, count):
+        """The first of `count` consecutive message IDs for `room`"""
+        return self.store.incr(f'chat:{room}:id', count) - count + 1
+
+    def add(self, room, messages):
+        """Record delivered messages (dicts with id, ts, user and msg)"""
+        history = self.rooms.get(room)
+        if history is None:
+            history = self.rooms[room] = ChatHistory(self.max_messages,
+                                                     self.max_bytes)
+        for message in messages:
+            if 'id' in message:
+                history.add(ChatRecord(message['id'], message['ts'],
+                                       str(message['user']),
+                                       str(message['msg'])))
+
+    def page(self, room, before=None, limit=50):
+        """A page of messages plus the cursor for the next older page"""
+        history = self.rooms.get(room)
+        messages = history.page(before, limit) if history else []
+        more = bool(messages) and messages[0]['id'] > history.first_id
+        return {'messages': messages,
+                'cursor': messages[0]['id'] if more else None}
+
+    def drop(self, room):
+        self.rooms.pop(room, None)
+        self.store.delete(f'chat:{room}:id')
@@ -0,0 +1,160 @@
+import atexit
+import sqlite3
+import time
+
+try:
+    # The writer must be a real thread even when eventlet has patched the
+    # threading module, or its disk writes would stall the event loop
+    from eventlet.patcher import original
+    queue = original('queue')
+    threading = original('threading')
+except ImportError:
+    import queue
+    import threading
+
+# CHAT_LOG_FSYNC policy -> SQLite synchronous mode. In WAL mode "normal"
+# only syncs at checkpoints (a crash can lose the last batches but never
+# corrupts the log); "full" syncs every batch before it counts as written.
+FSYNC_MODES = {'off': 'OFF', 'normal': 'NORMAL', 'full': 'FULL'}
+
+
+class ChatLog:
+    """Append-only chat log in SQLite (WAL), written by a background thread.
+
+    `append` only puts the message on a bounded queue, so event handlers
+    never wait for the disk. The writer thread takes whatever has queued up
+    (up to `max_batch` messages, waiting at most `flush_interval` for more)
+    and commits it as one transaction. When the queue is full new messages
+    are dropped and counted rather than blocking the caller. A batch that
+    fails to write is rolled back, counted as failed and logged to
+    `event_log`, and the writer goes on with the next one.
+
+    Each message gets a global offset (the row ID); reads can go by offset
+    or by time range, optionally for one room.
+    """
+
+    def __init__(self, path, fsync='normal', queue_size=10000, max_batch=500,
+                 flush_interval=0.05, event_log=None):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f'Unsupported chat log fsync policy: {fsync}')
+        self.path = path
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.event_log = event_log
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(queue_size)
+        self._reader = self._connect()
+        self._reader.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'offset INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'room TEXT, ts REAL, user TEXT, msg TEXT)')
+        self._reader.execute('CREATE INDEX IF NOT EXISTS messages_room_ts '
+                             'ON messages (room, ts)')
+        self._reader.execute('CREATE INDEX IF NOT EXISTS messages_ts '
+                             'ON messages (ts)')
+        self._read_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='chat-log-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                             check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(f'PRAGMA synchronous={FSYNC_MODES[self.fsync]}')
+        return db
+
+    def append(self, room, ts, user, msg):
+        """Queue one message for writing; returns False if it was dropped"""
+        try:
+            self._queue.put_nowait((room, ts, user, msg))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            closing = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(timeout, 0)) \
+                        if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._write(db, batch)
+            if closing:
+                break
+        db.close()
+
+    def _write(self, db, batch):
+        try:
+            db.execute('BEGIN')
+            db.executemany('INSERT INTO messages (room, ts, user, msg) '
+                           'VALUES (?, ?, ?, ?)', batch)
+            db.execute('COMMIT')
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                try:
+                    db.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+            self.failed += len(batch)
+            if self.event_log is not None:
+                self.event_log.error('chat_log_write_failed', error=str(e),
+                                     messages=len(batch), failed=self.failed)
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def close(self):
+        """Write out everything still queued and stop the writer"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def read(self, room=None, after=0, since=None, until=None, limit=500):
+        """Messages with offset > `after`, optionally limited to one room
+        and to `since` <= ts < `until`, in log order"""
+        query = 'SELECT offset, room, ts, user, msg FROM messages ' \
+                'WHERE offset > ?'
+        params = [after]
+        if room is not None:
+            query += ' AND room = ?'
+            params.append(room)
+        if since is not None:
+            query += ' AND ts >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND ts < ?'
+            params.append(until)
+        query += ' ORDER BY offset LIMIT ?'
+        params.append(limit)
+        with self._read_lock:
+            rows = self._reader.execute(query, params).fetchall()
+        return [{'offset': offset, 'room': room, 'ts': ts, 'user': user,
+                 'msg': msg} for offset, room, ts, user, msg in rows]
+
+    def stats(self):
+        return {'enqueued': self.enqueued, 'written': self.written,
+                'dropped': self.dropped, 'failed': self.failed,
+                'batches': self.batches,
+                'queued': self._queue.qsize()}
@@ -0,0 +1,149 @@
+import atexit
+import json
+import random
+import sys
+import time
+from collections import deque
+
+try:
+    # The drainer must be a real thread even when eventlet has patched the
+    # threading module, so a slow stdout never stalls the event loop
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+# Keys every record starts with
+RESERVED = frozenset(('ts', 'level', 'event'))
+
+
+def parse_sample(spec):
+    """Parse a LOG_SAMPLE value like ``chat_message=0.01`` into a dict"""
+    sample = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, rate = item.partition('=')
+        sample[event] = float(rate)
+    return sample
+
+
+class EventLog:
+    """Structured event log that never blocks the caller.
+
+    `log` checks the level and the event's sample rate, then appends the
+    unformatted record to a bounded deque (a single atomic append, no
+    lock). A background thread wakes every `flush_interval` seconds, or as
+    soon as the queue is half full, formats everything queued and writes
+    it to `stream` as one batch of JSON lines. When the queue is full, new
+    records are dropped and counted.
+
+    This pays off when the sink can be slow. On a fast one the caller still
+    pays more per record than a bare print() of preformatted text: the
+    drainer's formatting holds the GIL the caller needs, and bursts beyond
+    what it can format are dropped.
+
+    The level and per-event sample rates can be changed at runtime.
+    """
+
+    def __init__(self, stream=None, level='info', sample=None,
+                 queue_size=10000, flush_interval=0.1):
+        self.stream = stream or sys.stdout
+        self.set_level(level)
+        # Fraction of records kept per event type, 1.0 when not listed
+        self.sample = dict(sample or {})
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._queue = deque()
+        self._wake_at = queue_size // 2
+        self._wake = threading.Event()
+        self._encoder = json.JSONEncoder(default=str)
+        # (level, event) -> the encoded record text that follows `ts`
+        self._prefixes = {}
+        self._drainer = None
+        atexit.register(self.flush)
+
+    def set_level(self, level):
+        if level not in LEVELS:
+            raise ValueError(f'Unsupported log level: {level}')
+        self.level = level
+        self._threshold = LEVELS[level]
+
+    def log(self, level, event, **fields):
+        self._log(level, event, fields)
+
+    def _log(self, level, event, fields):
+        if LEVELS[level] < self._threshold:
+            return
+        rate = self.sample.get(event)
+        if rate is not None and random.random() >= rate:
+            self.sampled_out += 1
+            return
+        queue = self._queue
+        size = len(queue)
+        if size >= self.queue_size:
+            self.dropped += 1
+            return
+        queue.append((time.time(), level, event, fields))
+        if size == self._wake_at:
+            self._wake.set()
+        if self._drainer is None:
+            self._start()
+
+    # Each passes its keyword arguments on as they are, saving a repack
+    def debug(self, event, **fields):
+        self._log('debug', event, fields)
+
+    def info(self, event, **fields):
+        self._log('info', event, fields)
+
+    def warning(self, event, **fields):
+        self._log('warning', event, fields)
+
+    def error(self, event, **fields):
+        self._log('error', event, fields)
+
+    def _start(self):
+        self._drainer = threading.Thread(target=self._drain_loop,
+                                         name='event-log-drainer', daemon=True)
+        self._drainer.start()
+
+    def _drain_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write out everything queued so far"""
+        lines = []
+        queue = self._queue
+        encode = self._encoder.encode
+        prefixes = self._prefixes
+        while True:
+            try:
+                ts, level, event, fields = queue.popleft()
+            except IndexError:
+                break
+            if not RESERVED.isdisjoint(fields):
+                record = {'ts': round(ts, 3), 'level': level, 'event': event}
+                record.update(fields)
+                lines.append(encode(record))
+                continue
+            prefix = prefixes.get((level, event))
+            if prefix is None:
+                prefix = prefixes[level, event] = \
+                    f', "level": {encode(level)}, "event": {encode(event)}'
+            lines.append('{"ts": %.3f%s%s' % (
+                ts, prefix, ', ' + encode(fields)[1:] if fields else '}'))
+        if lines:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+            self.written += len(lines)
+
+    def stats(self):
+        return {'level': self.level, 'sample': dict(self.sample),
+                'written': self.written, 'dropped': self.dropped,
+                'sampled_out': self.sampled_out, 'queued': len(self._queue)}
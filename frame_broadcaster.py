@@ -0,0 +1,207 @@
+import os
+import shlex
+
+try:
+    # The pipe reader must be a real thread reading a real pipe even when
+    # eventlet has patched the standard library, or its blocking reads
+    # would stall the event loop
+    from eventlet.patcher import original
+    subprocess = original('subprocess')
+    threading = original('threading')
+except ImportError:
+    import subprocess
+    import threading
+
+PLACEHOLDER_TEXT = b'Server camera not available in cloud deployment. Use browser camera below.'
+TEST_PATTERN_COMMAND = ('ffmpeg -loglevel error -re -f lavfi '
+                        '-i testsrc=size=640x480:rate={fps} '
+                        '-f mjpeg -q:v 5 -')
+
+
+class PlaceholderSource:
+    """Static text frame, used when the server has no camera"""
+    content_type = 'text/plain'
+    paced = False
+
+    def read(self):
+        return PLACEHOLDER_TEXT
+
+
+class FileSource:
+    """JPEG frames from one file, or cycled from every .jpg in a directory"""
+    content_type = 'image/jpeg'
+    paced = False
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path)
+                           if n.lower().endswith(('.jpg', '.jpeg')))
+            paths = [os.path.join(path, n) for n in names]
+        else:
+            paths = [path]
+        self.frames = []
+        for frame_path in paths:
+            with open(frame_path, 'rb') as f:
+                self.frames.append(f.read())
+        self.index = 0
+
+    def read(self):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return frame
+
+
+class PipeSource:
+    """MJPEG frames read from a command's stdout, e.g. ffmpeg -f mjpeg -.
+
+    A native thread reads the pipe and keeps the newest complete frame;
+    `read` returns each frame once and None until the next one is in.
+    """
+    content_type = 'image/jpeg'
+    paced = True
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.frame = None
+        self.seq = 0
+        self.read_seq = 0
+
+    def read(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(shlex.split(self.command),
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+            threading.Thread(target=self._read_pipe, args=(self.process,),
+                             name='frame-pipe-reader', daemon=True).start()
+        if self.read_seq == self.seq:
+            return None
+        self.read_seq = self.seq
+        return self.frame
+
+    def _read_pipe(self, process):
+        buffer = b''
+        while self.process is process:
+            chunk = process.stdout.read1(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            # A JPEG runs from its SOI marker to its EOI marker
+            while True:
+                start = buffer.find(b'\xff\xd8')
+                end = buffer.find(b'\xff\xd9', start + 2)
+                if start == -1 or end == -1:
+                    break
+                self.frame = buffer[start:end + 2]
+                self.seq += 1
+                buffer = buffer[end + 2:]
+        process.stdout.close()
+        process.wait()
+
+    def close(self):
+        """Stop the command while nobody is watching"""
+        process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+
+def create_frame_source(spec, fps=10):
+    """Build a frame source from a VIDEO_FEED_SOURCE value.
+
+    ``placeholder`` (default), ``testsrc`` (ffmpeg test pattern),
+    ``file:<path to .jpg or directory>`` or ``pipe:<command>``.
+    """
+    if not spec or spec == 'placeholder':
+        return PlaceholderSource()
+    if spec == 'testsrc':
+        return PipeSource(TEST_PATTERN_COMMAND.format(fps=fps))
+    if spec.startswith('file:'):
+        return FileSource(spec[len('file:'):])
+    if spec.startswith('pipe:'):
+        return PipeSource(spec[len('pipe:'):])
+    raise ValueError(f'Unsupported video feed source: {spec}')
+
+
+class FrameBroadcaster:
+    """One producer feeding every /video_feed client from a shared ring.
+
+    Each frame is wrapped in its multipart chunk once and the same bytes
+    object is handed to every consumer. Consumers only track the sequence
+    number of the last frame they sent; one that falls more than `max_lag`
+    frames behind skips straight to the newest frames instead of buffering.
+    The producer runs while anyone is watching and stops when idle. A
+    consumer that gets no new frame for `keepalive` seconds is sent the
+    last one again, so the response doesn't look stalled to proxies.
+    """
+
+    def __init__(self, socketio, source, fps=10, ring_size=16, max_lag=2,
+                 keepalive=5):
+        self.socketio = socketio
+        self.source = source
+        self.fps = fps
+        self.ring = [None] * ring_size
+        self.max_lag = min(max_lag, ring_size - 1)
+        self.keepalive = keepalive
+        self.seq = 0
+        self.subscribers = 0
+        self.dropped = 0
+        self.keepalives = 0
+        self.producer = None
+        self._frame_ready = socketio.server.eio.create_event()
+
+    def publish(self, frame):
+        """Add one encoded frame to the ring and wake every consumer"""
+        chunk = b''.join((
+            b'--frame\r\nContent-Type: ', self.source.content_type.encode(),
+            b'\r\nContent-Length: ', str(len(frame)).encode(), b'\r\n\r\n',
+            frame, b'\r\n'))
+        self.ring[(self.seq + 1) % len(self.ring)] = chunk
+        self.seq += 1
+        # Swap in a fresh event so waiters can't miss a frame between
+        # waking up and waiting again
+        ready = self._frame_ready
+        self._frame_ready = self.socketio.server.eio.create_event()
+        ready.set()
+
+    def _produce(self):
+        interval = 1.0 / self.fps
+        # A paced source makes frames at its own rate; look for a new one
+        # several times per frame so it goes out promptly
+        if self.source.paced:
+            interval /= 4
+        while self.subscribers:
+            frame = self.source.read()
+            if frame is not None:
+                self.publish(frame)
+            self.socketio.sleep(interval)
+        # No yield from here on, so a new consumer can't see this producer
+        # after it has closed the source
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+        self.producer = None
+
+    def stream(self):
+        """Generator of multipart chunks for one consumer"""
+        self.subscribers += 1
+        if self.producer is None:
+            self.producer = self.socketio.start_background_task(self._produce)
+        try:
+            # Start from the latest frame, if there is one
+            sent = max(self.seq - 1, 0)
+            while True:
+                ready = self._frame_ready
+                if sent == self.seq:
+                    ready.wait(self.keepalive)
+                    if sent == self.seq and sent:
+                        self.keepalives += 1
+                        yield self.ring[sent % len(self.ring)]
+                    continue
+                latest = self.seq
+                start = max(sent, latest - self.max_lag)
+                self.dropped += start - sent
+                for seq in range(start + 1, latest + 1):
+                    yield self.ring[seq % len(self.ring)]
+                sent = latest
+        finally:
+            self.subscribers -= 1
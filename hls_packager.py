@@ -0,0 +1,205 @@
+import atexit
+import os
+import subprocess
+import time
+
+
+class _Packager:
+    __slots__ = ('source', 'process', 'started', 'restarts', 'backoff',
+                 'restart_at')
+
+    def __init__(self, source):
+        self.source = source
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 1
+        self.restart_at = 0.0
+
+
+class HLSPackager:
+    """Packages every published stream as HLS, without re-encoding.
+
+    node-media-server v4 only relays RTMP, so the worker running it starts
+    one ffmpeg per published stream. It reads the stream back with
+    `input_args(source)` and copies its audio and video into
+    media_root/live/<playback id>/index.m3u8. Classic HLS is cut into
+    `segment_time` segments on keyframes. With `part_time` set, ffmpeg cuts
+    parts of that length on time instead, and ll_hls.py groups them into
+    segments. A packager that exits while its stream is still published is
+    restarted with backoff.
+    """
+
+    def __init__(self, socketio, event_log, media_root, input_args,
+                 ffmpeg='ffmpeg', segment_time=2, list_size=3, part_time=None,
+                 interval=1):
+        self.socketio = socketio
+        self.event_log = event_log
+        self.media_root = media_root
+        self.input_args = input_args
+        self.ffmpeg = ffmpeg
+        self.segment_time = segment_time
+        self.list_size = list_size
+        self.part_time = part_time
+        self.interval = interval
+        # playback ID -> _Packager, on the worker running the RTMP server
+        self.streams = {}
+        # Stopped ffmpegs that may not have exited yet: (process, when to
+        # kill it, folder to clear once it is gone)
+        self._dying = []
+        self.task = None
+        atexit.register(self.stop)
+
+    def publish(self, playback_id, source):
+        """Start packaging a stream that went live on this worker"""
+        packager = self.streams.get(playback_id)
+        if packager is not None:
+            # Published again before the last publish was done with
+            packager.source = source
+            return
+        # The last publish's ffmpeg would clear the new one's files on exit
+        folder = self._folder(playback_id)
+        for process, _, dying_folder in self._dying:
+            if dying_folder == folder:
+                process.kill()
+                process.wait()
+        self._dying = [entry for entry in self._dying if entry[2] != folder]
+        packager = self.streams[playback_id] = _Packager(source)
+        self._start(playback_id, packager, time.monotonic())
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self._run)
+
+    def unpublish(self, playback_id):
+        packager = self.streams.pop(playback_id, None)
+        if packager is not None:
+            self._stop(playback_id, packager)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                self.event_log.error('hls_packager_check_failed',
+                                     error=str(e))
+
+    def check(self):
+        """Reap stopped ffmpegs and restart the ones that died"""
+        now = time.monotonic()
+        self._reap_dying(now)
+        for playback_id, packager in self.streams.items():
+            process = packager.process
+            if process is None:
+                if now >= packager.restart_at:
+                    self._start(playback_id, packager, now)
+                continue
+            if process.poll() is None:
+                if now - packager.started > 60:
+                    packager.backoff = 1
+                continue
+            self.event_log.warning('hls_packager_exited',
+                                   playback_id=playback_id,
+                                   code=process.returncode,
+                                   backoff=packager.backoff)
+            packager.process = None
+            self._restart_later(packager, now)
+
+    def _folder(self, playback_id):
+        return os.path.join(self.media_root, 'live', playback_id)
+
+    def command(self, playback_id, source):
+        if self.part_time:
+            flags = ['-hls_time', str(self.part_time), '-hls_list_size', '30',
+                     '-hls_flags', 'split_by_time+delete_segments+temp_file']
+        else:
+            flags = ['-hls_time', str(self.segment_time),
+                     '-hls_list_size', str(self.list_size),
+                     '-hls_flags', 'delete_segments+temp_file']
+        return [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            *self.input_args(source),
+            '-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy',
+            '-f', 'hls', *flags,
+            os.path.join(self._folder(playback_id), 'index.m3u8')]
+
+    def _start(self, playback_id, packager, now):
+        os.makedirs(self._folder(playback_id), exist_ok=True)
+        try:
+            packager.process = subprocess.Popen(
+                self.command(playback_id, packager.source),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self.event_log.error('hls_packager_start_failed',
+                                 playback_id=playback_id, error=str(e))
+            self._restart_later(packager, now)
+            return
+        packager.started = now
+        self.event_log.info('hls_packager_started', playback_id=playback_id,
+                            pid=packager.process.pid)
+
+    def _restart_later(self, packager, now):
+        packager.restarts += 1
+        packager.restart_at = now + packager.backoff
+        packager.backoff = min(packager.backoff * 2, 30)
+
+    def _stop(self, playback_id, packager):
+        """Stop a packager; its files go once ffmpeg has exited, so a stale
+        playlist is never served"""
+        process, packager.process = packager.process, None
+        folder = self._folder(playback_id)
+        if process is not None and process.poll() is None:
+            process.terminate()
+            self._dying.append((process, time.monotonic() + 5, folder))
+        else:
+            _clear(folder)
+        self.event_log.info('hls_packager_stopped', playback_id=playback_id)
+
+    def _reap_dying(self, now):
+        dying = []
+        for process, deadline, folder in self._dying:
+            if process.poll() is not None:
+                _clear(folder)
+                continue
+            if now > deadline:
+                process.kill()
+            dying.append((process, deadline, folder))
+        self._dying = dying
+
+    def stop(self):
+        """Stop every packager, e.g. when the app exits"""
+        for playback_id in list(self.streams):
+            self.unpublish(playback_id)
+        for process, _, folder in self._dying:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            _clear(folder)
+        self._dying = []
+
+    def stats(self):
+        return {'streams': {playback_id: {
+                    'running': packager.process is not None,
+                    'restarts': packager.restarts}
+                for playback_id, packager in self.streams.items()},
+                'stopping': len(self._dying)}
+
+
+def _clear(folder):
+    """Remove the packager's files; rendition folders are left to abr.py"""
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_file():
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    try:
+        os.rmdir(folder)
+    except OSError:
+        pass
@@ -0,0 +1,220 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from flask import Response, request, send_file
+from werkzeug.security import safe_join
+
+PLAYBACK_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+PLAYLIST_RE = re.compile(r'^[\w-]+\.m3u8$')
+SEGMENT_RE = re.compile(r'^[\w.-]+\.(ts|m4s|mp4|aac)$')
+RENDITION_RE = re.compile(r'^[\w-]+$')
+
+MIMETYPES = {
+    'm3u8': 'application/vnd.apple.mpegurl',
+    'ts': 'video/mp2t',
+    'm4s': 'video/iso.segment',
+    'mp4': 'video/mp4',
+    'aac': 'audio/aac',
+}
+
+
+def _etag(mtime, size):
+    return f'{mtime:x}-{size:x}'
+
+
+class SegmentCache:
+    """LRU cache of file contents bounded by total bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, mtime):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != mtime:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, mtime, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(path)
+            self._entries[path] = (mtime, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, path):
+        with self._lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def paths(self):
+        with self._lock:
+            return list(self._entries)
+
+
+class HLSServer:
+    """Serve node-media-server's HLS output from `media_root` in-process.
+
+    Playlists are re-read whenever they change and cached for about a second
+    by clients. Segments never change once written, so they are cached
+    forever by clients; recent ones are also kept in memory (a watcher loads
+    new segments as soon as they appear, since every viewer will ask for them)
+    and anything else is streamed from disk with the server's sendfile path.
+
+    With a `low_latency` packager (see ll_hls.py), its playlists, parts and
+    segments are served from memory instead, and it takes over the watching.
+    """
+
+    def __init__(self, socketio, media_root, cache_bytes=256 * 1024 * 1024,
+                 playlist_max_age=1, scan_interval=0.5, low_latency=None):
+        self.socketio = socketio
+        self.media_root = media_root
+        self.cache = SegmentCache(cache_bytes)
+        self.playlist_max_age = playlist_max_age
+        self.scan_interval = scan_interval
+        self.low_latency = low_latency
+        self.watcher = None
+
+    def start(self):
+        if self.low_latency is not None:
+            self.low_latency.start()
+        elif self.watcher is None:
+            self.watcher = self.socketio.start_background_task(self._watch)
+
+    def _watch(self):
+        while True:
+            self.scan()
+            self.socketio.sleep(self.scan_interval)
+
+    def scan(self):
+        """Preload new segments and forget deleted ones"""
+        live_root = os.path.join(self.media_root, 'live')
+        seen = set()
+        try:
+            keys = os.listdir(live_root)
+        except FileNotFoundError:
+            keys = []
+        # Stream folders, then the rendition folders found in them
+        folders = [(os.path.join(live_root, key), True) for key in keys]
+        for folder, is_stream in folders:
+            try:
+                entries = list(os.scandir(folder))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if is_stream and entry.is_dir() and \
+                        RENDITION_RE.match(entry.name):
+                    folders.append((entry.path, False))
+                    continue
+                if PLAYLIST_RE.match(entry.name):
+                    # Loaded on request, but kept while the file exists
+                    seen.add(entry.path)
+                if not SEGMENT_RE.match(entry.name):
+                    continue
+                seen.add(entry.path)
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if self.cache.get(entry.path, mtime) is None:
+                    self._load(entry.path, mtime)
+        for path in self.cache.paths():
+            if path not in seen:
+                self.cache.discard(path)
+
+    def _load(self, path, mtime):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.cache.put(path, mtime, data)
+        return data
+
+    def _resolve(self, playback_id, name, pattern, rendition=None):
+        if not PLAYBACK_ID_RE.match(playback_id) or not pattern.match(name):
+            return None
+        if rendition is None:
+            path = safe_join(self.media_root, 'live', playback_id, name)
+        elif RENDITION_RE.match(rendition):
+            path = safe_join(self.media_root, 'live', playback_id, rendition,
+                             name)
+        else:
+            return None
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+
+    def _cached_response(self, data, mtime, mimetype, cache_control):
+        response = Response(data, mimetype=mimetype)
+        response.headers['Cache-Control'] = cache_control
+        response.set_etag(_etag(mtime, len(data)))
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=len(data))
+
+    def playlist(self, playback_id, name, rendition=None):
+        """A stream's playlist, or one of its `rendition`'s (see abr.py)"""
+        if self.low_latency is not None and rendition is None and \
+                name == 'index.m3u8':
+            # Malformed values come back as None
+            msn = request.args.get('_HLS_msn', type=int)
+            part = request.args.get('_HLS_part', type=int)
+            if msn is None and ('_HLS_msn' in request.args or
+                                '_HLS_part' in request.args) or \
+                    part is None and '_HLS_part' in request.args:
+                return Response('Bad _HLS_msn or _HLS_part', status=400)
+            response = self.low_latency.playlist(playback_id, msn, part)
+            if response is not None:
+                return response
+        path = self._resolve(playback_id, name, PLAYLIST_RE, rendition)
+        if path is None:
+            return Response('Not found', status=404)
+        mtime = os.stat(path).st_mtime_ns
+        data = self.cache.get(path, mtime) or self._load(path, mtime)
+        if data is None:
+            return Response('Not found', status=404)
+        return self._cached_response(
+            data, mtime, MIMETYPES['m3u8'],
+            f'public, max-age={self.playlist_max_age}')
+
+    def segment(self, playback_id, name, rendition=None):
+        mimetype = MIMETYPES.get(name.rsplit('.', 1)[-1])
+        cache_control = 'public, max-age=31536000, immutable'
+        if self.low_latency is not None and rendition is None and \
+                PLAYBACK_ID_RE.match(playback_id) and SEGMENT_RE.match(name):
+            held = self.low_latency.media(playback_id, name)
+            if held is not None:
+                return self._cached_response(held[0], held[1], mimetype,
+                                             cache_control)
+        path = self._resolve(playback_id, name, SEGMENT_RE, rendition)
+        if path is None:
+            return Response('Not found', status=404)
+        stat = os.stat(path)
+        data = self.cache.get(path, stat.st_mtime_ns)
+        if data is not None:
+            return self._cached_response(data, stat.st_mtime_ns, mimetype,
+                                         cache_control)
+        # Cold segment: hand the file to the server so it can use sendfile
+        response = send_file(path, mimetype=mimetype, conditional=True,
+                             etag=_etag(stat.st_mtime_ns, stat.st_size),
+                             max_age=None)
+        response.headers['Cache-Control'] = cache_control
+        return response
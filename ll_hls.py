@@ -0,0 +1,357 @@
+import math
+import os
+import re
+import time
+from collections import deque
+
+from flask import Response
+
+# ffmpeg numbers its files: index12.ts is followed by index13.ts
+NUMBERED_RE = re.compile(r'^(.*?)(\d+)(\.ts)$')
+SEGMENT_NAME_RE = re.compile(r'^segment(\d+)\.ts$')
+# MPEG-TS stream types of the video codecs ffmpeg writes
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1b, 0x24}
+
+
+def ts_starts_independent(data):
+    """Whether an MPEG-TS part can be decoded on its own.
+
+    True when the first video packet starts a keyframe (the random access
+    indicator is set), or when there is no video at all.
+    """
+    pmt_pid = video_pid = None
+    for offset in range(0, len(data) - 187, 188):
+        packet = data[offset:offset + 188]
+        if packet[0] != 0x47:
+            return False
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        unit_start = packet[1] & 0x40
+        adaptation = packet[3] & 0x20
+        payload = 5 + packet[4] if adaptation else 4
+        if pid == video_pid and unit_start:
+            return bool(adaptation and packet[4] and packet[5] & 0x40)
+        if not unit_start or payload >= 188:
+            continue
+        # PSI sections start after a pointer field
+        section = packet[payload + 1 + packet[payload]:]
+        if pid == 0 and pmt_pid is None and len(section) >= 12:
+            pmt_pid = ((section[10] & 0x1f) << 8) | section[11]
+        elif pid == pmt_pid and pmt_pid is not None and len(section) >= 12:
+            end = min(3 + (((section[1] & 0x0f) << 8) | section[2]) - 4,
+                      len(section))
+            index = 12 + (((section[10] & 0x0f) << 8) | section[11])
+            while index + 5 <= end:
+                if section[index] in VIDEO_STREAM_TYPES:
+                    video_pid = ((section[index + 1] & 0x1f) << 8) | \
+                        section[index + 2]
+                    break
+                index += 5 + (((section[index + 3] & 0x0f) << 8) |
+                              section[index + 4])
+            if video_pid is None:
+                return True
+    return False
+
+
+def _program_date_time(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + \
+        f'.{int(timestamp % 1 * 1000):03d}Z'
+
+
+class _Segment:
+    __slots__ = ('msn', 'parts', 'duration', 'data', 'started')
+
+    def __init__(self, msn):
+        self.msn = msn
+        # (name, duration, independent)
+        self.parts = []
+        self.duration = 0.0
+        self.data = None
+        self.started = None
+
+
+class _Stream:
+    """Parts and segments of one stream"""
+
+    def __init__(self, updated):
+        self.segments = deque()
+        self.current = _Segment(0)
+        # Part name -> bytes, for the parts still listed
+        self.parts = {}
+        self.next_part = None
+        self.ended = False
+        # ffmpeg's media sequence number of the newest part, and the
+        # modification time of its playlist when last read
+        self.last_seq = -1
+        self.mtime = None
+        self.etag_base = time.time_ns()
+        self.rendered = None
+        self.updated = updated
+
+    def newest(self):
+        """(msn, part index) of the newest part, or None"""
+        if self.current.parts:
+            return self.current.msn, len(self.current.parts) - 1
+        if self.segments:
+            return self.segments[-1].msn, len(self.segments[-1].parts) - 1
+        return None
+
+
+class LowLatencyHLS:
+    """LL-HLS packaging and delivery of node-media-server's HLS output.
+
+    In low-latency mode ffmpeg cuts parts of at most `part_target` seconds
+    on time rather than whole segments on keyframes. Each part is read into
+    memory as soon as ffmpeg lists it in its own playlist (checked every
+    `poll_interval` seconds) and grouped into segments of about
+    `segment_target` seconds that start on a keyframe where the stream has
+    one (never longer than `segment_max`). The app's playlist keeps the
+    last `window` segments, with EXT-X-PART entries for the newest
+    `part_segments` and an EXT-X-PRELOAD-HINT for the part being written.
+
+    Playlist requests with `_HLS_msn`/`_HLS_part` and requests for the
+    hinted part are held until what they ask for exists. Waiters park on
+    the stream's event, which is set and replaced with a fresh one every
+    time a part arrives, so nothing polls while they wait.
+    """
+
+    def __init__(self, socketio, media_root, part_target=0.334,
+                 segment_target=2, segment_max=4, window=6, part_segments=3,
+                 poll_interval=0.05):
+        self.socketio = socketio
+        self.media_root = media_root
+        self.part_target = part_target
+        self.segment_target = segment_target
+        self.segment_max = segment_max
+        self.target_duration = math.ceil(segment_max)
+        self.window = window
+        self.part_segments = part_segments
+        self.poll_interval = poll_interval
+        self.streams = {}
+        self.held = 0
+        self.watcher = None
+
+    def start(self):
+        if self.watcher is None:
+            # So that the request starting it already finds live streams
+            self.scan()
+            self.watcher = self.socketio.start_background_task(self._watch)
+
+    def _watch(self):
+        while True:
+            self.scan()
+            self.socketio.sleep(self.poll_interval)
+
+    def scan(self):
+        """Take in the parts ffmpeg has finished since the last scan"""
+        live_root = os.path.join(self.media_root, 'live')
+        try:
+            keys = os.listdir(live_root)
+        except FileNotFoundError:
+            keys = []
+        live = set()
+        for key in keys:
+            folder = os.path.join(live_root, key)
+            try:
+                mtime = os.stat(os.path.join(folder, 'index.m3u8')).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            live.add(key)
+            stream = self.streams.get(key)
+            if stream is not None and stream.mtime == mtime:
+                continue
+            try:
+                with open(os.path.join(folder, 'index.m3u8')) as f:
+                    text = f.read()
+            except FileNotFoundError:
+                continue
+            self._read_playlist(key, folder, text, mtime)
+        # node-media-server deletes the files once a publish is over
+        for key in set(self.streams) - live:
+            self.reset(key)
+
+    def _read_playlist(self, key, folder, text, mtime):
+        sequence, duration, entries = 0, None, []
+        for line in text.splitlines():
+            if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                sequence = int(line.split(':', 1)[1])
+            elif line.startswith('#EXTINF:'):
+                duration = float(line[8:].split(',', 1)[0])
+            elif line and not line.startswith('#'):
+                entries.append((line, duration))
+        ended = '#EXT-X-ENDLIST' in text
+        stream = self.streams.get(key)
+        if stream is not None and (
+                sequence + len(entries) <= stream.last_seq or
+                (stream.ended and not ended)):
+            # ffmpeg started over for a new publish
+            self.reset(key)
+        stream = self._stream(key)
+        stream.mtime = mtime
+        for offset, (name, duration) in enumerate(entries):
+            if sequence + offset <= stream.last_seq:
+                continue
+            try:
+                with open(os.path.join(folder, name), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            stream.last_seq = sequence + offset
+            self.add_part(key, name, duration, data)
+        if ended and not stream.ended:
+            stream.ended = True
+            self._updated(stream)
+
+    def _stream(self, key):
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = _Stream(
+                self.socketio.server.eio.create_event())
+        return stream
+
+    def add_part(self, key, name, duration, data):
+        """Append a finished part to `key`'s stream and wake its waiters"""
+        stream = self._stream(key)
+        independent = ts_starts_independent(data)
+        current = stream.current
+        if current.parts and (
+                current.duration + duration > self.segment_max or
+                (independent and current.duration >=
+                 self.segment_target - self.part_target / 2)):
+            self._close_segment(stream)
+            current = stream.current
+        if not current.parts:
+            # When its first frame was captured, near enough
+            current.started = time.time() - duration
+        current.parts.append((name, duration, independent))
+        current.duration += duration
+        stream.parts[name] = data
+        match = NUMBERED_RE.match(name)
+        stream.next_part = match and \
+            f'{match[1]}{int(match[2]) + 1}{match[3]}'
+        self._updated(stream)
+
+    def _close_segment(self, stream):
+        segment = stream.current
+        segment.data = b''.join(stream.parts[name]
+                                for name, _, _ in segment.parts)
+        stream.segments.append(segment)
+        stream.current = _Segment(segment.msn + 1)
+        while len(stream.segments) > self.window:
+            stream.segments.popleft()
+        # Parts are only listed for the newest segments
+        if len(stream.segments) > self.part_segments:
+            expired = stream.segments[-self.part_segments - 1]
+            for name, _, _ in expired.parts:
+                stream.parts.pop(name, None)
+
+    def _updated(self, stream):
+        stream.rendered = None
+        # A fresh event first, so a waiter can't miss the next update
+        # between waking up and waiting again
+        updated = stream.updated
+        stream.updated = self.socketio.server.eio.create_event()
+        updated.set()
+
+    def reset(self, key):
+        """Forget a stream, e.g. when its publisher goes away"""
+        stream = self.streams.pop(key, None)
+        if stream is not None:
+            stream.ended = True
+            self._updated(stream)
+
+    def _wait(self, stream, ready, timeout):
+        deadline = time.monotonic() + timeout
+        self.held += 1
+        try:
+            while not ready():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or stream.ended:
+                    return False
+                stream.updated.wait(remaining)
+            return True
+        finally:
+            self.held -= 1
+
+    def render(self, stream):
+        if stream.rendered is not None:
+            return stream.rendered
+        lines = ['#EXTM3U', '#EXT-X-VERSION:6',
+                 f'#EXT-X-TARGETDURATION:{self.target_duration}',
+                 f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}',
+                 f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,'
+                 f'PART-HOLD-BACK={3 * self.part_target:.3f}']
+        segments = list(stream.segments)
+        first = segments[0].msn if segments else stream.current.msn
+        lines.append(f'#EXT-X-MEDIA-SEQUENCE:{first}')
+        with_parts = stream.current.msn - self.part_segments
+        for segment in segments + [stream.current]:
+            if segment.started is None:
+                continue
+            lines.append('#EXT-X-PROGRAM-DATE-TIME:' +
+                         _program_date_time(segment.started))
+            if segment.msn >= with_parts:
+                for name, duration, independent in segment.parts:
+                    lines.append(
+                        f'#EXT-X-PART:DURATION={duration:.3f},URI="{name}"' +
+                        (',INDEPENDENT=YES' if independent else ''))
+            if segment is not stream.current:
+                lines += [f'#EXTINF:{segment.duration:.3f},',
+                          f'segment{segment.msn}.ts']
+        if stream.ended:
+            lines.append('#EXT-X-ENDLIST')
+        elif stream.next_part:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,'
+                         f'URI="{stream.next_part}"')
+        stream.rendered = ('\n'.join(lines) + '\n').encode()
+        return stream.rendered
+
+    def playlist(self, key, msn=None, part=None):
+        """The playlist response, held until it has segment `msn` (or part
+        `part` of it, or anything newer); None for unknown streams"""
+        stream = self.streams.get(key)
+        if stream is None:
+            return None
+        if msn is None:
+            response = Response(self.render(stream),
+                                mimetype='application/vnd.apple.mpegurl')
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        if msn > stream.current.msn + 2:
+            return Response('_HLS_msn is too far ahead', status=400)
+
+        def ready():
+            if part is None:
+                return msn < stream.current.msn
+            newest = stream.newest()
+            return newest is not None and (msn, part) <= newest
+
+        if not self._wait(stream, ready, 3 * self.target_duration):
+            if stream.ended:
+                return Response('Stream ended', status=404)
+            return Response('Not available yet', status=503)
+        response = Response(self.render(stream),
+                            mimetype='application/vnd.apple.mpegurl')
+        # The answer to a blocking request never goes stale
+        response.headers['Cache-Control'] = \
+            f'public, max-age={6 * self.target_duration}'
+        return response
+
+    def media(self, key, name):
+        """(bytes, etag base) of a part or segment held in memory, waiting
+        for the hinted part; None if there is no such thing"""
+        stream = self.streams.get(key)
+        if stream is None:
+            return None
+        match = SEGMENT_NAME_RE.match(name)
+        if match:
+            msn = int(match[1])
+            if not stream.segments or msn < stream.segments[0].msn or \
+                    msn > stream.segments[-1].msn:
+                return None
+            segment = stream.segments[msn - stream.segments[0].msn]
+            return segment.data, stream.etag_base
+        if name not in stream.parts and name == stream.next_part:
+            self._wait(stream, lambda: name in stream.parts,
+                       3 * self.target_duration)
+        data = stream.parts.get(name)
+        return None if data is None else (data, stream.etag_base)
@@ -0,0 +1,262 @@
+"""Minimal pub/sub broker for running several app workers on one machine.
+
+Every frame a publisher writes is relayed to all subscribers, which is all the
+Socket.IO message queue needs. Frames are pickled, so only trusted peers may
+connect: start it next to the workers on a Unix socket, which only its owner
+can open,
+
+    python local_broker.py --socket /run/livestream/broker.sock
+
+and point them at it with SOCKETIO_MESSAGE_QUEUE=local:///run/livestream/broker.sock.
+Over TCP every peer must prove it holds a shared secret first:
+
+    python local_broker.py --port 6390 --secret <secret>
+    SOCKETIO_MESSAGE_QUEUE=local://:<secret>@127.0.0.1:6390
+
+Use Redis (redis://...) for deployments spanning several nodes.
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import pickle
+import secrets
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+from socketio.pubsub_manager import PubSubManager
+
+HEADER = struct.Struct('!I')
+# Largest frame taken from a peer before it is authenticated
+HANDSHAKE_LIMIT = 64
+
+
+def read_frame(sock, limit=None):
+    """Read one length-prefixed frame, or return None when the peer is gone
+    (or the frame is longer than `limit`)"""
+    header = _read_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    size = HEADER.unpack(header)[0]
+    if limit is not None and size > limit:
+        return None
+    return _read_exact(sock, size)
+
+
+def _read_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def write_frame(sock, payload):
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def sign(secret, challenge):
+    return hmac.new(secret.encode(), challenge, hashlib.sha256).digest()
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    """The broker over TCP, for peers that answer a challenge with `secret`"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, secret):
+        if not secret:
+            raise ValueError('a TCP broker needs a secret')
+        super().__init__(address, BrokerHandler)
+        self.secret = secret
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def relay(self, payload):
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                with client.write_lock:
+                    write_frame(client.request, payload)
+            except OSError:
+                with self.lock:
+                    self.clients.discard(client)
+
+
+class UnixBrokerServer(socketserver.ThreadingUnixStreamServer):
+    """The broker on a Unix socket that only its owner can connect to"""
+    daemon_threads = True
+    secret = None
+    relay = BrokerServer.relay
+
+    def __init__(self, path):
+        # Replace the socket of a broker that did not shut down cleanly
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, BrokerHandler)
+        finally:
+            os.umask(umask)
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    """A connection opens with a PUB or SUB frame that fixes its role, after
+    answering the server's challenge if it has a secret"""
+
+    def setup(self):
+        if self.request.family != socket.AF_UNIX:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+
+    def authenticate(self):
+        challenge = secrets.token_bytes(16)
+        write_frame(self.request, challenge)
+        proof = read_frame(self.request, HANDSHAKE_LIMIT)
+        return proof is not None and hmac.compare_digest(
+            proof, sign(self.server.secret, challenge))
+
+    def handle(self):
+        if self.server.secret is not None and not self.authenticate():
+            return
+        role = read_frame(self.request, HANDSHAKE_LIMIT)
+        if role == b'SUB':
+            with self.server.lock:
+                self.server.clients.add(self)
+            # Subscribers never send anything else; wait for them to leave
+            read_frame(self.request)
+            return
+        while role == b'PUB':
+            payload = read_frame(self.request)
+            if payload is None:
+                break
+            self.server.relay(payload)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.clients.discard(self)
+
+
+class LocalBrokerManager(PubSubManager):
+    """Socket.IO client manager that uses :class:`BrokerServer` as its queue.
+
+    :param url: The broker address, as ``local:///path/to/broker.sock`` or
+                ``local://:secret@host:port``; a TCP broker's secret may
+                also come from ``LOCAL_BROKER_SECRET``.
+    :param channel: The channel name on which the server sends and receives
+                    notifications.
+    :param write_only: If set to ``True``, only initialize to emit events.
+    """
+    name = 'local'
+
+    def __init__(self, url='local://127.0.0.1:6390', channel='flask-socketio',
+                 write_only=False, logger=None):
+        parsed = urlparse(url)
+        if parsed.hostname is None and parsed.path:
+            self.address = parsed.path
+            self.secret = None
+        else:
+            self.address = (parsed.hostname or '127.0.0.1',
+                            parsed.port or 6390)
+            self.secret = unquote(parsed.password or '') or \
+                os.environ.get('LOCAL_BROKER_SECRET')
+            if not self.secret:
+                raise ValueError('a TCP local broker needs its secret, in '
+                                 'the URL or LOCAL_BROKER_SECRET')
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger)
+
+    def _connect(self, role):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+        else:
+            sock = socket.create_connection(self.address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            challenge = read_frame(sock, HANDSHAKE_LIMIT)
+            if challenge is None:
+                sock.close()
+                raise ConnectionError('local broker closed the connection')
+            write_frame(sock, sign(self.secret, challenge))
+        write_frame(sock, role)
+        return sock
+
+    def _publish(self, data):
+        payload = pickle.dumps((self.channel, data))
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect(b'PUB')
+                    write_frame(self._publisher, payload)
+                    return
+                except OSError:
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                sock = self._connect(b'SUB')
+                retry_sleep = 1
+                while True:
+                    payload = read_frame(sock)
+                    if payload is None:
+                        break
+                    channel, data = pickle.loads(payload)
+                    if channel == self.channel:
+                        yield data
+                sock.close()
+            except OSError:
+                self._get_logger().error('Cannot receive from local broker, '
+                                         'retrying in %s secs', retry_sleep)
+            time.sleep(retry_sleep)
+            retry_sleep = min(retry_sleep * 2, 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Socket.IO broker')
+    parser.add_argument('--socket', help='listen on this Unix socket path')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    parser.add_argument('--secret', default=os.environ.get(
+        'LOCAL_BROKER_SECRET'), help='required over TCP')
+    args = parser.parse_args()
+
+    if args.socket:
+        server, where = UnixBrokerServer(args.socket), args.socket
+    elif not args.secret:
+        parser.error('listening on TCP needs --secret (or '
+                     'LOCAL_BROKER_SECRET); use --socket for a local broker')
+    else:
+        server = BrokerServer((args.host, args.port), args.secret)
+        where = f'{args.host}:{args.port}'
+    with server:
+        print(f'Local broker listening on {where}')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
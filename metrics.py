@@ -0,0 +1,180 @@
+import functools
+import time
+from bisect import bisect_left
+
+# Seconds; handlers are expected to take tens of microseconds to a few ms
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Recipients per emit
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+                  10000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing is one bisect and two additions"""
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    """A minimal Prometheus registry.
+
+    Counters and histograms are created once per label set and kept by the
+    caller, so the hot path only touches a preallocated object. Gauges are
+    callbacks evaluated when /metrics is scraped.
+    """
+
+    def __init__(self, prefix='livestream'):
+        self.prefix = prefix
+        self._families = {}
+
+    def _child(self, kind, name, help, labels, factory):
+        family = self._families.setdefault(
+            name, {'type': kind, 'help': help, 'children': {}})
+        key = tuple(sorted(labels.items()))
+        child = family['children'].get(key)
+        if child is None:
+            child = family['children'][key] = factory()
+        return child
+
+    def counter(self, name, help, **labels):
+        return self._child('counter', name, help, labels, Counter)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self._child('histogram', name, help, labels,
+                           lambda: Histogram(buckets))
+
+    def gauge(self, name, help, callback, type='gauge'):
+        """Value read at scrape time: `callback` returns a number or a list
+        of (labels dict, value). Use type='counter' for running totals kept
+        elsewhere."""
+        self._families[name] = {'type': type, 'help': help,
+                                'callback': callback}
+
+    def render(self):
+        lines = []
+        for name, family in self._families.items():
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {family["help"]}')
+            lines.append(f'# TYPE {full_name} {family["type"]}')
+            if 'callback' in family:
+                values = family['callback']()
+                if not isinstance(values, list):
+                    values = [({}, values)]
+                for labels, value in values:
+                    lines.append(f'{full_name}'
+                                 f'{_format_labels(sorted(labels.items()))} '
+                                 f'{value}')
+            elif family['type'] == 'counter':
+                for labels, child in family['children'].items():
+                    lines.append(f'{full_name}{_format_labels(labels)} '
+                                 f'{child.value}')
+            else:
+                for labels, child in family['children'].items():
+                    cumulative = 0
+                    bounds = [str(b) for b in child.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, child.counts):
+                        cumulative += count
+                        lines.append(
+                            f'{full_name}_bucket'
+                            f'{_format_labels(labels + (("le", bound),))} '
+                            f'{cumulative}')
+                    lines.append(f'{full_name}_sum{_format_labels(labels)} '
+                                 f'{child.sum}')
+                    lines.append(f'{full_name}_count{_format_labels(labels)} '
+                                 f'{cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def instrument_socketio(socketio, metrics, namespace='/', broadcaster=None):
+    """Time every registered event handler and count what the server emits.
+
+    Call once, after the handlers have been registered. Handlers are
+    wrapped where python-socketio dispatches them, so the latency includes
+    Flask-SocketIO's request context setup. Outgoing events are counted per
+    recipient, including those a `broadcaster` queued, and fan-out is
+    recorded per emit from the participant list the client manager walks.
+    """
+    server = socketio.server
+    handlers = server.handlers[namespace]
+    for event, handler in list(handlers.items()):
+        handlers[event] = _timed(
+            handler,
+            metrics.counter('socketio_events_received_total',
+                            'Socket.IO events received', event=event),
+            metrics.histogram('socketio_handler_seconds',
+                              'Socket.IO handler latency', handler=event))
+
+    emitted = {}
+    emit_internal = server._emit_internal
+
+    def count_emitted(event, recipients=1):
+        counter = emitted.get(event)
+        if counter is None:
+            counter = emitted[event] = metrics.counter(
+                'socketio_events_emitted_total',
+                'Socket.IO events sent, one per recipient', event=event)
+        counter.value += recipients
+
+    def counting_emit_internal(eio_sid, event, *args, **kwargs):
+        count_emitted(event)
+        return emit_internal(eio_sid, event, *args, **kwargs)
+
+    server._emit_internal = counting_emit_internal
+    if broadcaster is not None:
+        broadcaster.on_emit = count_emitted
+
+    fanout = metrics.histogram('socketio_fanout_recipients',
+                               'Recipients per emit', buckets=FANOUT_BUCKETS)
+    get_participants = server.manager.get_participants
+
+    def counting_get_participants(namespace, room):
+        count = 0
+        for participant in get_participants(namespace, room):
+            count += 1
+            yield participant
+        fanout.observe(count)
+
+    server.manager.get_participants = counting_get_participants
+
+
+def _timed(handler, received, latency):
+    counts, buckets = latency.counts, latency.buckets
+    perf_counter = time.perf_counter
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        received.value += 1
+        start = perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            counts[bisect_left(buckets, elapsed)] += 1
+            latency.sum += elapsed
+    return wrapper
@@ -0,0 +1,181 @@
+import functools
+import time
+
+from eventlet.queue import Queue
+
+# Policies for a full send queue
+COLLAPSE = 'collapse'
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+POLICIES = (COLLAPSE, DROP_OLDEST, DISCONNECT)
+
+
+class OutboundQueue(Queue):
+    """An Engine.IO socket's send queue, bounded at `limit` packets.
+
+    With the collapse policy, a queued event named in `collapse` is replaced
+    by a newer one of the same name, so a slow client only ever waits for
+    the latest `viewer_count`. With drop_oldest, the oldest event is dropped
+    to make room once `limit` packets are waiting. Only events queued by the
+    Broadcaster (packets with an `event`) are dropped or replaced; pings,
+    acks and close packets always go through.
+
+    `full_since` is when the queue last reached `limit`; it is cleared once
+    the client has caught up to half of it.
+    """
+
+    def __init__(self, monitor, limit, policies, collapse):
+        super().__init__()
+        self.monitor = monitor
+        self.limit = limit
+        self.collapse = collapse if COLLAPSE in policies else ()
+        self.drop_oldest = DROP_OLDEST in policies
+        self.dropped = 0
+        self.collapsed = 0
+        self.full_since = None
+        # event -> its queued packet, for the collapse policy
+        self._latest = {}
+
+    def _put(self, item):
+        event = getattr(item, 'event', None)
+        if event in self.collapse:
+            superseded = self._latest.get(event)
+            if superseded is not None and self._remove(superseded):
+                self.collapsed += 1
+                self.monitor.collapsed += 1
+            self._latest[event] = item
+        # The queue holds (time queued, packet) pairs
+        super()._put((time.monotonic(), item))
+        if len(self.queue) >= self.limit:
+            if self.full_since is None:
+                self.full_since = time.monotonic()
+            if self.drop_oldest:
+                self._drop()
+
+    def _get(self):
+        _, item = super()._get()
+        event = getattr(item, 'event', None)
+        if event is not None and self._latest.get(event) is item:
+            del self._latest[event]
+        if self.full_since is not None and len(self.queue) <= self.limit // 2:
+            self.full_since = None
+        return item
+
+    def lag(self):
+        """Seconds the oldest waiting packet has been queued"""
+        return time.monotonic() - self.queue[0][0] if self.queue else 0.0
+
+    def clear(self):
+        """Discards every waiting packet, for a socket being disconnected"""
+        while self.queue:
+            self.queue.popleft()
+            self.task_done()
+        self._latest.clear()
+
+    def _remove(self, item):
+        for index, (_, queued) in enumerate(self.queue):
+            if queued is item:
+                del self.queue[index]
+                # Keep join() from waiting on a packet that will never be sent
+                self.task_done()
+                return True
+        return False
+
+    def _drop(self):
+        for index, (_, item) in enumerate(self.queue):
+            event = getattr(item, 'event', None)
+            if event is not None:
+                del self.queue[index]
+                self.task_done()
+                if self._latest.get(event) is item:
+                    del self._latest[event]
+                self.dropped += 1
+                self.monitor.dropped += 1
+                return
+
+
+class SlowConsumerMonitor:
+    """Bounds every socket's send queue and watches for clients that lag.
+
+    `install` makes the Engine.IO server create OutboundQueues. Every
+    `interval` seconds the monitor records each client's lag, the age of
+    its oldest queued packet, and with the disconnect policy closes sockets
+    whose queue has stayed full for `max_lag` seconds.
+    """
+
+    def __init__(self, socketio, limit=1000, policies=POLICIES,
+                 collapse=('viewer_count', 'stream_info', 'stream_list'),
+                 max_lag=60, interval=1, report=20):
+        unknown = set(policies) - set(POLICIES)
+        if unknown:
+            raise ValueError(f'Unknown send queue policy: {", ".join(unknown)}')
+        self.socketio = socketio
+        self.limit = limit
+        self.policies = policies
+        self.collapse = frozenset(collapse)
+        self.max_lag = max_lag
+        self.interval = interval
+        self.report = report
+        self.dropped = 0
+        self.collapsed = 0
+        self.disconnected = 0
+        self.full = 0
+        self.max_seen_lag = 0.0
+        # The `report` clients lagging furthest behind, worst first
+        self.slowest = []
+        self.task = None
+
+    def install(self):
+        eio = self.socketio.server.eio
+        eio._async = dict(eio._async, queue=functools.partial(
+            OutboundQueue, self, self.limit, self.policies, self.collapse))
+
+    def start(self):
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            self.check()
+
+    def check(self):
+        server = self.socketio.server
+        now = time.monotonic()
+        lagging, full = [], 0
+        for eio_sid, socket in list(server.eio.sockets.items()):
+            queue = socket.queue
+            if not isinstance(queue, OutboundQueue) or not queue.queue or \
+                    socket.closed or socket.closing:
+                continue
+            lagging.append((queue.lag(), eio_sid, queue))
+            if queue.full_since is None:
+                continue
+            full += 1
+            if DISCONNECT in self.policies and \
+                    now - queue.full_since >= self.max_lag:
+                self.disconnected += 1
+                # The socket stays listed until its writer gives up, but
+                # nothing it had queued needs to be kept for it
+                queue.clear()
+                socket.close(wait=False, abort=True)
+        lagging.sort(key=lambda entry: entry[0], reverse=True)
+        self.full = full
+        self.max_seen_lag = lagging[0][0] if lagging else 0.0
+        self.slowest = [{
+            'sid': server.manager.sid_from_eio_sid(eio_sid, '/'),
+            'lag': round(lag, 3),
+            'queued': queue.qsize(),
+            'full_for': round(now - queue.full_since, 1)
+            if queue.full_since is not None else 0,
+            'dropped': queue.dropped,
+            'collapsed': queue.collapsed
+        } for lag, eio_sid, queue in lagging[:self.report]]
+
+    def stats(self):
+        return {'limit': self.limit, 'policies': list(self.policies),
+                'full': self.full, 'dropped': self.dropped,
+                'collapsed': self.collapsed,
+                'disconnected': self.disconnected,
+                'max_lag': round(self.max_seen_lag, 3),
+                'slowest': self.slowest}
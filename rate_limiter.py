@@ -0,0 +1,129 @@
+import functools
+import time
+from collections import OrderedDict
+
+from flask import request
+from flask_socketio import disconnect
+
+POLICIES = ('drop', 'delay', 'disconnect')
+
+# event=rate/burst:policy, comma separated; rate is events per second
+DEFAULT_LIMITS = ('chat_message=5/10:drop,'
+                  'webrtc_offer=2/5:drop,'
+                  'webrtc_ice_candidate=50/100:delay')
+
+
+def parse_limits(spec):
+    """Parse a RATE_LIMITS value into {event: (rate, burst, policy)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, rule = item.partition('=')
+        numbers, _, policy = rule.partition(':')
+        rate, _, burst = numbers.partition('/')
+        policy = policy or 'drop'
+        if policy not in POLICIES:
+            raise ValueError(f'Unsupported rate limit policy: {policy}')
+        limits[event] = (float(rate), float(burst or rate), policy)
+    return limits
+
+
+class RateLimiter:
+    """Token buckets per client and event type.
+
+    Buckets live in an OrderedDict kept in least-recently-used order, so a
+    check is O(1) and idle buckets (untouched for `idle_ttl` seconds) are
+    evicted from the front as new events arrive; `max_buckets` bounds memory
+    under a flood of fresh clients. An idle bucket would have refilled
+    anyway, so evicting it never changes a decision.
+
+    A delayed event books its token before it sleeps: the bucket goes
+    negative, so every later event waits behind it and delayed events run
+    in the order they arrived.
+    """
+
+    def __init__(self, limits, idle_ttl=60, max_buckets=100000,
+                 max_delay=1.0):
+        self.limits = limits
+        self.idle_ttl = idle_ttl
+        self.max_buckets = max_buckets
+        self.max_delay = max_delay
+        self.allowed = dict.fromkeys(limits, 0)
+        self.rejected = dict.fromkeys(limits, 0)
+        self.delayed = dict.fromkeys(limits, 0)
+        self.disconnected = 0
+        self._buckets = OrderedDict()
+
+    def check(self, key, event, max_wait=0):
+        """Take a token; returns 0 if allowed, else seconds until one is
+        free. A token up to `max_wait` seconds away is taken ahead."""
+        rate, burst, _ = self.limits[event]
+        now = time.monotonic()
+        bucket_key = (key, event)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = [burst, now]
+            self._evict(now)
+        else:
+            self._buckets.move_to_end(bucket_key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed[event] += 1
+            return 0
+        wait = (1 - bucket[0]) / rate
+        if wait <= max_wait:
+            bucket[0] -= 1
+        return wait
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self.idle_ttl and len(buckets) <= self.max_buckets:
+                break
+            del buckets[key]
+
+    def forget(self, key):
+        for event in self.limits:
+            self._buckets.pop((key, event), None)
+
+    def limit(self, event, key_func=None, sleep=time.sleep):
+        """Decorator applying `event`'s limit to a Socket.IO handler.
+
+        Over the limit the handler is skipped (drop), run once its booked
+        token is due (delay, dropped if that is more than `max_delay` away)
+        or the client is disconnected.
+        """
+        def decorator(handler):
+            if event not in self.limits:
+                return handler
+
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                key = key_func() if key_func else request.sid
+                policy = self.limits[event][2]
+                wait = self.check(key, event,
+                                  self.max_delay if policy == 'delay' else 0)
+                if wait:
+                    if policy == 'delay' and wait <= self.max_delay:
+                        # The token is already ours
+                        self.delayed[event] += 1
+                        self.allowed[event] += 1
+                        sleep(wait)
+                    else:
+                        self.rejected[event] += 1
+                        if policy == 'disconnect':
+                            self.disconnected += 1
+                            disconnect()
+                        return None
+                return handler(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {'allowed': dict(self.allowed),
+                'rejected': dict(self.rejected),
+                'delayed': dict(self.delayed),
+                'disconnected': self.disconnected,
+                'buckets': len(self._buckets)}
@@ -1,56 +1,92 @@
+const crypto = require('crypto');
 const NodeMediaServer = require('node-media-server');
 
+// Set by the app's supervisor
+const RTMP_PORT = parseInt(process.env.RTMP_PORT || '1935', 10);
+const HTTP_PORT = parseInt(process.env.RTMP_HTTP_PORT || '8000', 10);
+const STREAM_KEY_SECRET = process.env.STREAM_KEY_SECRET || '';
+
 const config = {
   rtmp: {
-    port: 1935,
+    port: RTMP_PORT,
     chunk_size: 60000,
     gop_cache: true,
     ping: 30,
     ping_timeout: 60
   },
-  http: {
-    port: 8000,
-    allow_origin: '*',
-    mediaroot: './media'
+  // Turns on node-media-server's check of every publish, which
+  // authorizePublish answers instead of its own signed URLs
+  auth: {
+    publish: true,
+    secret: STREAM_KEY_SECRET || 'unset'
   },
-  trans: {
-    // ffmpeg: '/usr/bin/ffmpeg', // Make sure this path is correct for your system
-    ffmpeg: '/usr/local/bin/ffmpeg', // Make sure this path is correct for your system
-    tasks: [
-      {
-        app: 'live',
-        hls: true,
-        hlsFlags: '[hls_time=2:hls_list_size=3:hls_flags=delete_segments]',
-        dash: false
-      }
-    ]
+  // node-media-server v4 only relays the stream; the app packages HLS
+  // itself by reading it back over RTMP (hls_packager.py)
+  http: {
+    port: HTTP_PORT,
+    allow_origin: '*'
   }
 };
 
 var nms = new NodeMediaServer(config);
 nms.run();
 
-// Handle server events
-nms.on('preConnect', (id, args) => {
-  console.log('[NodeEvent on preConnect]', `id=${id} args=${JSON.stringify(args)}`);
-});
+// Lines that are JSON objects with an `event` field are parsed by the app's
+// supervisor; everything else is plain log output
+function emitEvent(event, session, extra) {
+  console.log(JSON.stringify(Object.assign({
+    event: event,
+    id: session.id,
+    ip: session.ip,
+    app: session.streamApp,
+    stream_key: session.streamName,
+    stream_path: session.streamPath
+  }, extra)));
+}
 
-nms.on('postConnect', (id, args) => {
-  console.log('[NodeEvent on postConnect]', `id=${id} args=${JSON.stringify(args)}`);
-});
+// Same check as StreamKeys.verify in stream_keys.py: the key is
+// <expiry>-<nonce>-<signature>, signed with the app's STREAM_KEY_SECRET
+function verifyStreamKey(key) {
+  if (!STREAM_KEY_SECRET || typeof key !== 'string' || key.length > 64) {
+    return false;
+  }
+  const split = key.lastIndexOf('-');
+  const payload = key.slice(0, split);
+  const signature = key.slice(split + 1);
+  const dash = payload.indexOf('-');
+  const expires = dash < 0 ? '' : payload.slice(0, dash);
+  if (split < 0 || dash < 0 || !/^[0-9a-fA-F]+$/.test(expires) ||
+      parseInt(expires, 16) < Date.now() / 1000 || dash === payload.length - 1) {
+    return false;
+  }
+  const expected = crypto.createHmac('sha256', STREAM_KEY_SECRET)
+    .update(payload).digest('hex').slice(0, 32);
+  return signature.length === expected.length &&
+    crypto.timingSafeEqual(Buffer.from(signature), Buffer.from(expected));
+}
 
-nms.on('doneConnect', (id, args) => {
-  console.log('[NodeEvent on doneConnect]', `id=${id} args=${JSON.stringify(args)}`);
-});
+// node-media-server v4 emits prePublish right before its own auth check
+// and sets the publisher up straight after, without waiting for handlers.
+// Answering that check for this session refuses a bad key before any
+// ingest starts: the socket is closed and postPublish never fires.
+function authorizePublish(session) {
+  const authorized = session.streamApp === 'live' &&
+    verifyStreamKey(session.streamName);
+  session.broadcast.verifyAuth = () => authorized;
+  if (!authorized) {
+    emitEvent('rejectPublish', session);
+  }
+}
 
-nms.on('prePublish', (id, StreamPath, args) => {
-  console.log('[NodeEvent on prePublish]', `id=${id} StreamPath=${StreamPath} args=${JSON.stringify(args)}`);
+nms.on('prePublish', (session) => {
+  emitEvent('prePublish', session);
+  authorizePublish(session);
 });
 
-nms.on('postPublish', (id, StreamPath, args) => {
-  console.log('[NodeEvent on postPublish]', `id=${id} StreamPath=${StreamPath} args=${JSON.stringify(args)}`);
+nms.on('postPublish', (session) => {
+  emitEvent('postPublish', session);
 });
 
-nms.on('donePublish', (id, StreamPath, args) => {
-  console.log('[NodeEvent on donePublish]', `id=${id} StreamPath=${StreamPath} args=${JSON.stringify(args)}`);
+nms.on('donePublish', (session) => {
+  emitEvent('donePublish', session);
 });
\ No newline at end of file
@@ -0,0 +1,228 @@
+import atexit
+import json
+import socket
+import subprocess
+import time
+from collections import deque
+
+try:
+    # Pipe readers must be real threads even when eventlet has patched the
+    # threading module, so a blocking read never stalls the event loop
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+
+def parse_event(line):
+    """The structured event on a line of rtmp_server.js output, if any"""
+    if not line.startswith('{'):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or 'event' not in record:
+        return None
+    return record
+
+
+class RTMPSupervisor:
+    """Runs the RTMP server as a child process and keeps it running.
+
+    Two native threads drain the child's stdout and stderr into a bounded
+    deque, so it never blocks on a full pipe. A background task on the
+    app's event loop moves queued lines to the event log, hands structured
+    events (JSON lines with an ``event`` field) to `on_event` and checks
+    that `ports` accept connections.
+
+    A child that exits, or fails `max_failures` health checks in a row after
+    `startup_grace` seconds, is restarted after a backoff that doubles from
+    `min_backoff` up to `max_backoff` and resets once the child has stayed
+    up for `stable_after` seconds. `lease`, when given, is asked before every
+    health check; a worker that doesn't hold it stops its child, so only one
+    worker runs the server.
+    """
+
+    def __init__(self, socketio, command, event_log, on_event=None,
+                 ports=(), env=None, lease=None, interval=0.25,
+                 health_interval=5, max_failures=3, startup_grace=10,
+                 min_backoff=1, max_backoff=60, stable_after=60,
+                 max_lines=10000):
+        self.socketio = socketio
+        self.command = command
+        self.event_log = event_log
+        self.on_event = on_event
+        self.ports = ports
+        self.env = env
+        self.lease = lease
+        self.interval = interval
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.startup_grace = startup_grace
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.max_lines = max_lines
+        self.process = None
+        # A terminated child that may not have exited yet, and when to kill it
+        self._dying = None
+        self.healthy = False
+        self.restarts = 0
+        self.dropped_lines = 0
+        self.task = None
+        self._lines = deque()
+        self._backoff = min_backoff
+        self._restart_at = 0.0
+        self._started_at = 0.0
+        self._failures = 0
+        self._next_check = 0.0
+        atexit.register(self.stop)
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self._supervise)
+
+    def stop(self):
+        """Terminate the child and wait for it to exit"""
+        self._terminate()
+        if self._dying is not None:
+            try:
+                self._dying[0].wait(5)
+            except subprocess.TimeoutExpired:
+                self._dying[0].kill()
+            self._dying = None
+
+    def _terminate(self):
+        process, self.process = self.process, None
+        self.healthy = False
+        if process is not None and process.poll() is None:
+            process.terminate()
+            self._dying = (process, time.monotonic() + 5)
+
+    def _reap(self):
+        process, deadline = self._dying
+        if process.poll() is not None:
+            self._dying = None
+        elif time.monotonic() > deadline:
+            process.kill()
+
+    def stats(self):
+        return {'running': self.running, 'healthy': self.healthy,
+                'pid': self.process and self.process.pid,
+                'restarts': self.restarts,
+                'dropped_lines': self.dropped_lines}
+
+    def _supervise(self):
+        while True:
+            now = time.monotonic()
+            if self._dying is not None:
+                self._reap()
+            if self.process is None:
+                # The old child must be gone before a new one binds its ports
+                if (self._dying is None and now >= self._restart_at and
+                        self._holds_lease()):
+                    self._spawn()
+            elif self.process.poll() is not None:
+                self.event_log.error('rtmp_exited', pid=self.process.pid,
+                                     code=self.process.returncode,
+                                     backoff=self._backoff)
+                self._restart_later()
+            elif now >= self._next_check:
+                self._next_check = now + self.health_interval
+                if not self._holds_lease():
+                    self.event_log.warning('rtmp_lease_lost',
+                                           pid=self.process.pid)
+                    self._terminate()
+                else:
+                    self._check_health(now)
+            self._pump()
+            self.socketio.sleep(self.interval)
+
+    def _holds_lease(self):
+        return self.lease is None or self.lease()
+
+    def _spawn(self):
+        try:
+            process = subprocess.Popen(
+                self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL, env=self.env)
+        except OSError as e:
+            self.event_log.error('rtmp_start_failed', error=str(e),
+                                 backoff=self._backoff)
+            self._restart_later()
+            return
+        for pipe, name in ((process.stdout, 'stdout'),
+                           (process.stderr, 'stderr')):
+            threading.Thread(target=self._drain, args=(pipe, name),
+                             name=f'rtmp-{name}', daemon=True).start()
+        self.process = process
+        self._started_at = self._next_check = time.monotonic()
+        self._failures = 0
+        self.event_log.info('rtmp_started', pid=process.pid,
+                            restarts=self.restarts)
+
+    def _restart_later(self):
+        self._terminate()
+        self.restarts += 1
+        self._restart_at = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def _check_health(self, now):
+        closed = [port for port in self.ports if not self._port_open(port)]
+        if not closed:
+            self.healthy = True
+            self._failures = 0
+            if now - self._started_at >= self.stable_after:
+                self._backoff = self.min_backoff
+            return
+        self.healthy = False
+        if now - self._started_at < self.startup_grace:
+            return
+        self._failures += 1
+        self.event_log.warning('rtmp_unhealthy', pid=self.process.pid,
+                               closed_ports=closed, failures=self._failures)
+        if self._failures >= self.max_failures:
+            self._restart_later()
+
+    def _port_open(self, port):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    def _drain(self, pipe, name):
+        """Runs in a native thread until the child closes the pipe"""
+        lines = self._lines
+        for raw in iter(pipe.readline, b''):
+            if len(lines) < self.max_lines:
+                lines.append((name, raw.decode('utf-8', 'replace').rstrip()))
+            else:
+                self.dropped_lines += 1
+        pipe.close()
+
+    def _pump(self):
+        """Log queued output and dispatch the events in it"""
+        lines = self._lines
+        while lines:
+            name, line = lines.popleft()
+            record = parse_event(line)
+            if record is None:
+                if line:
+                    self.event_log.log('warning' if name == 'stderr'
+                                       else 'debug', 'rtmp_output',
+                                       stream=name, line=line)
+                continue
+            event = record.pop('event')
+            self.event_log.info(f'rtmp_{event}', **record)
+            if self.on_event is not None:
+                try:
+                    self.on_event(event, record)
+                except Exception as e:
+                    self.event_log.error('rtmp_event_failed', rtmp_event=event,
+                                         error=str(e))
@@ -0,0 +1,114 @@
+import time
+
+VIEWER = 'viewer'
+BROADCASTER = 'broadcaster'
+
+
+class Session:
+    """One connected socket; slots keep a record at about 100 bytes"""
+    __slots__ = ('sid', 'role', 'stream_id', 'transport', 'connected_at')
+
+    def __init__(self, sid, transport):
+        self.sid = sid
+        self.role = VIEWER
+        self.stream_id = None
+        self.transport = transport
+        self.connected_at = time.time()
+
+
+class SessionStore:
+    """The sockets connected to this worker, indexed by stream, role and
+    transport.
+
+    Every index maps a value to the set of sids that have it, so adding,
+    moving and removing a session touches one set per index whatever the
+    number of sessions, and "who is watching stream X" or "who is
+    broadcasting" are lookups instead of scans. `transport` is the one the
+    socket connected over; polling sockets may upgrade later.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.by_stream = {}
+        self.by_role = {}
+        self.by_transport = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, sid):
+        return sid in self.sessions
+
+    def get(self, sid):
+        return self.sessions.get(sid)
+
+    def add(self, sid, transport='polling'):
+        self.remove(sid)
+        session = self.sessions[sid] = Session(sid, transport)
+        _index(self.by_role, session.role, sid)
+        _index(self.by_transport, transport, sid)
+        return session
+
+    def remove(self, sid):
+        """Forget a session; returns it, or None if it wasn't connected"""
+        session = self.sessions.pop(sid, None)
+        if session is not None:
+            _unindex(self.by_stream, session.stream_id, sid)
+            _unindex(self.by_role, session.role, sid)
+            _unindex(self.by_transport, session.transport, sid)
+        return session
+
+    def stream_of(self, sid):
+        session = self.sessions.get(sid)
+        return session and session.stream_id
+
+    def set_stream(self, sid, stream_id):
+        session = self.sessions.get(sid)
+        if session is not None and session.stream_id != stream_id:
+            _unindex(self.by_stream, session.stream_id, sid)
+            _index(self.by_stream, stream_id, sid)
+            session.stream_id = stream_id
+
+    def set_role(self, sid, role):
+        session = self.sessions.get(sid)
+        if session is not None and session.role != role:
+            _unindex(self.by_role, session.role, sid)
+            _index(self.by_role, role, sid)
+            session.role = role
+
+    def in_stream(self, stream_id):
+        return self.by_stream.get(stream_id, set())
+
+    def with_role(self, role):
+        return self.by_role.get(role, set())
+
+    def snapshot(self):
+        """Session counts for the stats endpoints, read off the index sizes"""
+        streams = {stream_id: {'viewers': len(sids), 'broadcasters': 0}
+                   for stream_id, sids in self.by_stream.items()}
+        for sid in self.by_role.get(BROADCASTER, ()):
+            counts = streams.get(self.sessions[sid].stream_id)
+            if counts is not None:
+                counts['viewers'] -= 1
+                counts['broadcasters'] += 1
+        return {
+            'sessions': len(self.sessions),
+            'roles': {role: len(sids) for role, sids in self.by_role.items()},
+            'transports': {transport: len(sids) for transport, sids
+                           in self.by_transport.items()},
+            'streams': streams
+        }
+
+
+def _index(index, key, sid):
+    if key is not None:
+        index.setdefault(key, set()).add(sid)
+
+
+def _unindex(index, key, sid):
+    sids = index.get(key)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            # Empty groups would otherwise pile up with every ended stream
+            del index[key]
@@ -0,0 +1,334 @@
+import asyncio
+import fractions
+import importlib.metadata
+import time
+
+try:
+    # The SFU's asyncio loop runs in a real thread even when eventlet has
+    # patched the threading module
+    from eventlet.patcher import original
+    threading = original('threading')
+    selectors = original('selectors')
+except ImportError:
+    import selectors
+    import threading
+
+try:
+    import av
+    from aiortc import (MediaStreamTrack, RTCPeerConnection, RTCRtpReceiver,
+                        RTCRtpSender, RTCSessionDescription)
+    from aiortc.mediastreams import MediaStreamError
+except ImportError:
+    av = None
+    MediaStreamTrack = object
+
+# Codec every publisher and viewer is pinned to, so frames can be forwarded
+# as they arrive
+DEFAULT_CODECS = {'audio': 'audio/opus', 'video': 'video/VP8'}
+
+
+def missing_internals():
+    """The private aiortc hooks this SFU relies on that the installed
+    aiortc lacks. They are known to work with the version pinned in
+    requirements-sfu.txt."""
+    hooks = {
+        # Swapped for a PublishedTrack on every incoming track
+        'RTCRtpReceiver.__decoder_queue':
+            '_RTCRtpReceiver__decoder_queue' in
+            RTCRtpReceiver.__init__.__code__.co_names,
+        'RTCRtpReceiver._send_rtcp_pli':
+            callable(getattr(RTCRtpReceiver, '_send_rtcp_pli', None)),
+        # Replaced on each viewer's sender, so it must still be what the
+        # sender calls when the viewer reports picture loss
+        'RTCRtpSender._send_keyframe':
+            '_send_keyframe' in getattr(
+                RTCRtpSender, '_handle_rtcp_packet', lambda: None
+            ).__code__.co_names,
+    }
+    return [name for name, present in hooks.items() if not present]
+
+
+def offered_kinds(offer):
+    """Media kinds of an SDP offer's m-lines, in order"""
+    return [line[2:].split(' ', 1)[0] for line in offer['sdp'].splitlines()
+            if line.startswith('m=')]
+
+
+def is_keyframe(mime_type, data):
+    """Whether an encoded frame can be decoded on its own"""
+    if mime_type == 'video/VP8':
+        # Bit 0 of the frame tag is clear on key frames
+        return bool(data) and not data[0] & 0x01
+    if mime_type == 'video/H264':
+        # An IDR slice or SPS anywhere in the Annex B access unit
+        start = data.find(b'\x00\x00\x01')
+        while start != -1 and start + 3 < len(data):
+            if data[start + 3] & 0x1f in (5, 7):
+                return True
+            start = data.find(b'\x00\x00\x01', start + 3)
+        return False
+    return True
+
+
+class SubscriberTrack(MediaStreamTrack):
+    """One viewer's copy of a published track.
+
+    Encoded frames are queued up to `max_queue`; a viewer that falls behind
+    has its queue emptied and, for video, skips ahead to the next keyframe.
+    """
+
+    def __init__(self, source, max_queue):
+        super().__init__()
+        self.kind = source.kind
+        self.source = source
+        self.queue = asyncio.Queue(max_queue)
+        # Video can only start at a keyframe
+        self.waiting = source.kind == 'video'
+
+    def push(self, packet, keyframe):
+        """Queue a frame; returns True if a keyframe is needed"""
+        if self.waiting:
+            if not keyframe:
+                self.source.sfu.dropped += 1
+                return True
+            self.waiting = False
+        try:
+            self.queue.put_nowait(packet)
+        except asyncio.QueueFull:
+            self.source.sfu.dropped += self.queue.qsize() + 1
+            self._clear()
+            self.waiting = self.kind == 'video'
+            return self.waiting
+        return False
+
+    def end(self):
+        self._clear()
+        self.queue.put_nowait(None)
+
+    def _clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def recv(self):
+        packet = await self.queue.get()
+        if packet is None:
+            self.stop()
+            raise MediaStreamError
+        self.source.sfu.forwarded += 1
+        return packet
+
+    def stop(self):
+        super().stop()
+        self.source.subscribers.discard(self)
+
+
+class PublishedTrack:
+    """Encoded frames of one incoming track, fanned out to subscribers.
+
+    Takes the place of the receiver's decoder queue, so aiortc hands over
+    each reassembled frame instead of decoding it. Keyframe requests from
+    subscribers are passed to the publisher as one PLI per
+    `keyframe_interval` seconds.
+    """
+
+    def __init__(self, sfu, kind, receiver):
+        self.sfu = sfu
+        self.kind = kind
+        self.receiver = receiver
+        self.subscribers = set()
+        self.frames = 0
+        self._last_keyframe_request = 0.0
+        self._decoder_queue = receiver._RTCRtpReceiver__decoder_queue
+        receiver._RTCRtpReceiver__decoder_queue = self
+
+    def put(self, item):
+        """Called by the receiver with (codec, frame), or None when it stops"""
+        if item is None:
+            # Let the receiver's idle decoder thread exit
+            self._decoder_queue.put(None)
+            for subscriber in list(self.subscribers):
+                subscriber.end()
+            return
+        codec, frame = item
+        self.frames += 1
+        packet = av.Packet(frame.data)
+        packet.pts = frame.timestamp
+        packet.time_base = fractions.Fraction(1, codec.clockRate)
+        keyframe = is_keyframe(codec.mimeType, frame.data)
+        need_keyframe = False
+        for subscriber in self.subscribers:
+            need_keyframe |= subscriber.push(packet, keyframe)
+        if need_keyframe:
+            self.request_keyframe()
+
+    def get(self):
+        # The receiver's decoder thread may start after the swap; it idles
+        # on the original queue until the receiver stops
+        return self._decoder_queue.get()
+
+    def request_keyframe(self):
+        now = time.monotonic()
+        if (self.kind != 'video' or
+                now - self._last_keyframe_request < self.sfu.keyframe_interval):
+            return
+        self._last_keyframe_request = now
+        for source in self.receiver.getSynchronizationSources():
+            asyncio.ensure_future(self.receiver._send_rtcp_pli(source.source))
+
+
+class SFU:
+    """Selective forwarding unit built on aiortc.
+
+    A broadcaster publishes its tracks to the server once; every viewer gets
+    its own peer connection from the server, fed the publisher's encoded
+    frames without transcoding. Offers and answers are complete SDP (no
+    trickle ICE). aiortc runs on its own asyncio loop in a background
+    thread; the public methods block the calling thread, or just the
+    calling green thread when `sleep` is a cooperative sleep.
+    """
+
+    def __init__(self, codecs=None, max_queue=30, keyframe_interval=0.5,
+                 timeout=10, sleep=time.sleep):
+        if av is None:
+            raise RuntimeError('SFU mode requested but the aiortc package '
+                               'is not installed')
+        missing = missing_internals()
+        if missing:
+            raise RuntimeError(
+                'SFU mode needs aiortc internals that aiortc '
+                f'{importlib.metadata.version("aiortc")} lacks '
+                f'({", ".join(missing)}); install the tested version with '
+                'pip install -r requirements-sfu.txt')
+        self.codecs = dict(DEFAULT_CODECS, **(codecs or {}))
+        self.max_queue = max_queue
+        self.keyframe_interval = keyframe_interval
+        self.timeout = timeout
+        self.sleep = sleep
+        # stream ID -> (peer connection, {kind: PublishedTrack})
+        self.publications = {}
+        # viewer sid -> (stream ID, peer connection, [SubscriberTrack])
+        self.subscriptions = {}
+        self.forwarded = 0
+        self.dropped = 0
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def publish(self, stream_id, offer):
+        """Accept the broadcaster's offer; returns the answer"""
+        return self._run(self._publish(stream_id, offer))
+
+    def subscribe(self, stream_id, viewer_id, offer):
+        """Accept a viewer's receive-only offer; returns the answer"""
+        return self._run(self._subscribe(stream_id, viewer_id, offer))
+
+    def unpublish(self, stream_id):
+        if stream_id in self.publications:
+            self._run(self._unpublish(stream_id))
+
+    def unsubscribe(self, viewer_id):
+        if viewer_id in self.subscriptions:
+            self._run(self._unsubscribe(viewer_id))
+
+    def stats(self):
+        return {'publications': len(self.publications),
+                'subscribers': len(self.subscriptions),
+                'forwarded': self.forwarded, 'dropped': self.dropped}
+
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.SelectorEventLoop(
+                    selectors.DefaultSelector())
+                threading.Thread(target=self._loop.run_forever, name='sfu',
+                                 daemon=True).start()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        deadline = time.monotonic() + self.timeout
+        while not future.done():
+            if time.monotonic() > deadline:
+                future.cancel()
+                raise TimeoutError('SFU negotiation timed out')
+            self.sleep(0.005)
+        return future.result()
+
+    def _pin_codec(self, transceiver, kind):
+        preferred = self.codecs[kind]
+        transceiver.setCodecPreferences([
+            codec for codec in RTCRtpSender.getCapabilities(kind).codecs
+            if codec.mimeType in (preferred, f'{kind}/rtx')])
+
+    async def _answer(self, pc, offer):
+        await pc.setRemoteDescription(RTCSessionDescription(
+            sdp=offer['sdp'], type=offer['type']))
+        await pc.setLocalDescription(await pc.createAnswer())
+        return {'sdp': pc.localDescription.sdp,
+                'type': pc.localDescription.type}
+
+    async def _publish(self, stream_id, offer):
+        await self._unpublish(stream_id)
+        pc = RTCPeerConnection()
+        tracks = {}
+        for kind in offered_kinds(offer):
+            if kind in self.codecs:
+                self._pin_codec(pc.addTransceiver(kind, direction='recvonly'),
+                                kind)
+
+        @pc.on('track')
+        def on_track(track):
+            for transceiver in pc.getTransceivers():
+                if transceiver.receiver.track is track:
+                    tracks[track.kind] = PublishedTrack(
+                        self, track.kind, transceiver.receiver)
+
+        try:
+            answer = await self._answer(pc, offer)
+        except Exception:
+            await pc.close()
+            raise
+        self.publications[stream_id] = (pc, tracks)
+        return answer
+
+    async def _subscribe(self, stream_id, viewer_id, offer):
+        await self._unsubscribe(viewer_id)
+        publication = self.publications.get(stream_id)
+        if publication is None or not publication[1]:
+            raise LookupError('Stream is not published to the SFU')
+        pc = RTCPeerConnection()
+        tracks = []
+        # One track per published kind the viewer asked for
+        for kind in dict.fromkeys(offered_kinds(offer)):
+            source = publication[1].get(kind)
+            if source is None:
+                continue
+            track = SubscriberTrack(source, self.max_queue)
+            transceiver = pc.addTransceiver(track, direction='sendonly')
+            self._pin_codec(transceiver, kind)
+            # Picture loss reported by the viewer goes to the publisher
+            transceiver.sender._send_keyframe = source.request_keyframe
+            tracks.append(track)
+        try:
+            answer = await self._answer(pc, offer)
+        except Exception:
+            await pc.close()
+            raise
+        for track in tracks:
+            track.source.subscribers.add(track)
+            track.source.request_keyframe()
+        self.subscriptions[viewer_id] = (stream_id, pc, tracks)
+        return answer
+
+    async def _unpublish(self, stream_id):
+        publication = self.publications.pop(stream_id, None)
+        if publication is None:
+            return
+        for viewer_id, subscription in list(self.subscriptions.items()):
+            if subscription[0] == stream_id:
+                await self._unsubscribe(viewer_id)
+        await publication[0].close()
+
+    async def _unsubscribe(self, viewer_id):
+        subscription = self.subscriptions.pop(viewer_id, None)
+        if subscription is None:
+            return
+        for track in subscription[2]:
+            track.stop()
+        await subscription[1].close()
@@ -0,0 +1,253 @@
+import threading
+
+
+def signal_room(stream_id):
+    """Socket.IO room of the viewers negotiating WebRTC with a stream"""
+    return f'webrtc:{stream_id}'
+
+
+class SignalingRelay:
+    """Point-to-point WebRTC signaling between a streamer and its viewers.
+
+    A viewer asks to join a stream's WebRTC session; it then gets the
+    streamer's cached offer and ICE candidates (if the streamer published
+    an untargeted offer) and the streamer is told about the viewer so it can
+    send an offer just for them. Answers and candidates only ever go to the
+    one peer they are for, so signaling traffic grows with the number of
+    sessions rather than with everyone connected. Targeted offers, answers
+    and candidates are only relayed between a viewer and the streamer it
+    has a session with; sessions are also kept in the state store as
+    `signal_session:<viewer sid>`, as the two may be on different workers.
+
+    The per-stream offer cache lives in the shared state store, bounded to
+    `max_candidates` candidates and expiring after `ttl` seconds.
+
+    ICE candidates are gathered per (sender, recipient) pair for `window`
+    seconds and delivered as one `webrtc_ice_candidates` packet. A `None`
+    candidate marks the end of candidates: it flushes the pair at once and
+    the batch carrying it has `end` set. Batches of a pair are numbered by
+    `seq` and only one flush per pair runs at a time, so candidates arrive
+    in the order they were sent and the end marker always comes last.
+    A `window` of 0 sends every candidate in its own packet.
+    """
+
+    def __init__(self, socketio, store, max_candidates=32, ttl=3600,
+                 window=0.02, max_batch=50):
+        self.socketio = socketio
+        self.store = store
+        self.max_candidates = max_candidates
+        self.ttl = ttl
+        self.window = window
+        self.max_batch = max_batch
+        # viewer sid -> (stream ID, streamer sid) for sessions on this worker
+        self.sessions = {}
+        # (sender sid, recipient sid or room) -> batch being gathered
+        self._pending = {}
+        self._flushing = set()
+        self._seq = {}
+        # sid -> pairs it takes part in, to clean up after it leaves
+        self._pairs = {}
+        self._lock = threading.Lock()
+
+    def _key(self, stream_id):
+        return f'signal:{stream_id}'
+
+    def paired(self, sid, peer_id):
+        """Whether one of `sid` and `peer_id` is a viewer with a session with
+        the other, the streamer"""
+        session = self.sessions.get(sid)
+        if session is not None:
+            return session[1] == peer_id
+        session = self.store.get(f'signal_session:{peer_id}')
+        return session is not None and session[1] == sid
+
+    def publish_offer(self, stream, offer, streamer_name):
+        """Cache the streamer's current offer and send it to joined viewers"""
+        stream_id = stream['stream_id']
+        self.store.set(self._key(stream_id), {
+            'offer': offer,
+            'streamer_name': streamer_name,
+            'candidates': [],
+        }, ttl=self.ttl)
+        self.socketio.emit('webrtc_offer', {
+            'offer': offer,
+            'stream_id': stream_id,
+            'streamer_id': stream['streamer_id'],
+            'streamer_name': streamer_name,
+        }, to=signal_room(stream_id), skip_sid=stream['streamer_id'])
+
+    def send_offer(self, stream, viewer_id, offer, streamer_name):
+        """Offer made for one viewer; False if it has no session with the
+        stream"""
+        session = self.store.get(f'signal_session:{viewer_id}')
+        if session != [stream['stream_id'], stream['streamer_id']]:
+            return False
+        self.socketio.emit('webrtc_offer', {
+            'offer': offer,
+            'stream_id': stream['stream_id'],
+            'streamer_id': stream['streamer_id'],
+            'streamer_name': streamer_name,
+            'targeted': True,
+        }, to=viewer_id)
+        return True
+
+    def join(self, viewer_id, stream):
+        """Open a session between `viewer_id` and the stream's broadcaster"""
+        self.leave(viewer_id)
+        stream_id = stream['stream_id']
+        streamer_id = stream['streamer_id']
+        self.sessions[viewer_id] = (stream_id, streamer_id)
+        self.store.set(f'signal_session:{viewer_id}', [stream_id, streamer_id],
+                       ttl=self.ttl)
+        self.socketio.server.enter_room(viewer_id, signal_room(stream_id),
+                                        namespace='/')
+        cached = self.store.get(self._key(stream_id))
+        if cached is not None:
+            self.socketio.emit('webrtc_offer', {
+                'offer': cached['offer'],
+                'stream_id': stream_id,
+                'streamer_id': streamer_id,
+                'streamer_name': cached['streamer_name'],
+                'candidates': cached['candidates'],
+                'end_of_candidates': cached.get('end', False),
+            }, to=viewer_id)
+        self.socketio.emit('webrtc_viewer_joined', {
+            'viewer_id': viewer_id,
+            'stream_id': stream_id,
+        }, to=streamer_id)
+        return cached is not None
+
+    def leave(self, viewer_id):
+        """Close the viewer's session, if it has one"""
+        self._forget(viewer_id)
+        session = self.sessions.pop(viewer_id, None)
+        if session is None:
+            return
+        stream_id, streamer_id = session
+        self.store.delete(f'signal_session:{viewer_id}')
+        self.socketio.server.leave_room(viewer_id, signal_room(stream_id),
+                                        namespace='/')
+        self.socketio.emit('webrtc_viewer_left', {
+            'viewer_id': viewer_id,
+            'stream_id': stream_id,
+        }, to=streamer_id)
+
+    def answer(self, viewer_id, streamer_id, answer):
+        """Answer the streamer of the viewer's session; False if that is not
+        `streamer_id`"""
+        session = self.sessions.get(viewer_id)
+        if session is None or session[1] != streamer_id:
+            return False
+        self.socketio.emit('webrtc_answer', {
+            'answer': answer,
+            'viewer_id': viewer_id,
+        }, to=streamer_id)
+        return True
+
+    def candidate(self, from_id, candidate, target_id=None, stream=None):
+        """Queue a candidate (`None` for the end of candidates) for one peer,
+        or (streamer only, no target) for the cached offer and every joined
+        viewer. False if there is no session to send it to."""
+        if target_id:
+            if not self.paired(from_id, target_id):
+                return False
+            key, stream_id = (from_id, target_id), None
+        elif stream is not None:
+            stream_id = stream['stream_id']
+            key = (from_id, signal_room(stream_id))
+        else:
+            return False
+
+        with self._lock:
+            batch = self._pending.get(key)
+            started = batch is None
+            if started:
+                batch = self._pending[key] = {
+                    'candidates': [], 'end': False, 'stream_id': stream_id}
+                if key not in self._seq:
+                    self._seq[key] = 0
+                    for sid in key:
+                        self._pairs.setdefault(sid, set()).add(key)
+            if candidate is None:
+                batch['end'] = True
+            else:
+                batch['candidates'].append(candidate)
+            flush_now = (batch['end'] or self.window <= 0 or
+                         len(batch['candidates']) >= self.max_batch)
+
+        if flush_now:
+            self.flush(key)
+        elif started:
+            self.socketio.start_background_task(self._flush_later, key)
+        return True
+
+    def flush(self, key):
+        """Send what is pending for a (sender, recipient) pair.
+
+        If a flush of the pair is already emitting, it picks up the new
+        batch once done, which keeps the pair's batches in order.
+        """
+        with self._lock:
+            if key in self._flushing:
+                return
+            self._flushing.add(key)
+        try:
+            while True:
+                with self._lock:
+                    batch = self._pending.pop(key, None)
+                    if batch is None or key not in self._seq:
+                        return
+                    seq = self._seq[key]
+                    self._seq[key] = seq + 1
+                self._send(key, seq, batch)
+        finally:
+            with self._lock:
+                self._flushing.discard(key)
+
+    def _flush_later(self, key):
+        self.socketio.sleep(self.window)
+        self.flush(key)
+
+    def _send(self, key, seq, batch):
+        from_id, target = key
+        stream_id = batch['stream_id']
+        if stream_id is not None:
+            # Late joiners get these with the cached offer
+            cache_key = self._key(stream_id)
+            cached = self.store.get(cache_key)
+            if cached is not None:
+                candidates = (cached['candidates'] + batch['candidates'])[
+                    -self.max_candidates:]
+                self.store.set(cache_key, dict(
+                    cached, candidates=candidates,
+                    end=cached.get('end', False) or batch['end']),
+                    ttl=self.ttl)
+        self.socketio.emit('webrtc_ice_candidates', {
+            'from_id': from_id,
+            'candidates': batch['candidates'],
+            'end': batch['end'],
+            'seq': seq,
+        }, to=target, skip_sid=from_id if stream_id is not None else None)
+
+    def _forget(self, sid):
+        """Drop the pending candidates and sequence numbers of `sid`'s
+        pairs"""
+        with self._lock:
+            for key in self._pairs.pop(sid, ()):
+                self._pending.pop(key, None)
+                self._seq.pop(key, None)
+                for other in key:
+                    if other != sid and other in self._pairs:
+                        self._pairs[other].discard(key)
+                        if not self._pairs[other]:
+                            del self._pairs[other]
+
+    def end_stream(self, stream_id, streamer_id=None):
+        if streamer_id is not None:
+            self._forget(streamer_id)
+        for viewer_id, session in list(self.sessions.items()):
+            if session[0] == stream_id:
+                self.sessions.pop(viewer_id, None)
+                self.store.delete(f'signal_session:{viewer_id}')
+        self.store.delete(self._key(stream_id))
+        self.socketio.server.manager.close_room(signal_room(stream_id), '/')
@@ -1,3 +1,20 @@
 #!/bin/bash
 export PORT=${PORT:-8000}
-exec gunicorn --bind 0.0.0.0:$PORT --worker-class eventlet -w 1 --timeout 600 app:app
\ No newline at end of file
+export WORKERS=${WORKERS:-1}
+
+if [ "$WORKERS" -gt 1 ]; then
+    # Workers relay emits through a message queue and share stream/presence
+    # state through a store. Gunicorn has no sticky sessions, so clients are
+    # limited to WebSocket unless told otherwise.
+    if [ -z "$SOCKETIO_MESSAGE_QUEUE" ]; then
+        # Only this user can open the broker's socket
+        BROKER_SOCKET=$(mktemp -d)/broker.sock
+        python local_broker.py --socket "$BROKER_SOCKET" &
+        sleep 1
+        export SOCKETIO_MESSAGE_QUEUE=local://$BROKER_SOCKET
+    fi
+    export STATE_STORE_URL=${STATE_STORE_URL:-sqlite:////tmp/livestream-state.db}
+    export SOCKETIO_TRANSPORTS=${SOCKETIO_TRANSPORTS:-websocket}
+fi
+
+exec gunicorn --bind 0.0.0.0:$PORT --worker-class eventlet -w $WORKERS --timeout 600 app:app
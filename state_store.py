@@ -0,0 +1,217 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class MemoryStateStore:
+    """Process-local state store, used when running a single worker"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _missing(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return True
+        return entry is None
+
+    def get(self, key, default=None):
+        with self._lock:
+            if self._missing(key, time.time()):
+                return default
+            return self._data[key][0]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only if it does not exist yet; returns True on success"""
+        now = time.time()
+        with self._lock:
+            if not self._missing(key, now):
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def get_many(self, keys):
+        """The values of `keys`, in order, None for missing ones"""
+        now = time.time()
+        with self._lock:
+            return [None if self._missing(key, now) else self._data[key][0]
+                    for key in keys]
+
+    def incr(self, key, amount=1):
+        """Add `amount` to the integer at `key` (0 if missing); returns it"""
+        with self._lock:
+            value = 0 if self._missing(key, time.time()) else self._data[key][0]
+            self._data[key] = (value + amount, None)
+            return value + amount
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def scan(self, prefix):
+        """Return a dict of every live key starting with `prefix`"""
+        now = time.time()
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            return {k: self._data[k][0] for k in keys
+                    if not self._missing(k, now)}
+
+
+class SqliteStateStore:
+    """State shared by worker processes on one machine through SQLite (WAL)"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS state ('
+                         'key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        # Expired rows are otherwise only replaced when their key is reused
+        self._db.execute('DELETE FROM state WHERE expires <= ?', (time.time(),))
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM state WHERE key = ? AND '
+                '(expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_many(self, keys):
+        """The values of `keys`, in order, None for missing ones"""
+        keys = list(keys)
+        if not keys:
+            return []
+        with self._lock:
+            rows = dict(self._db.execute(
+                'SELECT key, value FROM state WHERE key IN (%s) AND '
+                '(expires IS NULL OR expires > ?)' % ','.join('?' * len(keys)),
+                (*keys, time.time())).fetchall())
+        return [json.loads(rows[key]) if key in rows else None for key in keys]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)',
+                             (key, json.dumps(value), expires))
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only if it does not exist yet; returns True on success"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('DELETE FROM state WHERE key = ? AND '
+                                 'expires <= ?', (key, now))
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO state VALUES (?, ?, ?)',
+                    (key, json.dumps(value), now + ttl if ttl else None))
+            finally:
+                self._db.execute('COMMIT')
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1):
+        """Add `amount` to the integer at `key` (0 if missing); returns it"""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT value FROM state WHERE key = ? AND '
+                    '(expires IS NULL OR expires > ?)',
+                    (key, time.time())).fetchone()
+                value = (json.loads(row[0]) if row else 0) + amount
+                self._db.execute('INSERT OR REPLACE INTO state VALUES '
+                                 '(?, ?, NULL)', (key, json.dumps(value)))
+            finally:
+                self._db.execute('COMMIT')
+        return value
+
+    def delete(self, *keys):
+        with self._lock:
+            self._db.executemany('DELETE FROM state WHERE key = ?',
+                                 [(key,) for key in keys])
+
+    def scan(self, prefix):
+        """Return a dict of every live key starting with `prefix`"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, value FROM state WHERE substr(key, 1, ?) = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (len(prefix), prefix, time.time())).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+
+class RedisStateStore:
+    """State shared by workers on any number of nodes through Redis"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('Redis state store requested but the redis '
+                               'package is not installed')
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key, default=None):
+        value = self._redis.get(key)
+        return json.loads(value) if value is not None else default
+
+    def get_many(self, keys):
+        """The values of `keys`, in order, None for missing ones"""
+        keys = list(keys)
+        if not keys:
+            return []
+        return [json.loads(value) if value is not None else None
+                for value in self._redis.mget(keys)]
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(key, json.dumps(value), ex=ttl and max(int(ttl), 1))
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only if it does not exist yet; returns True on success"""
+        return bool(self._redis.set(key, json.dumps(value), nx=True,
+                                    ex=ttl and max(int(ttl), 1)))
+
+    def incr(self, key, amount=1):
+        """Add `amount` to the integer at `key` (0 if missing); returns it"""
+        return self._redis.incr(key, amount)
+
+    def delete(self, *keys):
+        if keys:
+            self._redis.delete(*keys)
+
+    def scan(self, prefix):
+        """Return a dict of every live key starting with `prefix`"""
+        keys = list(self._redis.scan_iter(match=prefix + '*'))
+        if not keys:
+            return {}
+        return {key.decode(): json.loads(value)
+                for key, value in zip(keys, self._redis.mget(keys))
+                if value is not None}
+
+
+def create_state_store(url=None):
+    """Build a state store from a URL.
+
+    ``memory://`` (the default) keeps state in this process,
+    ``sqlite:///path/to/file.db`` shares it between processes on one machine
+    and ``redis://host:port/db`` shares it across machines.
+    """
+    if not url or url.startswith('memory://'):
+        return MemoryStateStore()
+    if url.startswith('sqlite:///'):
+        return SqliteStateStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStateStore(url)
+    raise ValueError(f'Unsupported state store URL: {url}')
@@ -0,0 +1,714 @@
+// Stream to watch, from the ?stream= query parameter
+const requestedStreamId = new URLSearchParams(window.location.search).get('stream');
+
+// Enhanced connection with fallback options
+const socket = io({
+    transports: SOCKETIO_TRANSPORTS,
+    upgrade: true,
+    rememberUpgrade: true,
+    timeout: 5000,
+    forceNew: true,
+    // Re-evaluated on reconnect so we rejoin the stream we watch, keep our
+    // place in the waiting room and, as a broadcaster, skip it
+    auth: (cb) => cb({
+        chat_batch: true,
+        stream_id: currentStreamInfo.stream_id || requestedStreamId,
+        ticket: admissionTicket,
+        stream_key: broadcastStreamKey
+    })
+});
+
+const chatBox = document.getElementById('chat-box');
+const statusDiv = document.getElementById('connection-status');
+const viewerCountDiv = document.getElementById('viewer-count');
+const userVideo = document.getElementById('user-video');
+const streamVideo = document.getElementById('stream-video');
+const streamStatus = document.getElementById('stream-status');
+const startBroadcastBtn = document.getElementById('start-broadcast');
+const stopBroadcastBtn = document.getElementById('stop-broadcast');
+const startBtn = document.getElementById('start-camera');
+const stopBtn = document.getElementById('stop-camera');
+const cameraError = document.getElementById('camera-error');
+
+let mediaStream = null;
+// Broadcaster: one peer connection per viewer, keyed by viewer socket id
+let viewerConnections = {};
+let broadcastName = null;
+// Broadcaster in SFU mode: the one connection that uploads to the server
+let sfuConnection = null;
+// Viewer: the connection to the stream's broadcaster, or to the SFU
+let peerConnection = null;
+let webrtcStreamId = null;
+let isBroadcasting = false;
+let currentStreamInfo = { active: false };
+let hlsPlayer = null;
+// Waiting-room ticket from the last refused connection attempt
+let admissionTicket = null;
+// Stream key of our current broadcast, for priority when reconnecting
+let broadcastStreamKey = null;
+
+// WebRTC configuration
+const rtcConfig = {
+    iceServers: [
+        { urls: 'stun:stun.l.google.com:19302' },
+        { urls: 'stun:stun1.l.google.com:19302' }
+    ]
+};
+
+// Broadcasting functions
+async function startBroadcast() {
+    const userName = document.getElementById('user').value.trim() || 'Anonymous';
+
+    try {
+        if (!mediaStream) {
+            await startCamera();
+        }
+
+        // Get RTMP key first
+        const rtmpResponse = await fetch('/stream/rtmp-key');
+        const rtmpData = await rtmpResponse.json();
+
+        const response = await new Promise((resolve) => {
+            socket.emit('start_broadcast', { 
+                user_name: userName,
+                stream_key: rtmpData.stream_key 
+            }, resolve);
+        });
+
+        if (response.success) {
+            isBroadcasting = true;
+            broadcastStreamKey = rtmpData.stream_key;
+            // Handshakes carry it too, so a reconnect isn't shed at a spike
+            socket.io.opts.query = { stream_key: broadcastStreamKey };
+            currentStreamInfo = { active: true, stream_id: response.stream_id };
+            startBroadcastBtn.disabled = true;
+            stopBroadcastBtn.disabled = false;
+            startBroadcastBtn.classList.add('broadcasting');
+
+            // Start WebRTC broadcasting
+            await setupWebRTCBroadcast(userName);
+
+            addMessage('System', 'You are now broadcasting!', 'status');
+        } else {
+            alert(response.message);
+        }
+    } catch (error) {
+        console.error('Error starting broadcast:', error);
+        alert('Failed to start broadcasting');
+    }
+}
+
+async function stopBroadcast() {
+    const response = await new Promise((resolve) => {
+        socket.emit('stop_broadcast', {}, resolve);
+    });
+
+    if (response.success) {
+        isBroadcasting = false;
+        broadcastStreamKey = null;
+        socket.io.opts.query = {};
+        currentStreamInfo = { active: false };
+        startBroadcastBtn.disabled = false;
+        stopBroadcastBtn.disabled = true;
+        startBroadcastBtn.classList.remove('broadcasting');
+
+        // Stop WebRTC
+        Object.values(viewerConnections).forEach(pc => pc.close());
+        viewerConnections = {};
+        if (sfuConnection) {
+            sfuConnection.close();
+            sfuConnection = null;
+        }
+        broadcastName = null;
+
+        addMessage('System', 'Broadcasting stopped', 'status');
+    }
+}
+
+async function setupWebRTCBroadcast(userName) {
+    broadcastName = userName;
+    if (WEBRTC_MODE === 'sfu') {
+        await publishToSFU();
+    }
+    // Otherwise offers are made per viewer, when the server says one has
+    // joined
+}
+
+// The SFU takes complete offers, with every candidate gathered
+function iceGatheringComplete(pc) {
+    if (pc.iceGatheringState === 'complete') {
+        return Promise.resolve();
+    }
+    return new Promise((resolve) => {
+        pc.addEventListener('icegatheringstatechange', () => {
+            if (pc.iceGatheringState === 'complete') {
+                resolve();
+            }
+        });
+    });
+}
+
+async function negotiateWithSFU(pc, event, data) {
+    await pc.setLocalDescription(await pc.createOffer());
+    await iceGatheringComplete(pc);
+    const response = await new Promise((resolve) => {
+        socket.emit(event, { ...data, offer: pc.localDescription }, resolve);
+    });
+    if (!response.success) {
+        throw new Error(response.message);
+    }
+    await pc.setRemoteDescription(response.answer);
+}
+
+async function publishToSFU() {
+    try {
+        sfuConnection = new RTCPeerConnection(rtcConfig);
+        mediaStream.getTracks().forEach(track => {
+            sfuConnection.addTransceiver(track, { direction: 'sendonly' });
+        });
+        await negotiateWithSFU(sfuConnection, 'sfu_publish', {});
+    } catch (error) {
+        console.error('Error publishing to the SFU:', error);
+    }
+}
+
+async function subscribeSFU(streamId) {
+    if (webrtcStreamId === streamId) {
+        return;
+    }
+    closeViewerConnection();
+    webrtcStreamId = streamId;
+    try {
+        const pc = new RTCPeerConnection(rtcConfig);
+        peerConnection = pc;
+        const remoteStream = new MediaStream();
+        pc.addTransceiver('video', { direction: 'recvonly' });
+        pc.addTransceiver('audio', { direction: 'recvonly' });
+        pc.ontrack = (event) => {
+            remoteStream.addTrack(event.track);
+            streamVideo.srcObject = remoteStream;
+            streamVideo.style.display = 'block';
+        };
+        await negotiateWithSFU(pc, 'sfu_subscribe', { stream_id: streamId });
+    } catch (error) {
+        // Not published to the SFU (yet); HLS playback still works
+        console.error('Could not subscribe to the SFU:', error);
+        webrtcStreamId = null;
+    }
+}
+
+// Broadcaster side of a viewer's WebRTC session
+socket.on('webrtc_viewer_joined', async (data) => {
+    if (!isBroadcasting || !mediaStream) {
+        return;
+    }
+    const viewerId = data.viewer_id;
+    try {
+        if (viewerConnections[viewerId]) {
+            viewerConnections[viewerId].close();
+        }
+        const pc = new RTCPeerConnection(rtcConfig);
+        viewerConnections[viewerId] = pc;
+
+        // Add local stream to peer connection
+        mediaStream.getTracks().forEach(track => {
+            pc.addTrack(track, mediaStream);
+        });
+
+        // A null candidate tells the viewer gathering is complete
+        pc.onicecandidate = (event) => {
+            socket.emit('webrtc_ice_candidate', {
+                candidate: event.candidate,
+                target_id: viewerId
+            });
+        };
+
+        // Create and send an offer for this viewer only
+        const offer = await pc.createOffer();
+        await pc.setLocalDescription(offer);
+
+        socket.emit('webrtc_offer', {
+            offer: offer,
+            viewer_id: viewerId,
+            streamer_name: broadcastName
+        });
+    } catch (error) {
+        console.error('Error setting up WebRTC:', error);
+    }
+});
+
+socket.on('webrtc_answer', async (data) => {
+    const pc = viewerConnections[data.viewer_id];
+    if (pc) {
+        try {
+            await pc.setRemoteDescription(new RTCSessionDescription(data.answer));
+        } catch (error) {
+            console.error('Error applying WebRTC answer:', error);
+        }
+    }
+});
+
+socket.on('webrtc_viewer_left', (data) => {
+    const pc = viewerConnections[data.viewer_id];
+    if (pc) {
+        pc.close();
+        delete viewerConnections[data.viewer_id];
+    }
+});
+
+function joinWebRTC(streamId) {
+    if (webrtcStreamId === streamId) {
+        return;
+    }
+    closeViewerConnection();
+    webrtcStreamId = streamId;
+    socket.emit('webrtc_join', { stream_id: streamId }, (response) => {
+        if (!response.success) {
+            console.error('Could not join WebRTC session:', response.message);
+            webrtcStreamId = null;
+        }
+    });
+}
+
+function closeViewerConnection() {
+    if (peerConnection) {
+        peerConnection.close();
+        peerConnection = null;
+    }
+    webrtcStreamId = null;
+}
+
+async function getRTMPInfo() {
+    try {
+        const response = await fetch('/stream/rtmp-key');
+        const data = await response.json();
+
+        const modal = document.getElementById('rtmp-modal');
+        const infoDiv = document.getElementById('rtmp-info');
+
+        infoDiv.innerHTML = `
+            <div class="rtmp-info">
+                <h4>📺 For OBS Studio:</h4>
+                <p><strong>Server:</strong> ${data.rtmp_url}</p>
+                <p><strong>Stream Key:</strong> ${data.stream_key}</p>
+            </div>
+
+            <div class="rtmp-info">
+                <h4>📱 Setup Instructions:</h4>
+                <ol>
+                    <li>Open OBS Studio</li>
+                    <li>Go to Settings → Stream</li>
+                    <li>Service: Custom</li>
+                    <li>Server: <code>${data.rtmp_url}</code></li>
+                    <li>Stream Key: <code>${data.stream_key}</code></li>
+                    <li>Click OK and Start Streaming!</li>
+                </ol>
+            </div>
+
+            <div class="rtmp-info">
+                <h4>🎬 Alternative Software:</h4>
+                <p>You can use any RTMP-compatible software like Streamlabs, XSplit, or mobile apps with these same settings.</p>
+            </div>
+
+            <div class="rtmp-info">
+                <p><strong>Note:</strong> Currently using WebRTC for browser-to-browser streaming. RTMP server integration coming soon!</p>
+            </div>
+        `;
+
+        modal.style.display = 'block';
+    } catch (error) {
+        console.error('Error getting RTMP info:', error);
+        alert('Failed to get RTMP information');
+    }
+}
+
+function closeRTMPModal() {
+    document.getElementById('rtmp-modal').style.display = 'none';
+}
+
+// Camera functions
+async function startCamera() {
+    try {
+        cameraError.style.display = 'none';
+
+        mediaStream = await navigator.mediaDevices.getUserMedia({
+            video: {
+                width: { ideal: 640 },
+                height: { ideal: 480 },
+                facingMode: 'user'
+            },
+            audio: false
+        });
+
+        userVideo.srcObject = mediaStream;
+        startBtn.disabled = true;
+        stopBtn.disabled = false;
+
+        addMessage('System', 'Camera started successfully', 'status');
+
+    } catch (error) {
+        console.error('Error accessing camera:', error);
+        cameraError.style.display = 'block';
+        cameraError.textContent = `Camera error: ${error.message}`;
+        addMessage('System', 'Failed to access camera', 'status');
+    }
+}
+
+function stopCamera() {
+    if (mediaStream) {
+        mediaStream.getTracks().forEach(track => track.stop());
+        mediaStream = null;
+    }
+    userVideo.srcObject = null;
+    startBtn.disabled = false;
+    stopBtn.disabled = true;
+    cameraError.style.display = 'none';
+
+    addMessage('System', 'Camera stopped', 'status');
+}
+
+// Auto-start camera on page load
+window.addEventListener('load', () => {
+    startCamera();
+});
+
+// More detailed connection logging
+socket.on('connect', () => {
+    admissionTicket = null;
+    console.log('Connected to WebSocket server with transport:', socket.io.engine.transport.name);
+    statusDiv.textContent = `Connected (${socket.io.engine.transport.name})`;
+    statusDiv.className = 'connection-status connected';
+
+    // Add a system message
+    addMessage('System', 'Connected to chat', 'status');
+});
+
+socket.on('disconnect', (reason) => {
+    console.log('Disconnected from WebSocket server. Reason:', reason);
+    statusDiv.textContent = `Disconnected (${reason})`;
+    statusDiv.className = 'connection-status disconnected';
+
+    // Add a system message
+    addMessage('System', `Disconnected: ${reason}`, 'status');
+});
+
+// Transport upgrade logging
+socket.io.on('upgrade', () => {
+    console.log('Upgraded to transport:', socket.io.engine.transport.name);
+});
+
+// Handle viewer count updates
+socket.on('viewer_count', (data) => {
+    console.log('Viewer count update:', data.count);
+    const plural = data.count === 1 ? 'viewer' : 'viewers';
+    viewerCountDiv.textContent = `👥 ${data.count} ${plural} online`;
+});
+
+function joinStream(streamId) {
+    socket.emit('join_stream', { stream_id: streamId }, (response) => {
+        if (!response.success) {
+            console.error('Could not join stream:', response.message);
+        }
+    });
+}
+
+// Handle stream events; only lobby sockets hear about new streams
+socket.on('stream_started', (data) => {
+    console.log('Stream started:', data);
+    addMessage('System', data.message, 'status');
+
+    if (!isBroadcasting && !currentStreamInfo.active) {
+        joinStream(data.stream_id);
+    }
+});
+
+socket.on('stream_list', (data) => {
+    if (!isBroadcasting && !currentStreamInfo.active && data.streams.length) {
+        joinStream(data.streams[0].stream_id);
+    }
+});
+
+socket.on('stream_stopped', (data) => {
+    console.log('Stream stopped:', data);
+    if (data.stream_id !== currentStreamInfo.stream_id) {
+        return;
+    }
+    currentStreamInfo = { active: false };
+    socket.emit('leave_stream', {});
+    closeViewerConnection();
+    streamStatus.textContent = 'No one is streaming';
+    streamStatus.className = 'stream-status stream-inactive';
+    streamVideo.style.display = 'none';
+
+    // Clean up HLS player if it exists
+    if (hlsPlayer) {
+        hlsPlayer.destroy();
+        hlsPlayer = null;
+    }
+
+    addMessage('System', data.message, 'status');
+});
+
+socket.on('stream_info', (data) => {
+    currentStreamInfo = data;
+    if (data.active) {
+        streamStatus.textContent = `🔴 LIVE: ${data.streamer_name}`;
+        streamStatus.className = 'stream-status stream-active';
+
+        // HLS only exists while the RTMP server is receiving the stream
+        if (!isBroadcasting && data.playback_id && data.ingest === 'live') {
+            setupHLSPlayback(data.playback_id, data.hls_playlist);
+        }
+        if (!isBroadcasting && data.stream_id &&
+                !data.streamer_id.startsWith('rtmp:')) {
+            if (WEBRTC_MODE === 'sfu') {
+                subscribeSFU(data.stream_id);
+            } else {
+                joinWebRTC(data.stream_id);
+            }
+        }
+    } else {
+        streamStatus.textContent = 'No one is streaming';
+        streamStatus.className = 'stream-status stream-inactive';
+        streamVideo.style.display = 'none';
+    }
+});
+
+socket.on('stream_ingest', (data) => {
+    if (currentStreamInfo) {
+        currentStreamInfo.ingest = data.ingest;
+    }
+    if (!isBroadcasting && data.ingest === 'live') {
+        setupHLSPlayback(data.playback_id, data.hls_playlist);
+    }
+});
+
+// master.m3u8 when the server transcodes an ABR ladder (HLS_ABR=on)
+function setupHLSPlayback(playbackId, playlist = 'index.m3u8') {
+    const hlsUrl = `/live/${playbackId}/${playlist}`;
+
+    console.log('Setting up HLS playback from:', hlsUrl);
+
+    if (Hls.isSupported()) {
+        if (hlsPlayer) {
+            hlsPlayer.destroy();
+        }
+
+        // Low-latency playback kicks in when the playlist has parts
+        // (HLS_LOW_LATENCY=on); otherwise this is plain HLS
+        hlsPlayer = new Hls({ lowLatencyMode: true, backBufferLength: 30 });
+        hlsPlayer.loadSource(hlsUrl);
+        hlsPlayer.attachMedia(streamVideo);
+        hlsPlayer.on(Hls.Events.MANIFEST_PARSED, function() {
+            streamVideo.play().catch(e => console.error('Error playing video:', e));
+            streamVideo.style.display = 'block';
+        });
+
+        hlsPlayer.on(Hls.Events.ERROR, function(event, data) {
+            console.error('HLS Error:', data);
+            if (data.fatal) {
+                switch(data.type) {
+                    case Hls.ErrorTypes.NETWORK_ERROR:
+                        console.error('Fatal network error encountered, trying to recover');
+                        hlsPlayer.startLoad();
+                        break;
+                    case Hls.ErrorTypes.MEDIA_ERROR:
+                        console.error('Fatal media error encountered, trying to recover');
+                        hlsPlayer.recoverMediaError();
+                        break;
+                    default:
+                        console.error('Unrecoverable error encountered');
+                        setupHLSPlayback(playbackId, playlist);
+                        break;
+                }
+            }
+        });
+    } else if (streamVideo.canPlayType('application/vnd.apple.mpegurl')) {
+        // For Safari
+        streamVideo.src = hlsUrl;
+        streamVideo.addEventListener('loadedmetadata', function() {
+            streamVideo.play().catch(e => console.error('Error playing video:', e));
+            streamVideo.style.display = 'block';
+        });
+    } else {
+        console.error('HLS is not supported in this browser');
+    }
+}
+
+// WebRTC handling for viewers
+socket.on('webrtc_offer', async (data) => {
+    if (data.streamer_id !== socket.id) {
+        console.log('Received WebRTC offer from:', data.streamer_name);
+
+        try {
+            if (peerConnection) {
+                peerConnection.close();
+            }
+            const viewerPeerConnection = new RTCPeerConnection(rtcConfig);
+            peerConnection = viewerPeerConnection;
+
+            // Handle incoming stream
+            viewerPeerConnection.ontrack = (event) => {
+                console.log('Received remote stream');
+                streamVideo.srcObject = event.streams[0];
+                streamVideo.style.display = 'block';
+            };
+
+            viewerPeerConnection.onicecandidate = (event) => {
+                socket.emit('webrtc_ice_candidate', {
+                    candidate: event.candidate,
+                    target_id: data.streamer_id
+                });
+            };
+
+            await viewerPeerConnection.setRemoteDescription(new RTCSessionDescription(data.offer));
+            // Candidates the broadcaster gathered before we joined
+            await addIceCandidates(viewerPeerConnection, data.candidates || [],
+                                   data.end_of_candidates);
+            const answer = await viewerPeerConnection.createAnswer();
+            await viewerPeerConnection.setLocalDescription(answer);
+
+            socket.emit('webrtc_answer', {
+                answer: answer,
+                streamer_id: data.streamer_id
+            });
+
+        } catch (error) {
+            console.error('Error handling WebRTC offer:', error);
+        }
+    }
+});
+
+async function addIceCandidates(pc, candidates, end) {
+    try {
+        for (const candidate of candidates) {
+            await pc.addIceCandidate(candidate);
+        }
+        if (end) {
+            await pc.addIceCandidate();
+        }
+    } catch (error) {
+        console.error('Error adding ICE candidate:', error);
+    }
+}
+
+// Candidates arrive in batches, in the order the peer sent them
+socket.on('webrtc_ice_candidates', async (data) => {
+    // From a viewer to the broadcaster, or from the broadcaster to us
+    const pc = viewerConnections[data.from_id] || peerConnection;
+    if (pc) {
+        await addIceCandidates(pc, data.candidates, data.end);
+    }
+});
+
+// Handle status messages
+socket.on('status', (data) => {
+    console.log('Status:', data);
+    addMessage('System', data.msg, 'status');
+});
+
+// Handle chat messages
+socket.on('chat_message', (data) => {
+    console.log('Received message:', data);
+    addMessage(data.user, data.msg);
+});
+
+// Handle batched chat messages
+socket.on('chat_batch', (data) => {
+    data.messages.forEach((msg) => {
+        lastChatId = Math.max(lastChatId, msg.id || 0);
+        addMessage(msg.user, msg.msg);
+    });
+});
+
+// Recent chat replayed on joining a room; after a reconnect to the same
+// room only messages we haven't shown yet are added
+let lastChatId = 0;
+let chatStreamId = null;
+socket.on('chat_history', (data) => {
+    const streamId = currentStreamInfo.stream_id || null;
+    if (streamId !== chatStreamId) {
+        chatStreamId = streamId;
+        lastChatId = 0;
+    }
+    data.messages
+        .filter((msg) => msg.id > lastChatId)
+        .forEach((msg) => addMessage(msg.user, msg.msg));
+    lastChatId = Math.max(lastChatId, ...data.messages.map((msg) => msg.id));
+});
+
+function addMessage(user, msg, type = 'message') {
+    const msgElement = document.createElement('div');
+    msgElement.className = `message ${type}`;
+    // Chat is user input (replayed history included), so never parse it as HTML
+    const userElement = document.createElement('strong');
+    userElement.textContent = `${user}:`;
+    msgElement.append(userElement, ` ${msg}`);
+    chatBox.appendChild(msgElement);
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+function sendMessage(event) {
+    event.preventDefault(); // Prevent form submission
+
+    const user = document.getElementById('user').value.trim();
+    const msg = document.getElementById('message').value.trim();
+
+    if (user && msg) {
+        if (socket.connected) {
+            console.log('Sending message:', {user, msg});
+            socket.emit('chat_message', {user, msg});
+            document.getElementById('message').value = '';
+        } else {
+            alert('Not connected to server. Please wait for reconnection.');
+        }
+    } else {
+        alert('Please enter both name and message');
+    }
+}
+
+// Allow Enter key to send message
+document.getElementById('message').addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') {
+        sendMessage(e);
+    }
+});
+
+// Handle connection errors with more detail
+socket.on('connect_error', (error) => {
+    // A busy server holds us in its waiting room; retry when it suggests
+    if (error.message === 'waiting_room') {
+        const wait = error.data.retry_after;
+        admissionTicket = error.data.ticket || admissionTicket;
+        statusDiv.textContent = error.data.position
+            ? `Server busy: you are number ${error.data.position} in line, retrying in ${wait}s`
+            : `Server busy, retrying in ${wait}s`;
+        statusDiv.className = 'connection-status disconnected';
+        setTimeout(() => socket.connect(), wait * 1000);
+        return;
+    }
+    console.error('Connection error:', error);
+    statusDiv.textContent = `Connection Error: ${error.message}`;
+    statusDiv.className = 'connection-status disconnected';
+    addMessage('System', `Connection error: ${error.message}`, 'status');
+});
+
+// Handle reconnection attempts
+socket.on('reconnect_attempt', (attemptNumber) => {
+    console.log('Reconnection attempt:', attemptNumber);
+    statusDiv.textContent = `Reconnecting... (attempt ${attemptNumber})`;
+    addMessage('System', `Reconnecting... (attempt ${attemptNumber})`, 'status');
+});
+
+socket.on('reconnect', (attemptNumber) => {
+    console.log('Reconnected after', attemptNumber, 'attempts');
+    addMessage('System', `Reconnected after ${attemptNumber} attempts`, 'status');
+});
+
+// Clean up camera on page unload
+window.addEventListener('beforeunload', () => {
+    stopCamera();
+    if (hlsPlayer) {
+        hlsPlayer.destroy();
+    }
+});
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Where vendor scripts come from when build_assets.py has not fetched them
+VENDOR_SOURCES = {
+    'vendor/hls.min.js': 'https://cdn.jsdelivr.net/npm/hls.js@1.5.13/dist/hls.min.js',
+    'vendor/socket.io.min.js': 'https://cdn.socket.io/4.5.4/socket.io.min.js',
+    # Same client with the MessagePack parser, for SOCKETIO_SERIALIZER=msgpack
+    'vendor/socket.io.msgpack.min.js': 'https://cdn.socket.io/4.5.4/socket.io.msgpack.min.js',
+}
+
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'image/svg+xml')
+
+
+class Asset:
+    """An immutable response body with precomputed encodings and ETag"""
+
+    __slots__ = ('body', 'gzip', 'br', 'etag', 'mimetype')
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.gzip = self.br = None
+        if mimetype.startswith(COMPRESSIBLE) and len(body) > 1024:
+            self.gzip = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(body)
+
+    def response(self, cache_control):
+        """Serve the asset, honouring If-None-Match and Accept-Encoding"""
+        headers = {'ETag': f'"{self.etag}"', 'Cache-Control': cache_control,
+                   'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains(self.etag):
+            return Response(status=304, headers=headers)
+
+        body = self.body
+        accepted = request.accept_encodings
+        if self.br is not None and accepted['br']:
+            body = self.br
+            headers['Content-Encoding'] = 'br'
+        elif self.gzip is not None and accepted['gzip']:
+            body = self.gzip
+            headers['Content-Encoding'] = 'gzip'
+        return Response(body, mimetype=self.mimetype, headers=headers)
+
+
+class StaticAssets:
+    """Front-end files loaded once and served under content-hashed names.
+
+    Hashed URLs never change content, so they are cached forever by browsers;
+    a new deploy simply produces new names.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        self.urls = {}
+        self.load()
+
+    def load(self):
+        for folder, _, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    body = f.read()
+                mimetype = mimetypes.guess_type(filename)[0] or \
+                    'application/octet-stream'
+                asset = Asset(body, mimetype)
+                stem, ext = os.path.splitext(name)
+                hashed = f'{stem}.{asset.etag[:10]}{ext}'
+                self.assets[hashed] = asset
+                self.urls[name] = f'/assets/{hashed}'
+
+    def url(self, name):
+        """Public URL for an asset, falling back to its CDN for vendor files"""
+        return self.urls.get(name) or VENDOR_SOURCES[name]
+
+    def response(self, hashed_name):
+        asset = self.assets.get(hashed_name)
+        if asset is None:
+            return Response('Not found', status=404)
+        return asset.response('public, max-age=31536000, immutable')
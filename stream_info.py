@@ -0,0 +1,118 @@
+import time
+
+from flask import Response, jsonify, request
+
+
+class StreamInfo:
+    """Serves /stream/info: one stream's record, or the longest running one.
+
+    Records carry the `version` the registry gave their latest change (0 is
+    the idle state). The response's ETag is the registry's epoch and the
+    version, so pollers can revalidate with If-None-Match and get a 304
+    with no body, and a version reused after a restart never matches.
+    `?wait_version=N` holds the request while the state is still version N,
+    for up to `max_wait` seconds, and answers as soon as it changes; when
+    the wait runs out the unchanged state is answered as usual.
+
+    Held requests sleep on one event, swapped for a fresh one and set on
+    every change. Changes made by this worker set it at once through
+    `notify`; while requests are held, the registry's change marker is read
+    every `poll_interval` seconds to catch those made by other workers.
+    """
+
+    def __init__(self, socketio, registry, idle, max_wait=30,
+                 poll_interval=0.1):
+        self.socketio = socketio
+        self.registry = registry
+        self.idle = dict(idle, version=0)
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.event = socketio.server.eio.create_event()
+        # The latest change marker seen by this worker
+        self.changed = None
+        # (change marker, longest running stream) for requests without an ID
+        self._latest = (None, None)
+        self.held = 0
+        self.woken = 0
+        self.task = None
+
+    def notify(self, changed):
+        """Wake held requests; the registry calls this on every change"""
+        self.changed = changed
+        self._wake()
+
+    def _wake(self):
+        # A fresh event first, so a request can't miss the next change
+        # between waking up and waiting again
+        event = self.event
+        self.event = self.socketio.server.eio.create_event()
+        self.woken += 1
+        event.set()
+
+    def _watch(self):
+        while True:
+            self.socketio.sleep(self.poll_interval)
+            if not self.held:
+                continue
+            changed = self.registry.changed()
+            if changed != self.changed:
+                self.changed = changed
+                self._wake()
+
+    def current(self, stream_id=None, changed=None):
+        """The record a request gets, the idle state, or None if `stream_id`
+        is not live. Without an ID the pick is redone only when the change
+        marker (read from the registry unless given) moved."""
+        if stream_id is not None:
+            return self.registry.get(stream_id)
+        if changed is None:
+            changed = self.registry.changed()
+        if self._latest[1] is None or self._latest[0] != changed:
+            streams = self.registry.list()
+            self._latest = (changed, streams[0] if streams else self.idle)
+        return self._latest[1]
+
+    def _wait(self, stream_id, version, timeout):
+        if not self.held:
+            # Nobody was watching for other workers' changes until now
+            self.changed = self.registry.changed()
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self._watch)
+        deadline = time.monotonic() + timeout
+        self.held += 1
+        try:
+            while True:
+                event = self.event
+                stream = self.current(stream_id, self.changed)
+                remaining = deadline - time.monotonic()
+                if stream is None or stream.get('version', 0) != version or \
+                        remaining <= 0:
+                    return stream
+                event.wait(remaining)
+        finally:
+            self.held -= 1
+
+    def respond(self, stream_id=None):
+        # Malformed values come back as None
+        wait_version = request.args.get('wait_version', type=int)
+        if wait_version is None and 'wait_version' in request.args:
+            return jsonify({'error': 'Bad wait_version'}), 400
+        stream = self.current(stream_id)
+        if wait_version is not None and stream is not None and \
+                stream.get('version', 0) == wait_version:
+            stream = self._wait(stream_id, wait_version, self.max_wait)
+        if stream is None:
+            return jsonify({'error': 'Stream not found'}), 404
+        etag = f"{self.registry.epoch}-{stream.get('version', 0)}"
+        # Clients keep the response but revalidate it before every use
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"',
+                                                 'Cache-Control': 'no-cache'})
+        response = jsonify(stream)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def stats(self):
+        return {'held': self.held, 'woken': self.woken,
+                'changed': self.changed}
@@ -0,0 +1,51 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+
+class StreamKeys:
+    """Stateless, expiring RTMP stream keys.
+
+    A key is ``<expiry>-<nonce>-<signature>``: the expiry as hex Unix time,
+    8 random bytes and the first 16 bytes of an HMAC-SHA256 over both, all
+    in hex so keys stay valid in HLS paths. Any worker holding the secret
+    checks a key with one HMAC, without shared state or lookups.
+
+    A key lets its holder publish, so it is never shown to viewers: they
+    find a stream's HLS under its playback ID, another HMAC of the key that
+    can't be turned back into it.
+    """
+
+    def __init__(self, secret, ttl=24 * 3600):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode(),
+                        hashlib.sha256).hexdigest()[:32]
+
+    def mint(self):
+        payload = f'{int(time.time() + self.ttl):x}-{secrets.token_hex(8)}'
+        return f'{payload}-{self._sign(payload)}'
+
+    def verify(self, key):
+        """Return the key's expiry time if it is genuine and unexpired"""
+        if not isinstance(key, str) or len(key) > 64:
+            return None
+        payload, _, signature = key.rpartition('-')
+        expires, _, nonce = payload.partition('-')
+        try:
+            expires = int(expires, 16)
+        except ValueError:
+            return None
+        # Expired keys are turned away without computing the HMAC
+        if expires < time.time() or not nonce:
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        return expires
+
+    def playback_id(self, key):
+        """Public name of a key's stream, used in its HLS paths"""
+        return self._sign(f'playback:{key}')[:20]
@@ -0,0 +1,148 @@
+import secrets
+import time
+
+LOBBY_ROOM = 'lobby'
+
+
+def stream_room(stream_id):
+    """Socket.IO room holding a stream's broadcaster and viewers"""
+    return f'stream:{stream_id}'
+
+
+class StreamRegistry:
+    """Live streams keyed by stream ID, kept in the shared state store.
+
+    Each broadcaster (socket ID) can run one stream at a time; a reverse
+    `streamer:<sid>` key makes the disconnect cleanup a direct lookup, and
+    `streamkey:<key>` finds the stream an RTMP publish belongs to. Records
+    are sent to viewers, so they hold the stream's playback ID and the
+    stream key is kept apart, under `publishkey:<stream id>`.
+    `broadcaster:<key>` marks a key as broadcasting; it outlives the stream
+    by `reconnect_grace` seconds, so a broadcaster whose connection dropped
+    is still recognised when it comes back.
+
+    `owner:<stream id>` names the worker that started a stream (`owner`).
+    A worker that dies cannot stop its streams, so the others `reap` every
+    stream whose owner is no longer alive.
+
+    Every change gives the record it writes the next `version` from one
+    shared counter, so a version names one state of one stream. After the
+    write, `streams:changed` is set to the new version and `on_change` is
+    called with it; whoever sees the marker move can read the change.
+    Versions start over when the store does (every boot, for the in-process
+    store), so `epoch`, kept next to the counter, tells the runs apart.
+    """
+
+    def __init__(self, store, on_change=None, reconnect_grace=60,
+                 owner=None):
+        self.store = store
+        self.on_change = on_change
+        self.reconnect_grace = reconnect_grace
+        self.owner = owner
+        self.store.add('streams:epoch', secrets.token_urlsafe(6))
+        self.epoch = self.store.get('streams:epoch')
+
+    def start(self, streamer_id, streamer_name, stream_key=None,
+              playback_id=None):
+        """Register a new stream, or return None if `streamer_id` is live"""
+        stream_id = secrets.token_urlsafe(6)
+        if not self.store.add(f'streamer:{streamer_id}', stream_id):
+            return None
+        stream = {
+            'stream_id': stream_id,
+            'active': True,
+            'streamer_id': streamer_id,
+            'streamer_name': streamer_name,
+            'playback_id': playback_id,
+            # 'live' while the RTMP server is receiving the stream key
+            'ingest': None,
+            'started_at': time.time()
+        }
+        # Before the record, so no listed stream is ever without an owner
+        self.store.set(f'owner:{stream_id}', self.owner)
+        if stream_key:
+            self.store.set(f'publishkey:{stream_id}', stream_key)
+            self.store.set(f'streamkey:{stream_key}', stream_id)
+            self.store.set(f'broadcaster:{stream_key}', stream_id)
+        self._save(stream)
+        return stream
+
+    def stop(self, streamer_id):
+        """Remove the stream run by `streamer_id` and return it, if any"""
+        stream = self.get_by_streamer(streamer_id)
+        self.store.delete(f'streamer:{streamer_id}')
+        if stream is not None:
+            self._remove(stream)
+        return stream
+
+    def _remove(self, stream):
+        stream_id = stream['stream_id']
+        self.store.delete(f'stream:{stream_id}', f'owner:{stream_id}')
+        stream_key = self.store.get(f'publishkey:{stream_id}')
+        if stream_key:
+            self.store.delete(f'publishkey:{stream_id}',
+                              f'streamkey:{stream_key}')
+            self.store.set(f'broadcaster:{stream_key}', stream_id,
+                           ttl=self.reconnect_grace)
+        self._changed(self.store.incr('streams:version'))
+
+    def reap(self, live):
+        """Remove the streams of owners not in `live`; returns them"""
+        streams = self.list()
+        owners = self.store.scan('owner:')
+        reaped = []
+        for stream in streams:
+            owner = owners.get(f'owner:{stream["stream_id"]}')
+            if owner == self.owner or owner in live:
+                continue
+            # Every live worker looks; the first to claim a stream removes it
+            if not self.store.add(f'reaping:{stream["stream_id"]}',
+                                  self.owner, ttl=60):
+                continue
+            self.store.delete(f'streamer:{stream["streamer_id"]}')
+            self._remove(stream)
+            reaped.append(stream)
+        return reaped
+
+    def update(self, stream_id, **fields):
+        """Change fields of a live stream; returns the new record"""
+        stream = self.get(stream_id)
+        if stream is None:
+            return None
+        stream.update(fields)
+        self._save(stream)
+        return stream
+
+    def _save(self, stream):
+        stream['version'] = self.store.incr('streams:version')
+        self.store.set(f'stream:{stream["stream_id"]}', stream)
+        self._changed(stream['version'])
+
+    def _changed(self, version):
+        self.store.set('streams:changed', version)
+        if self.on_change is not None:
+            self.on_change(version)
+
+    def changed(self):
+        """The version of the latest change, or None before the first"""
+        return self.store.get('streams:changed')
+
+    def get(self, stream_id):
+        return self.store.get(f'stream:{stream_id}')
+
+    def get_by_streamer(self, streamer_id):
+        stream_id = self.store.get(f'streamer:{streamer_id}')
+        return self.get(stream_id) if stream_id else None
+
+    def get_by_key(self, stream_key):
+        stream_id = self.store.get(f'streamkey:{stream_key}')
+        return self.get(stream_id) if stream_id else None
+
+    def is_broadcaster(self, stream_key):
+        """Whether `stream_key` is live or was within the reconnect grace"""
+        return self.store.get(f'broadcaster:{stream_key}') is not None
+
+    def list(self):
+        """All live streams, oldest first"""
+        streams = self.store.scan('stream:').values()
+        return sorted(streams, key=lambda stream: stream['started_at'])